@@ -1,5 +1,5 @@
 import os
-from TTH.MEAnalysis.MEAnalysis_heppy import sequence
+from TTH.MEAnalysis.MEAnalysis_heppy import sequence, conf
 from TTH.MEAnalysis.samples_base import lfn_to_pfn
 from TTH.MEAnalysis.samples_vhbb import samples
 
@@ -57,6 +57,18 @@ for s in samples:
 
 #finalization of the configuration object.
 from PhysicsTools.HeppyCore.framework.chain import Chain as Events
+
+#Process a seeded random subset of nEvents entries instead of the first ones,
+#with a seed depending on the files and first event of the job, such that
+#the jobs of a sample draw different subsets
+if conf.general.get("sampling", None) != None:
+    from TTH.MEAnalysis.entrylists import make_sampled_chain, job_seed
+    Events = make_sampled_chain(
+        nEvents,
+        job_seed(conf.general["sampling"].get("seed", 1), fns, firstEvent),
+        conf.general["sampling"].get("stratify", None),
+    )
+    firstEvent = 0
 config = cfg.Config(
     #Run across these inputs
     components = inputSamples,
@@ -71,14 +83,34 @@ config = cfg.Config(
     events_class = Events
 )
 
-from PhysicsTools.HeppyCore.framework.looper import Looper
-looper = Looper('Loop',
-    config,
+#Checkpoint the job, such that a job restarted after preemption resumes from
+#the last checkpoint in its working directory instead of starting over
+from TTH.MEAnalysis.looper import MELooper, find_checkpoint, read_checkpoint
+checkpoint_conf = conf.general.get("checkpoint", {})
+kwargs = dict(
     nPrint = 0,
-    firstEvent=firstEvent,
-    nEvents = nEvents
+    firstEvent = firstEvent,
+    nEvents = nEvents,
+    checkpointEvents = checkpoint_conf.get("events", 0),
+    checkpointSeconds = checkpoint_conf.get("seconds", 0),
+    statusSeconds = conf.general.get("monitor", {}).get("seconds", 0),
+    memoryCheck = conf.general.get("memoryCheck", None),
 )
-
-looper.loop()
-looper.write()
-
+previous = find_checkpoint('Loop')
+
+#Use all the cores of the worker node, NUM_SHARDS overrides the configuration
+nShards = int(os.environ.get("NUM_SHARDS", conf.general.get("shards", 1)))
+if previous != None and read_checkpoint(previous)["complete"]:
+    print "job is complete in {0}".format(previous)
+elif nShards > 1:
+    from TTH.MEAnalysis.parallel import run_sharded
+    if previous != None:
+        print "sharded jobs are not resumed, processing again"
+    run_sharded('Loop', config, nShards, **kwargs)
+else:
+    if previous != None:
+        kwargs["resumeFrom"] = previous
+    looper = MELooper('Loop', config, **kwargs)
+
+    looper.loop()
+    looper.write()
@@ -71,6 +71,13 @@ class Conf:
                 "CSVT": ("btagCSV", 0.941)
             },
 
+            #Scan of the b-tagging working point: the number of selected jets with the
+            #discriminator above each threshold is stored per event in the btag_scan_n array
+            #"btagScan": ("btagCSV", [0.05 * i for i in range(20)]),
+
+            #The W-tag looks for the pair of untagged jets with the invariant mass closest to this
+            "Wmass": 80.0,
+
             #if btagCSV, untagged/tagged selection for W mass and MEM is done by CSVM cut
             #if btagLR, selection is done by the btag likelihood ratio permutation
             "untaggedSelection": "btagCSV"
@@ -88,7 +95,119 @@ class Conf:
             #"verbosity": ["eventboundary", "input", "matching", "gen", "reco"],
             "verbosity": [],
 
-            #Process only these events (will scan through file to find)
+            #Write the time and pass rate of every analyzer to profile.json and
+            #profile.csv in its directory at the end of the job (see profiling.py),
+            #used by "scheduling" and for the analyzer rates of "monitor"
+            "profile": False,
+
+            #If > 0, read the input collections in blocks of this many entries
+            #into numpy arrays instead of particle-by-particle, and select the
+            #blocks with the vectorized analyzers (process_batch)
+            "batchSize": 0,
+
+            #Read the input collections only when an analyzer first uses them
+            "lazyCollections": False,
+
+            #Disable the input branches that are not declared as read by
+            #the analyzers (input_branches) or the tree producer (inputBranches)
+            "pruneBranches": False,
+
+            #TTreeCache for the input files, see TTH.MEAnalysis.treecache
+            #size in bytes (0 disables the cache), entries in the learning phase
+            #and asynchronous prefetching of the next cache block
+            #"treeCache": {
+            #    "size": 30 * 1024 * 1024,
+            #    "learnEntries": 100,
+            #    "asyncPrefetch": True,
+            #},
+
+            #Copy the input files to a local disk cache before reading them,
+            #the next file is copied while the current one is processed.
+            #Files are evicted least-recently-used above quota (bytes).
+            #"fileCache": {
+            #    "dir": "/scratch/{0}/filecache".format(os.environ["USER"]),
+            #    "quota": 50 * 1024**3,
+            #    "ahead": 1,
+            #    #size, checksum and entries of all the input files (required),
+            #    #written with python filecache.py --catalog
+            #    "catalog": "/scratch/{0}/filecache/catalog.json".format(os.environ["USER"]),
+            #},
+
+            #Read the samples from columnar stores in this directory, one
+            #subdirectory per sample nickname, converted once with
+            #python columnstore.py --out DIR/nickName file1.root ...
+            #"columnStore": "/scratch/{0}/columnstore".format(os.environ["USER"]),
+
+            #Read only the entries passing the lepton and jet selection, as
+            #stored by MEAnalysis_skim.py for the same Conf.leptons and jet pt, eta cuts
+            #"skim": {
+            #    "dir": "/scratch/{0}/skim".format(os.environ["USER"]),
+            #},
+
+            #Save the output and counters every N events or T seconds, such
+            #that an interrupted job can be continued with
+            #python MEAnalysis_heppy.py --resume
+            #"checkpoint": {
+            #    "events": 500,
+            #    "seconds": 900,
+            #},
+
+            #Store the results of the analyzers before the MEM (selected
+            #jets and leptons, b-tag LR, category, W mass, gen matching) in
+            #DIR/<sample>/*.npz. With memOnly, restore them from these files
+            #and run only the MEM and the tree producer, e.g. to rerun with
+            #other mem["methodsToRun"] (see sidecar.py)
+            #"sidecar": {
+            #    "dir": "/scratch/{0}/sidecar".format(os.environ["USER"]),
+            #    "memOnly": False,
+            #},
+
+            #Write the progress (event rates, ETA, MEM calls per second) to
+            #status.json and status.prom in the job directory every N seconds,
+            #python watch_jobs.py shows the status of all the local jobs
+            #"monitor": {
+            #    "seconds": 30,
+            #},
+
+            #Sample the memory use every N events and warn if it grows
+            #linearly with the events, with the ROOT object counts by class
+            #and the python allocation sites (tracemalloc frames, if
+            #available) which grow most, see memcheck.py
+            #"memoryCheck": {
+            #    "events": 1000,
+            #    "rootObjects": True,
+            #    "tracemalloc": 0,
+            #},
+
+            #Split the entries of each job across this many worker
+            #processes on the same node, the outputs and counters are
+            #merged in entry order (see parallel.py)
+            "shards": 1,
+
+            #Number of samples processed concurrently by MEAnalysis_heppy.py,
+            #each in its own process and looper directory, with a summary
+            #in components.json (also set with --parallel N)
+            "parallelComponents": 1,
+
+            #Reorder the analyzers by their declared dependencies (consumes,
+            #produces), running first those with the lowest time per rejected
+            #event in the profiles (profile.json) of a previous job run with "profile"
+            #"scheduling": {
+            #    "profileDir": "Loop_tth_13tev",
+            #},
+
+            #Process a reproducible random subset of nEvents entries spread
+            #over all the files, sampled in proportion in each bin of the
+            #stratify expression (optional)
+            #"sampling": {
+            #    "nEvents": 1000,
+            #    "seed": 1,
+            #    "stratify": "nJet",
+            #},
+
+            #Process only these events, found with per-file (run, lumi, evt)
+            #indices which are built once in eventIndexDir (see entrylists.py)
+            #"eventIndexDir": "/scratch/{0}/eventindex".format(os.environ["USER"]),
             #"eventWhitelist": [
             #    (1, 1201, 120035),
             #    #(1, 626, 62574),
@@ -107,6 +226,10 @@ class Conf:
             "MECategories": ["cat1", "cat2", "cat3", "cat6"],
             #"MECategories": ["cat1"],
 
+            #Reject the events outside of MECategories or without cat_btag H
+            #in MECategoryAnalyzer, e.g. if only the ME results are needed
+            #"selectCategories": True,
+
             #If bLR > cut, calculate ME
             #only used if untaggedSelection=btagLR
             "btagLRCut": {
@@ -53,6 +53,8 @@ from TTH.MEAnalysis.VHbbTree import *
 evs = cfg.Analyzer(
     EventAnalyzer,
     'events',
+    batchSize = conf.general.get("batchSize", 0),
+    lazy = conf.general.get("lazyCollections", False),
 )
 
 #Here we define all the main analyzers
@@ -179,11 +181,23 @@ delRType = NTupleObjectType("delRType", variables = [
     NTupleVariable("delR", lambda x : x.delR),
 ])
 
+#number of selected jets above a threshold of the b-tag scan, see Conf.jets["btagScan"]
+btagScanType = NTupleObjectType("btagScanType", variables = [
+    NTupleVariable("n", lambda x : x, type=int),
+])
+
 #Create the output TTree writer
+#Profile the time spent filling the output tree as for the FilterAnalyzers
+from TTH.MEAnalysis.profiling import profiled
 treeProducer = cfg.Analyzer(
-    class_object = AutoFillTreeProducer,
+    class_object = profiled(AutoFillTreeProducer) if conf.general.get("profile", False) else AutoFillTreeProducer,
     verbose = False,
     vectorTree = True,
+    #branches of the input tree read by fillCoreVariables and globalVariables
+    inputBranches = [
+        "run", "lumi", "evt", "xsec", "nTrueInt", "puWeight", "genWeight",
+        "numJets", "lheNj", "lheNb", "lheNc", "lheNg"
+    ],
     globalVariables = [
         NTupleVariable(
             "Wmass", lambda ev: ev.Wmass,
@@ -396,6 +410,11 @@ treeProducer = cfg.Analyzer(
 )
 
 
+if conf.jets.get("btagScan", None) != None:
+    treeProducer.collections["btag_scan"] = NTupleCollection("btag_scan", btagScanType,
+        len(conf.jets["btagScan"][1]), help="Selected jets above each b-tag scan threshold"
+    )
+
 #Override the default fillCoreVariables function, which
 #by default looks for FWLite variables
 #FIXME: this is a hack to run heppy on non-EDM formats. Better to propagate it to heppy
@@ -421,6 +440,61 @@ sequence = cfg.Sequence([
     treeProducer
 ])
 
+#Store the results of the analyzers before the MEM in sidecar files, or in the MEM-only
+#mode, restore them from the sidecar files and run only the MEM and the tree producer
+memOnly = False
+if conf.general.get("sidecar", None) != None:
+    memOnly = conf.general["sidecar"].get("memOnly", False)
+    if memOnly:
+        sidecar_reader = cfg.Analyzer(
+            MECoreAnalyzers.SidecarReaderAnalyzer,
+            'sidecar',
+            _conf = conf
+        )
+        sequence[:] = [evs, sidecar_reader, mem_analyzer, treeProducer]
+    else:
+        sidecar_writer = cfg.Analyzer(
+            MECoreAnalyzers.SidecarWriterAnalyzer,
+            'sidecar',
+            _conf = conf
+        )
+        last = mem_analyzer if mem_analyzer in sequence else treeProducer
+        sequence.insert(sequence.index(last), sidecar_writer)
+
+#Check that the event attributes used by the analyzers are produced earlier in the sequence
+#and optionally run the cheap, rejecting filters first, using the profiles of a previous job
+from TTH.MEAnalysis.scheduling import validate_sequence, schedule_sequence, load_profiles
+for ana in sequence:
+    ana.profile = conf.general.get("profile", False)
+validate_sequence(sequence)
+if conf.general.get("scheduling", None) != None:
+    sequence[:] = schedule_sequence(sequence,
+        load_profiles(conf.general["scheduling"].get("profileDir", None))
+    )
+    print "Scheduled sequence:", [ana.name for ana in sequence]
+
+#Read the samples from their columnar stores (see columnstore.py) instead of the ntuples
+if conf.general.get("columnStore", None) != None:
+    for samp in inputSamples:
+        samp.files = [os.path.join(conf.general["columnStore"], samp.name)]
+
+#Configure the read cache for the input files
+if conf.general.get("treeCache", None) != None and conf.general.get("columnStore", None) is None:
+    sequence.insert(0, cfg.Analyzer(
+        MECoreAnalyzers.TreeCacheAnalyzer,
+        'treecache',
+        _conf = conf
+    ))
+
+#Disable the input branches which are not read by the sequence
+if conf.general.get("pruneBranches", False) and conf.general.get("columnStore", None) is None:
+    sequence.insert(0, cfg.Analyzer(
+        MECoreAnalyzers.BranchSelectionAnalyzer,
+        'branchsel',
+        _conf = conf,
+        analyzers = list(sequence)
+    ))
+
 #Book the output file
 from PhysicsTools.HeppyCore.framework.services.tfile import TFileService
 output_service = cfg.Service(
@@ -433,6 +507,62 @@ output_service = cfg.Service(
 
 #finalization of the configuration object.
 from PhysicsTools.HeppyCore.framework.chain import Chain as Events
+
+#Each of these options reads the input with its own events class, which do not compose
+events_options = [k for k in ["fileCache", "skim", "sampling", "eventWhitelist", "columnStore"]
+    if conf.general.get(k, None) != None
+]
+if memOnly and conf.general.get("eventWhitelist", None) is None:
+    events_options += ["sidecar memOnly"]
+if len(events_options) > 1:
+    raise ValueError("Conf.general options {0} cannot be combined, enable only one".format(
+        ", ".join(events_options))
+    )
+
+#Read the input files through the local file cache
+if conf.general.get("fileCache", None) != None:
+    from TTH.MEAnalysis.filecache import make_cached_chain
+    Events = make_cached_chain(
+        conf.general["fileCache"]["dir"],
+        conf.general["fileCache"]["quota"],
+        conf.general["fileCache"].get("ahead", 1),
+        conf.general["fileCache"].get("catalog", None),
+    )
+
+#Read only the entries which passed the skim stage (MEAnalysis_skim.py) with the same selection
+if conf.general.get("skim", None) != None:
+    from TTH.MEAnalysis.entrylists import make_skimmed_chain, selection_hash
+    Events = make_skimmed_chain(conf.general["skim"]["dir"], selection_hash(conf))
+
+#Read a seeded, optionally stratified random subset of the entries of all files
+if conf.general.get("sampling", None) != None:
+    from TTH.MEAnalysis.entrylists import make_sampled_chain
+    Events = make_sampled_chain(
+        conf.general["sampling"]["nEvents"],
+        conf.general["sampling"].get("seed", 1),
+        conf.general["sampling"].get("stratify", None),
+    )
+
+#Seek directly to the whitelisted events using the per-file event indices
+if conf.general.get("eventWhitelist", None) != None:
+    from TTH.MEAnalysis.entrylists import make_eventid_chain
+    Events = make_eventid_chain(
+        conf.general.get("eventIndexDir", "eventindex"),
+        conf.general["eventWhitelist"]
+    )
+
+#In the MEM-only mode, read only the events stored in the sidecar files
+if memOnly and conf.general.get("eventWhitelist", None) is None:
+    from TTH.MEAnalysis.entrylists import make_eventid_chain
+    from TTH.MEAnalysis.sidecar import sidecar_event_ids
+    Events = make_eventid_chain(
+        conf.general.get("eventIndexDir", "eventindex"),
+        sidecar_event_ids(conf.general["sidecar"]["dir"], [samp.name for samp in inputSamples])
+    )
+
+if conf.general.get("columnStore", None) != None:
+    from TTH.MEAnalysis.columnstore import ColumnStoreEvents as Events
+
 config = cfg.Config(
     #Run across these inputs
     components = inputSamples,
@@ -448,9 +578,33 @@ config = cfg.Config(
 )
 
 if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Runs the MEAnalysis heppy main loop")
+    parser.add_argument("--resume", action="store_true",
+        help="resume the interrupted jobs from their last checkpoint, skip the completed samples"
+    )
+    parser.add_argument("--parallel", type=int, default=conf.general.get("parallelComponents", 1),
+        help="number of samples processed concurrently, each in its own process"
+    )
+    args = parser.parse_args()
+
     print "Running MEAnalysis heppy main loop"
 
+    from TTH.MEAnalysis.looper import MELooper, find_checkpoint, read_checkpoint
+    checkpoint_conf = conf.general.get("checkpoint", {})
+    monitor_conf = conf.general.get("monitor", {})
+
+    #(looper name, configuration, looper arguments) of the samples to process
+    jobs = []
     for samp in inputSamples:
+        kwargs = {}
+        if args.resume:
+            previous = find_checkpoint('Loop_'+samp.name)
+            if previous != None and read_checkpoint(previous)["complete"]:
+                print "sample {0} is complete in {1}".format(samp.name, previous)
+                continue
+            kwargs["resumeFrom"] = previous
+
         print "processing sample ", samp
         config = cfg.Config(
             #Run across these inputs
@@ -465,17 +619,42 @@ if __name__ == "__main__":
             #This defines how events are loaded
             events_class = Events
         )
-        from PhysicsTools.HeppyCore.framework.looper import Looper
         nEvents = samp.perJob
 
 
-        kwargs = {}
-        if conf.general.get("eventWhitelist", None) is None:
+        if (conf.general.get("eventWhitelist", None) is None and
+            conf.general.get("sampling", None) is None and not memOnly):
             kwargs["nEvents"] = nEvents
-        looper = Looper(
-            'Loop_'+samp.name,
-            config,
+        kwargs.update(
             nPrint = 0,
+            checkpointEvents = checkpoint_conf.get("events", 0),
+            checkpointSeconds = checkpoint_conf.get("seconds", 0),
+            statusSeconds = monitor_conf.get("seconds", 0),
+            memoryCheck = conf.general.get("memoryCheck", None),
+        )
+
+        jobs += [('Loop_'+samp.name, config, kwargs)]
+
+    #process the samples concurrently, the largest first
+    if args.parallel > 1:
+        from TTH.MEAnalysis.parallel import run_components
+        if conf.general.get("shards", 1) > 1:
+            print "samples processed concurrently are not sharded"
+        run_components(jobs, args.parallel)
+        jobs = []
+
+    for (name, config, kwargs) in jobs:
+        #split the entries of the sample across worker processes
+        if conf.general.get("shards", 1) > 1:
+            from TTH.MEAnalysis.parallel import run_sharded
+            if kwargs.pop("resumeFrom", None) != None:
+                print "sharded jobs are not resumed, processing {0} again".format(name)
+            run_sharded(name, config, conf.general["shards"], **kwargs)
+            continue
+
+        looper = MELooper(
+            name,
+            config,
             **kwargs
         )
 
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+"""
+Skim stage: runs the lepton and jet selection over the complete input
+files of the samples and stores the passing entries as entry lists in
+Conf.general["skim"]["dir"]. MEAnalysis_heppy.py then reads only these
+entries, as long as Conf.leptons and the jet pt and eta cuts are unchanged.
+
+Usage:
+ME_CONF=/path/to/conffile.py python MEAnalysis_skim.py
+"""
+import PhysicsTools.HeppyCore.framework.config as cfg
+from PhysicsTools.HeppyCore.framework.chain import Chain
+from PhysicsTools.HeppyCore.framework.looper import Looper
+
+from TTH.MEAnalysis.MEAnalysis_heppy import conf, inputSamples, evs, leps, jets
+import TTH.MEAnalysis.MECoreAnalyzers as MECoreAnalyzers
+
+skim_recorder = cfg.Analyzer(
+    MECoreAnalyzers.SkimRecorderAnalyzer,
+    'skim',
+    _conf = conf
+)
+
+sequence = cfg.Sequence([
+    evs,
+    leps,
+    jets,
+    skim_recorder,
+])
+
+if __name__ == "__main__":
+    if conf.general.get("skim", None) is None:
+        raise ValueError("Conf.general[\"skim\"] must specify the entry list directory")
+
+    for samp in inputSamples:
+        print "skimming sample ", samp
+        config = cfg.Config(
+            components = [samp],
+            sequence = sequence,
+            services = [],
+            events_class = Chain
+        )
+        looper = Looper('Skim_'+samp.name, config, nPrint = 0)
+        looper.loop()
+        looper.write()
@@ -1,24 +1,58 @@
 import ROOT
+import bisect
+import heapq
 import itertools
 from PhysicsTools.HeppyCore.framework.analyzer import Analyzer
+from TTH.MEAnalysis.kinematics import Kinematics
+from TTH.MEAnalysis.treecache import ReadStats, enable_async_prefetch, configure_cache, cache_efficiency
+from TTH.MEAnalysis.profiling import profile_process
 import copy
+import json
+import os
 
-import sys
+import numpy as np
 
-#Load the MEM integrator libraries
-# ROOT.gSystem.Load("libFWCoreFWLite")
-# ROOT.gROOT.ProcessLine('AutoLibraryLoader::enable();')
-# ROOT.gSystem.Load("libFWCoreFWLite")
-ROOT.gSystem.Load("libCintex")
-ROOT.gROOT.ProcessLine('ROOT::Cintex::Cintex::Enable();')
-ROOT.gSystem.Load("libTTHMEIntegratorStandalone")
+import sys
 
-from ROOT import MEM
-o = MEM.MEMOutput
+#The MEM integrator namespace and the shorthands for the permutation and
+#integration variable vectors, set by load_mem_libraries
+MEM = None
+CvectorPermutations = None
+CvectorPSVar = None
 
-#Pre-define shorthands for permutation and integration variable vectors
-CvectorPermutations = getattr(ROOT, "std::vector<MEM::Permutations::Permutations>")
-CvectorPSVar = getattr(ROOT, "std::vector<MEM::PSVar::PSVar>")
+def load_mem_libraries():
+    """
+    Loads the MEM integrator libraries on first use, such that importing
+    this module and configuring jobs without the MEM calculation is fast.
+    """
+    global MEM, CvectorPermutations, CvectorPSVar
+    if MEM != None:
+        return MEM
+    # ROOT.gSystem.Load("libFWCoreFWLite")
+    # ROOT.gROOT.ProcessLine('AutoLibraryLoader::enable();')
+    # ROOT.gSystem.Load("libFWCoreFWLite")
+    ROOT.gSystem.Load("libCintex")
+    ROOT.gROOT.ProcessLine('ROOT::Cintex::Cintex::Enable();')
+    ROOT.gSystem.Load("libTTHMEIntegratorStandalone")
+
+    MEM = ROOT.MEM
+    CvectorPermutations = getattr(ROOT, "std::vector<MEM::Permutations::Permutations>")
+    CvectorPSVar = getattr(ROOT, "std::vector<MEM::PSVar::PSVar>")
+    return MEM
+
+class EmptyMEMOutput(object):
+    """
+    Result stored for the MEM hypotheses if the calculation is disabled,
+    with the fields of MEM.MEMOutput read by the tree producer.
+    """
+    def __init__(self):
+        self.p = 0.0
+        self.p_err = 0.0
+        self.chi2 = 0.0
+        self.time = 0.0
+        self.error_code = 0
+        self.efficiency = 0.0
+        self.num_perm = 0
 
 def lvec(self):
     """
@@ -33,16 +67,360 @@ class FilterAnalyzer(Analyzer):
     """
     A generic analyzer that may filter events.
     Counts events the number of processed and passing events.
+
+    input_branches (list of str): branches of the input tree which the
+        analyzer reads directly from event.input, see BranchSelectionAnalyzer
+    consumes, produces (list of str): event attributes which the analyzer
+        reads and sets, None if undeclared, see TTH.MEAnalysis.scheduling
+
+    The wall and CPU time of the process calls, their latency histogram and
+    the slowest events are written to profile.json and profile.csv at
+    endLoop (see TTH.MEAnalysis.profiling) if cfg_ana.profile is True.
+
+    Analyzers may implement process_batch, which selects a block of events
+    at once (see columnar.run_batch): the events of the batch are not passed
+    to process, count_batch increments their counters and fill_event sets
+    the attributes of the passing events instead. The batch versions are
+    not used with Conf.general["verbosity"], which prints from process.
     """
+    input_branches = []
+    consumes = None
+    produces = None
+
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        super(FilterAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        conf = getattr(cfg_ana, "_conf", None)
+        verbose = conf != None and len(conf.general.get("verbosity", [])) > 0
+        if type(self).process_batch.im_func is not FilterAnalyzer.process_batch.im_func and not verbose:
+            from TTH.MEAnalysis.columnar import run_batch
+            process = self.process
+            self.process = lambda event: run_batch(self, process, event)
+        self.profile = None
+        if getattr(cfg_ana, "profile", False):
+            self.profile = profile_process(self)
+
+    def process_batch(self, batch):
+        """
+        Returns the boolean array of the events of the columnar.EventBatch
+        which pass the analyzer, or None if there is no batch version. The
+        per-event results for later analyzers are stored in batch.values.
+        """
+        return None
+
+    def count_batch(self, batch, index):
+        """
+        Increments the counters for the event index of the batch as process
+        would. Analyzers with more counters than processed/passes extend it.
+        """
+        self.counters["processing"].inc("processed")
+        if batch.masks[self.name][index]:
+            self.counters["processing"].inc("passes")
+
+    def fill_event(self, event, batch, index):
+        """
+        Sets the attributes of process for the event index of the batch,
+        which passed process_batch, from batch.values.
+        """
+        raise NotImplementedError("{0} has no fill_event".format(self.name))
+
     def beginLoop(self, setup):
         super(FilterAnalyzer, self).beginLoop(setup)
         self.counters.addCounter("processing")
         self.counters["processing"].register("processed")
         self.counters["processing"].register("passes")
 
+    def endLoop(self, setup):
+        super(FilterAnalyzer, self).endLoop(setup)
+        if self.profile != None:
+            self.profile.write(self.dirName)
+
+class BranchSelectionAnalyzer(FilterAnalyzer):
+    """
+    Disables all the branches of the input tree that are not read by the
+    analyzers in the sequence, such that ROOT does not decompress them.
+
+    Configuration:
+    cfg_ana.analyzers (list of cfg.Analyzer): the sequence, the branches to
+        read are the union of class_object.input_branches and the
+        inputBranches attribute of the analyzer configurations.
+
+    The number of bytes read and avoided (compressed size) are counted in
+    the "branches" counter.
+    """
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        super(BranchSelectionAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        self.conf = cfg_ana._conf
+        self.branches = set([])
+        for ana in cfg_ana.analyzers:
+            self.branches.update(getattr(ana.class_object, "input_branches", []))
+            self.branches.update(getattr(ana, "inputBranches", []))
+        self.tree = None
+        self.tree_number = -1
+
+    def beginLoop(self, setup):
+        super(BranchSelectionAnalyzer, self).beginLoop(setup)
+        self.counters.addCounter("branches")
+        for c in ["enabled", "disabled", "bytes_read", "bytes_avoided"]:
+            self.counters["branches"].register(c)
+        self.bytes_read = 0.0
+        self.bytes_avoided = 0.0
+
+    def select_branches(self, tree):
+        """
+        Sets the branch status of tree and stores the number and the
+        compressed size per entry of the enabled and disabled branches of
+        the current file.
+        """
+        tree.SetBranchStatus("*", False)
+        for br in self.branches:
+            if tree.GetBranch(br) == None:
+                print "BranchSelection: branch {0} not in input tree".format(br)
+                continue
+            tree.SetBranchStatus(br, True)
+
+        #The currently loaded TTree in case of a TChain
+        t = tree.GetTree()
+        nentries = max(float(t.GetEntries()), 1.0)
+        self.n_enabled = 0
+        self.n_disabled = 0
+        self.size_enabled = 0.0
+        self.size_disabled = 0.0
+        for br in t.GetListOfBranches():
+            if tree.GetBranchStatus(br.GetName()):
+                self.n_enabled += 1
+                self.size_enabled += br.GetZipBytes("*") / nentries
+            else:
+                self.n_disabled += 1
+                self.size_disabled += br.GetZipBytes("*") / nentries
+
+    def process(self, event):
+        self.counters["processing"].inc("processed")
+
+        tree = event.input
+        #set the branch status again when a new file is opened
+        tree_number = tree.GetTreeNumber()
+        if tree is not self.tree or tree_number != self.tree_number:
+            self.tree = tree
+            self.tree_number = tree_number
+            self.select_branches(tree)
+            print "BranchSelection: reading {0} of {1} branches, {2:.0f} of {3:.0f} bytes per entry".format(
+                self.n_enabled, self.n_enabled + self.n_disabled,
+                self.size_enabled, self.size_enabled + self.size_disabled
+            )
+        self.bytes_read += self.size_enabled
+        self.bytes_avoided += self.size_disabled
+
+        self.counters["processing"].inc("passes")
+        return True
+
+    def endLoop(self, setup):
+        super(BranchSelectionAnalyzer, self).endLoop(setup)
+        if self.tree != None:
+            self.counters["branches"].inc("enabled", self.n_enabled)
+            self.counters["branches"].inc("disabled", self.n_disabled)
+        self.counters["branches"].inc("bytes_read", int(self.bytes_read))
+        self.counters["branches"].inc("bytes_avoided", int(self.bytes_avoided))
+        print "BranchSelection: read {0:.1f} MB, avoided reading {1:.1f} MB".format(
+            self.bytes_read / 1024.0**2, self.bytes_avoided / 1024.0**2
+        )
+
+class TreeCacheAnalyzer(FilterAnalyzer):
+    """
+    Sets up the TTreeCache with a learning phase and asynchronous prefetch
+    for the input tree, see TTH.MEAnalysis.treecache.
+
+    Configuration:
+    Conf.general["treeCache"] (dict): size, learnEntries, asyncPrefetch
+
+    Writes the bytes read, the read calls and the cache hit rate of the job
+    to readstats.json at endLoop.
+    """
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        super(TreeCacheAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        self.conf = cfg_ana._conf
+        self.cache_conf = self.conf.general.get("treeCache", {})
+        #The input files are opened by the looper after the analyzers are created
+        enable_async_prefetch(self.cache_conf.get("asyncPrefetch", True))
+        self.stats = ReadStats()
+        self.tree = None
+        self.tree_number = -1
+        self.nentries_file = 0
+        self.efficiency = None
+
+    def beginLoop(self, setup):
+        super(TreeCacheAnalyzer, self).beginLoop(setup)
+        self.counters.addCounter("read")
+        self.counters["read"].register("bytes_read")
+        self.counters["read"].register("read_calls")
+        self.stats.begin()
+
+    def process(self, event):
+        self.counters["processing"].inc("processed")
+
+        tree = event.input
+        tree_number = tree.GetTreeNumber()
+        if tree is not self.tree or tree_number != self.tree_number:
+            #The previous file is already closed, use its last efficiency
+            if self.tree != None:
+                self.stats.file_done(self.efficiency, self.nentries_file)
+            #A TChain keeps the cache settings for the next files
+            if tree is not self.tree:
+                configure_cache(tree, self.cache_conf)
+            self.tree = tree
+            self.tree_number = tree_number
+            self.nentries_file = 0
+            self.efficiency = None
+        self.nentries_file += 1
+        if self.nentries_file % 100 == 0:
+            self.efficiency = cache_efficiency(tree)
+
+        self.counters["processing"].inc("passes")
+        return True
+
+    def endLoop(self, setup):
+        super(TreeCacheAnalyzer, self).endLoop(setup)
+        if self.tree != None:
+            self.stats.file_done(cache_efficiency(self.tree), self.nentries_file)
+        summary = self.stats.summary()
+        self.counters["read"].inc("bytes_read", summary["bytes_read"])
+        self.counters["read"].inc("read_calls", summary["read_calls"])
+        print "TreeCache:", summary
+        of = open(os.path.join(self.dirName, "readstats.json"), "w")
+        of.write(json.dumps(summary, indent=2))
+        of.close()
+
+class SkimRecorderAnalyzer(FilterAnalyzer):
+    """
+    Records the entries of the input files which reach this analyzer and
+    stores them at endLoop as entry lists, see TTH.MEAnalysis.entrylists.
+    Must run over the complete component files, as in MEAnalysis_skim.py.
+    The input must be a TChain (the heppy Chain), whose tree number gives
+    the file of the entry, other events classes are rejected.
+
+    Configuration:
+    Conf.general["skim"]["dir"] (str): directory of the entry lists
+    """
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        super(SkimRecorderAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        self.conf = cfg_ana._conf
+        from TTH.MEAnalysis.entrylists import EntryListCache, selection_hash
+        self.cache = EntryListCache(self.conf.general["skim"]["dir"])
+        self.selection = selection_hash(self.conf)
+
+    def beginLoop(self, setup):
+        super(SkimRecorderAnalyzer, self).beginLoop(setup)
+        #tree number in the chain -> passing local entries
+        self.entries = {}
+
+    def process(self, event):
+        self.counters["processing"].inc("processed")
+        tree = event.input
+        if not isinstance(tree, ROOT.TChain):
+            raise ValueError("SkimRecorderAnalyzer needs a TChain input to find the file of the entries, got {0}".format(
+                type(tree).__name__)
+            )
+        tree_number = tree.GetTreeNumber()
+        if not self.entries.has_key(tree_number):
+            self.entries[tree_number] = []
+        self.entries[tree_number] += [tree.GetTree().GetReadEntry()]
+        self.counters["processing"].inc("passes")
+        return True
+
+    def endLoop(self, setup):
+        super(SkimRecorderAnalyzer, self).endLoop(setup)
+        from TTH.MEAnalysis.entrylists import file_fingerprint
+        for (ifile, fn) in enumerate(self.cfg_comp.files):
+            fp = file_fingerprint(fn, self.cfg_comp.tree_name)
+            entries = self.entries.get(ifile, [])
+            self.cache.save(fp, self.selection, entries)
+            print "SkimRecorder: {0} entries of {1} pass".format(len(entries), fn)
+
+class SidecarWriterAnalyzer(FilterAnalyzer):
+    """
+    Stores the results of the analyzers before the MEM for the events which
+    reach this analyzer in a sidecar file, see TTH.MEAnalysis.sidecar.
+
+    Configuration:
+    Conf.general["sidecar"]["dir"] (str): directory of the sidecar files
+    """
+    consumes = ["input", "Jet", "selLeptons", "good_jets", "good_leptons",
+        "btagged_jets", "buntagged_jets", "wquark_candidate_jets",
+        "is_sl", "is_dl", "numJets", "Wmass", "btag_LR_4b_2b", "cat", "cat_btag",
+        "catn", "cat_btag_n", "n_cat_gen", "b_quarks_t", "b_quarks_h", "l_quarks_w",
+        "lep_top", "nu_top", "nMatch_wq", "nMatch_tb", "nMatch_hb",
+    ]
+    produces = []
+
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        super(SidecarWriterAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        self.conf = cfg_ana._conf
+        self.sidecar_dir = self.conf.general["sidecar"]["dir"]
+
+    def beginLoop(self, setup):
+        super(SidecarWriterAnalyzer, self).beginLoop(setup)
+        from TTH.MEAnalysis.sidecar import SidecarWriter
+        self.writer = SidecarWriter(self.conf)
+        self.first_event = None
+
+    def process(self, event):
+        self.counters["processing"].inc("processed")
+        if self.first_event is None:
+            self.first_event = event.iEv
+        self.writer.add(event)
+        self.counters["processing"].inc("passes")
+        return True
+
+    def endLoop(self, setup):
+        super(SidecarWriterAnalyzer, self).endLoop(setup)
+        if self.first_event is None:
+            return
+        path = os.path.join(self.sidecar_dir, self.cfg_comp.name, "{0}.npz".format(self.first_event))
+        self.writer.save(path)
+        print "SidecarWriter: stored {0} events in {1}".format(len(self.writer), path)
+
+class SidecarReaderAnalyzer(FilterAnalyzer):
+    """
+    Restores the results of the analyzers before the MEM from the sidecar
+    files of the sample, see TTH.MEAnalysis.sidecar. Events which are not in
+    the sidecar did not pass these analyzers and are rejected.
+
+    Configuration:
+    Conf.general["sidecar"]["dir"] (str): directory of the sidecar files
+    """
+    input_branches = ["run", "lumi", "evt"]
+    consumes = ["input", "Jet", "selLeptons"]
+    produces = ["good_jets", "good_leptons", "btagged_jets", "buntagged_jets",
+        "wquark_candidate_jets", "b_quarks_t", "b_quarks_h", "l_quarks_w", "lep_top",
+        "nu_top", "is_sl", "is_dl", "numJets", "Wmass", "btag_LR_4b_2b*", "cat",
+        "cat_btag", "catn", "cat_btag_n", "cat_gen", "n_cat_gen", "nMatch*", "nB*",
+        "n_tagwp_tagged_true_bjets", "n_lr_tagged_true_bjets", "GenQ_*",
+    ]
+
+    def __init__(self, cfg_ana, cfg_comp, looperName):
+        super(SidecarReaderAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        self.conf = cfg_ana._conf
+        from TTH.MEAnalysis.sidecar import load_sidecar
+        self.table = load_sidecar(self.conf.general["sidecar"]["dir"], cfg_comp.name, self.conf)
+        print "SidecarReader: {0} events for {1}".format(len(self.table), cfg_comp.name)
+
+    def process(self, event):
+        self.counters["processing"].inc("processed")
+        row = self.table.find(event)
+        if row is None:
+            return False
+        self.table.read_event(event, row)
+        self.counters["processing"].inc("passes")
+        return True
+
 class EventIDFilterAnalyzer(FilterAnalyzer):
     """
+    Passes only the events in Conf.general["eventWhitelist"], a list of
+    (run, lumi, evt), if given. The input is then read with
+    entrylists.EventIDChain, which already seeks to these events.
     """
+    input_branches = ["run", "lumi", "evt"]
+    consumes = ["input"]
+    produces = []
 
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(EventIDFilterAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
@@ -74,6 +452,12 @@ class TestAnalyzer(FilterAnalyzer):
     Test analyzer by Thomas
     """
 
+    consumes = ["iEv", "cat", "good_jets", "httCandidate", "GenWZQuark", "GenBQuarkFromTop",
+        "kinematics"
+    ]
+    #the generator collections are modified
+    produces = ["GenWZQuark", "GenBQuarkFromTop"]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(TestAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
         self.conf = cfg_ana._conf
@@ -106,6 +490,7 @@ class TestAnalyzer(FilterAnalyzer):
         super(TestAnalyzer, self).beginLoop(setup)
 
     def endLoop(self, setup):
+        super(TestAnalyzer, self).endLoop(setup)
 
         print 'Statistics:'
         print 'n_processed       = {0}'.format(self.Statistics['n_processed'])
@@ -182,13 +567,7 @@ class TestAnalyzer(FilterAnalyzer):
 
         # Determine delR for quarks with jets
 
-        tl_jets = []
-
-        for (i_jet, jet) in enumerate(event.good_jets):
-            x = ROOT.TLorentzVector()
-            x.SetPtEtaPhiM( jet.pt, jet.eta, jet.phi, jet.mass )
-            setattr( x, 'i_jet', i_jet )
-            tl_jets.append( x )
+        tl_jets = event.kinematics.get( event.good_jets )
 
 
         ( jet_links , jet_delR_list ) = self.Do_delR_combinatorics(
@@ -201,23 +580,11 @@ class TestAnalyzer(FilterAnalyzer):
 
         # Determine delR for quarks with subjets
 
-        tl_subjets = []
-
         prefixes = [ 'sjW1', 'sjW2', 'sjNonW' ]
 
-        for (i_subjet, prefix) in enumerate( prefixes ):
-
-            x = ROOT.TLorentzVector()
-
-            x.SetPtEtaPhiM(
-                getattr( top, prefix + 'pt' ),
-                getattr( top, prefix + 'eta' ),
-                getattr( top, prefix + 'phi' ),
-                getattr( top, prefix + 'mass' ) )
-
-            setattr( x, 'i_subjet', i_subjet )
-
-            tl_subjets.append( x )
+        tl_subjets = Kinematics( *[
+            [ getattr( top, prefix + attr ) for prefix in prefixes ]
+            for attr in [ 'pt', 'eta', 'phi', 'mass' ] ] )
 
         ( subjet_links , subjet_delR_list ) = self.Do_delR_combinatorics(
             tl_genquarks, tl_subjets )
@@ -317,8 +684,8 @@ class TestAnalyzer(FilterAnalyzer):
     #  - The first quark is a Gen B quark. This should be the hadronic B quark.
     #    Which quark is hadronic is determined by adding the light quarks to the
     #    B quarks, and seeing which combined mass comes closer to the top mass
-    #  - Output looks like: [ BQuark, lightQuark1, lightQuark2 ], where the list
-    #    entries are TLorentzVector objects. 
+    #  - Output looks like: [ BQuark, lightQuark1, lightQuark2 ], as the
+    #    Kinematics of the 3 quarks from event.kinematics
     def Get_tl_genquarks(self, event ):
 
         # Check if right amount of quarks was generated
@@ -335,50 +702,30 @@ class TestAnalyzer(FilterAnalyzer):
             self.Statistics['n_too_many_B'] += 1
             return 0
 
-        # Make list of TLorentzVector objects for the 2 light quarks
-        tl_GenWZQuarks = []
-        for l in event.GenWZQuark:
-            tl_l = ROOT.TLorentzVector()
-            tl_l.SetPtEtaPhiM( l.pt, l.eta, l.phi, l.mass )
-            tl_GenWZQuarks.append( tl_l )
-
-        # Make list for the 2 B quarks, and a list of B quarks + light quarks
-        tl_GenBQuarks = []
-        tl_Combined = []
-        for (b_i, b) in enumerate(event.GenBQuarkFromTop):
-
-            tl_b = ROOT.TLorentzVector()
-            tl_b.SetPtEtaPhiM( b.pt, b.eta, b.phi, b.mass )
+        # The 2 B quarks followed by the 2 light quarks, and the masses of
+        # each B quark + light quarks
+        tl_quarks = event.kinematics.get(
+            list(event.GenBQuarkFromTop) + list(event.GenWZQuark) )
 
-            tl_GenBQuarks.append( tl_b )
-            tl_Combined.append( tl_b + tl_GenWZQuarks[0] + tl_GenWZQuarks[1] )
-
-
-        delmass0 = abs(tl_Combined[0].M() - self.top_mass)
-        delmass1 = abs(tl_Combined[1].M() - self.top_mass)
+        delmass0 = abs(tl_quarks.mass_of([ 0, 2, 3 ]) - self.top_mass)
+        delmass1 = abs(tl_quarks.mass_of([ 1, 2, 3 ]) - self.top_mass)
 
         # Make sure the B quark with lowest del mass to top mass is at index 0
-        # (both for the tl list and in the event)
+        # in the event
         if delmass1 < delmass0:
 
-            tl_GenBQuarks = [ tl_GenBQuarks[1], tl_GenBQuarks[0] ]
-
             event.GenBQuarkFromTop = [
                 event.GenBQuarkFromTop[1],
                 event.GenBQuarkFromTop[0] ]
 
-        setattr(  tl_GenBQuarks[0], 'is_hadr', 1 )
         setattr(  event.GenBQuarkFromTop[0], 'is_hadr', 1 )
         setattr(  event.GenBQuarkFromTop[1], 'is_hadr', 0 )
 
         # Create the definitive list of 3 quarks
-        tl_GenQuarks = []
-        tl_GenQuarks.append( tl_GenBQuarks[0] )
-
         # There should be only 2 generated WZQuarks:
-        tl_GenQuarks.append( tl_GenWZQuarks[0] )
-        tl_GenQuarks.append( tl_GenWZQuarks[1] )
-        
+        tl_GenQuarks = event.kinematics.get(
+            [ event.GenBQuarkFromTop[0] ] + list(event.GenWZQuark) )
+
         return tl_GenQuarks
     #--------------------------------------#
 
@@ -389,8 +736,7 @@ class TestAnalyzer(FilterAnalyzer):
         n_quarks = len(tl_genquarks)
 
         # Create delR matrix:
-        Rmat = [[ (tl_genquarks[i].DeltaR( tl_jets[j] )) \
-            for j in range(n_jets)] for i in range(n_quarks) ]
+        Rmat = tl_genquarks.delta_r( tl_jets ).tolist()
 
         """        
         print '\ndelR matrix:'
@@ -464,7 +810,9 @@ class LeptonAnalyzer(FilterAnalyzer):
 
     Configuration:
     Conf.leptons[channel][cuttype] where channel=mu,ele, cuttype=tight,loose,(+veto)
-    the lepton cuts must specify pt, eta and isolation cuts.
+    the lepton cuts must specify pt, eta and isolation cuts. The cuts are
+    compiled at beginLoop, such that each lepton is classified in all the
+    categories in a single pass.
 
     Returns:
     event.good_leptons (list of VHbbTree.selLeptons): contains the leptons that pass the SL XOR DL selection.
@@ -472,10 +820,25 @@ class LeptonAnalyzer(FilterAnalyzer):
     event.is_sl, is_dl (bool): specifies if the event passes SL or DL selection.
 
     """
+    consumes = ["selLeptons"]
+    produces = ["mu", "el", "is_sl", "is_dl", "good_leptons"] + [
+        p + l + "_" + a + b
+        for p in ["", "n_"]
+        for l in ["mu", "el", "lep"]
+        for a in ["tight", "loose"]
+        for b in ["", "_veto"]
+    ]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(LeptonAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
         self.conf = cfg_ana._conf
 
+    #abs(pdgId) of the lepton flavours
+    flavours = {"mu": 13, "el": 11}
+
+    #lepton ID flag required for the tight and loose selections
+    id_flags = {"tight": "tightId", "loose": "looseIdPOG"}
+
     def beginLoop(self, setup):
         super(LeptonAnalyzer, self).beginLoop(setup)
 
@@ -491,59 +854,69 @@ class LeptonAnalyzer(FilterAnalyzer):
                     lt = l + "_" + a + b
                     self.counters["leptons"].register(lt)
 
+        self.selection = self.compile_selection()
+        #names of the lepton lists set by process
+        self.categories = list(self.flavours.keys())
+        for (l, isotype, cuts) in self.selection.values():
+            for (idflag, good, veto, name_good, name_veto) in cuts:
+                self.categories += [name_good, name_veto]
+
+    def compile_selection(self):
+        """
+        Returns {abs(pdgId): (flavour, isotype, cuts)} from Conf.leptons, where
+        cuts is a list of (ID flag, (pt, eta, iso) of the selection, (pt, eta,
+        iso) of the veto, selection name, veto name) for tight and loose.
+
+        A lepton of the selection passes its cuts and the ID, a lepton of
+        the veto passes the veto cuts and the ID but not the selection cuts.
+        """
+        selection = {}
+        for (l, pdgid) in self.flavours.items():
+            cuts = []
+            for a in ["tight", "loose"]:
+                c = [(
+                    self.conf.leptons[l][a+b]["pt"],
+                    self.conf.leptons[l][a+b]["eta"],
+                    self.conf.leptons[l][a+b]["iso"],
+                ) for b in ["", "_veto"]]
+                cuts += [(self.id_flags[a], c[0], c[1], l + "_" + a, l + "_" + a + "_veto")]
+            selection[pdgid] = (l, self.conf.leptons[l]["isotype"], cuts)
+        return selection
+
     def process(self, event):
         self.counters["processing"].inc("processed")
         self.counters["leptons"].inc("any", len(event.selLeptons))
 
-        event.mu = filter(
-            lambda x: abs(x.pdgId) == 13,
-            event.selLeptons,
-        )
-        event.el = filter(
-            lambda x: abs(x.pdgId) == 11,
-            event.selLeptons,
-        )
-
+        #classify each lepton in all the categories in one pass, in input order
+        sel = dict([(lt, []) for lt in self.categories])
+        for x in event.selLeptons:
+            flavour = self.selection.get(abs(x.pdgId), None)
+            if flavour is None:
+                continue
+            l, isotype, cuts = flavour
+            sel[l].append(x)
+            pt = x.pt
+            eta = abs(x.eta)
+            iso = abs(getattr(x, isotype))
+            for (idflag, good, veto, name_good, name_veto) in cuts:
+                if not getattr(x, idflag):
+                    continue
+                if pt > good[0] and eta < good[1] and iso < good[2]:
+                    sel[name_good].append(x)
+                elif pt > veto[0] and eta < veto[1] and iso < veto[2]:
+                    sel[name_veto].append(x)
+
+        for (lt, leps) in sel.items():
+            setattr(event, lt, leps)
+            if lt != "mu" and lt != "el":
+                setattr(event, "n_"+lt, len(leps))
+                self.counters["leptons"].inc(lt, len(leps))
         for a in ["tight", "loose"]:
             for b in ["", "_veto"]:
-                sumleps = []
-                for l in ["mu", "el"]:
-                    lepcuts = self.conf.leptons[l][a+b]
-                    incoll = getattr(event, l)
-
-                    leps = filter(
-                        lambda x: (
-                            x.pt > lepcuts["pt"]
-                            and abs(x.eta) < lepcuts["eta"]
-                            and abs(getattr(x, self.conf.leptons[l]["isotype"])) < lepcuts["iso"]
-                        ), incoll
-                    )
-
-                    if b == "_veto":
-                        good = getattr(event, "{0}_{1}".format(l, a))
-                        leps = filter(lambda x: x not in good, leps)
-
-                    if a == "tight":
-                        leps = filter(
-                            lambda x: x.tightId,
-                            leps
-                        )
-                    elif a == "loose":
-                        leps = filter(
-                            lambda x: x.looseIdPOG,
-                            leps
-                        )
-                    lep = sorted(leps, key=lambda x: x.pt, reverse=True)
-                    sumleps += leps
-                    lt = l + "_" + a + b
-                    setattr(event, lt, leps)
-                    setattr(event, "n_"+lt, len(leps))
-                    self.counters["leptons"].inc(lt, len(leps))
-
+                sumleps = sel["mu_"+a+b] + sel["el_"+a+b]
                 setattr(event, "lep_{0}".format(a+b), sumleps)
                 setattr(event, "n_lep_{0}".format(a+b), len(sumleps))
 
-
         event.is_sl = (event.n_lep_tight == 1 and event.n_lep_tight_veto == 0)
         event.is_dl = (event.n_lep_loose == 2 and event.n_lep_loose_veto == 0)
 
@@ -564,16 +937,112 @@ class LeptonAnalyzer(FilterAnalyzer):
             self.counters["processing"].inc("passes")
         return passes
 
+    def process_batch(self, batch):
+        pdgid = np.abs(batch.column("selLeptons", "pdgId"))
+        pt = batch.column("selLeptons", "pt")
+        eta = np.abs(batch.column("selLeptons", "eta"))
+        ids = dict([
+            (flag, batch.column("selLeptons", flag) != 0) for flag in self.id_flags.values()
+        ])
+
+        #the leptons of each list of process, and their number per event
+        sel = {}
+        for (pdg, (l, isotype, cuts)) in self.selection.items():
+            flavour = pdgid == pdg
+            sel[l] = flavour
+            iso = np.abs(batch.column("selLeptons", isotype))
+            for (idflag, good, veto, name_good, name_veto) in cuts:
+                base = flavour & ids[idflag]
+                sel[name_good] = base & (pt > good[0]) & (eta < good[1]) & (iso < good[2])
+                sel[name_veto] = base & ~sel[name_good] & (pt > veto[0]) & (eta < veto[1]) & (iso < veto[2])
+        n = {}
+        for lt in self.categories:
+            batch.values["selLeptons_" + lt] = sel[lt]
+            if lt != "mu" and lt != "el":
+                n[lt] = batch.count("selLeptons", sel[lt])
+        for a in ["tight", "loose"]:
+            for b in ["", "_veto"]:
+                n["lep_"+a+b] = n["mu_"+a+b] + n["el_"+a+b]
+        for (lt, nl) in n.items():
+            batch.values["n_"+lt] = nl
+        batch.values["n_selLeptons"] = batch.counts("selLeptons")
+
+        is_sl = (n["lep_tight"] == 1) & (n["lep_tight_veto"] == 0)
+        is_dl = (n["lep_loose"] == 2) & (n["lep_loose_veto"] == 0)
+        batch.values["is_sl"] = is_sl
+        batch.values["is_dl"] = is_dl
+        return (is_sl | is_dl) & ~(is_sl & is_dl)
+
+    def fill_event(self, event, batch, index):
+        offsets = batch.offsets("selLeptons")
+        lo, hi = offsets[index], offsets[index + 1]
+        for lt in self.categories:
+            leps = [event.selLeptons[i] for i in np.nonzero(batch.values["selLeptons_" + lt][lo:hi])[0]]
+            setattr(event, lt, leps)
+            if lt != "mu" and lt != "el":
+                setattr(event, "n_"+lt, len(leps))
+        for a in ["tight", "loose"]:
+            for b in ["", "_veto"]:
+                sumleps = getattr(event, "mu_"+a+b) + getattr(event, "el_"+a+b)
+                setattr(event, "lep_{0}".format(a+b), sumleps)
+                setattr(event, "n_lep_{0}".format(a+b), len(sumleps))
+        event.is_sl = bool(batch.values["is_sl"][index])
+        event.is_dl = bool(batch.values["is_dl"][index])
+        #the passing events are either SL or DL
+        if event.is_sl:
+            event.good_leptons = event.mu_tight + event.el_tight
+        else:
+            event.good_leptons = event.mu_loose + event.el_loose
+
+    def count_batch(self, batch, index):
+        super(LeptonAnalyzer, self).count_batch(batch, index)
+        self.counters["leptons"].inc("any", int(batch.values["n_selLeptons"][index]))
+        for l in ["mu", "el"]:
+            for a in ["tight", "loose"]:
+                for b in ["", "_veto"]:
+                    lt = l + "_" + a + b
+                    self.counters["leptons"].inc(lt, int(batch.values["n_"+lt][index]))
+        is_sl = batch.values["is_sl"][index]
+        is_dl = batch.values["is_dl"][index]
+        if is_sl:
+            self.counters["processing"].inc("sl")
+        if is_dl:
+            self.counters["processing"].inc("dl")
+        if is_sl and is_dl:
+            self.counters["processing"].inc("slanddl")
 
 
 class JetAnalyzer(FilterAnalyzer):
     """
     Performs jet selection and b-tag counting.
-    FIXME: doc
+
+    The 9 leading jets passing the pt and eta cuts are selected by a partial
+    sort. The working points of Conf.jets["btagWPs"] are grouped by
+    discriminator into ascending threshold lists at beginLoop, such that
+    each jet is classified against all the working points of a
+    discriminator with one binary search.
+
+    If Conf.jets["btagScan"] = (discriminator, thresholds) is set, the
+    number of good jets above each threshold is stored in event.btag_scan,
+    from the discriminator values sorted once per event, or in the batch
+    version from one histogram of the thresholds passed by the jets.
+
+    The good jets passing the working point Conf.jets["btagWP"], which must
+    be one of Conf.jets["btagWPs"], are stored in event.btagged_jets_bdisc,
+    the others in event.buntagged_jets_bdisc.
     """
+    consumes = ["Jet"]
+    produces = ["good_jets", "numJets", "btagged_jets_bdisc", "buntagged_jets_bdisc",
+        "n_tagwp_tagged_true_bjets", "nB*", "btag_scan"
+    ]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(JetAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
         self.conf = cfg_ana._conf
+        if not self.conf.jets["btagWP"] in self.conf.jets["btagWPs"]:
+            raise ValueError("Conf.jets[\"btagWP\"] = {0} is not one of Conf.jets[\"btagWPs\"]: {1}".format(
+                self.conf.jets["btagWP"], sorted(self.conf.jets["btagWPs"].keys()))
+            )
 
     def beginLoop(self, setup):
         super(JetAnalyzer, self).beginLoop(setup)
@@ -582,7 +1051,25 @@ class JetAnalyzer(FilterAnalyzer):
         self.counters["jets"].register("good")
         for (btag_wp_name, btag_wp) in self.conf.jets["btagWPs"].items():
             self.counters["jets"].register(btag_wp_name)
+        self.btag_algos = self.compile_working_points()
+        self.btag_scan = self.conf.jets.get("btagScan", None)
 
+    def compile_working_points(self):
+        """
+        Returns [(discriminator, ascending thresholds, working point names,
+        position of Conf.jets["btagWP"] or None)]. A jet with discriminator
+        value v passes the first bisect_left(thresholds, v) working points.
+        """
+        by_algo = {}
+        for (name, (algo, wp)) in self.conf.jets["btagWPs"].items():
+            by_algo.setdefault(algo, []).append((wp, name))
+        ret = []
+        for (algo, wps) in sorted(by_algo.items()):
+            wps = sorted(wps)
+            names = [name for (wp, name) in wps]
+            isel = names.index(self.conf.jets["btagWP"]) if self.conf.jets["btagWP"] in names else None
+            ret += [(algo, [wp for (wp, name) in wps], names, isel)]
+        return ret
 
     def process(self, event):
         self.counters["processing"].inc("processed")
@@ -593,52 +1080,134 @@ class JetAnalyzer(FilterAnalyzer):
             for j in event.Jet:
                 print "ijet", j.pt, j.eta, j.phi, j.mass, j.btagCSV, j.mcFlavour
 
-        event.good_jets = sorted(
-            filter(
-                lambda x: (
-                    x.pt > self.conf.jets["pt"]
-                    and abs(x.eta) < self.conf.jets["eta"]
-                ), event.Jet
-            ),
-            key=lambda x: x.pt, reverse=True
-            )[0:9]
+        ptcut = self.conf.jets["pt"]
+        etacut = self.conf.jets["eta"]
+        #same order as sorted(..., reverse=True)[0:9], also for equal pt
+        event.good_jets = heapq.nlargest(9,
+            [x for x in event.Jet if x.pt > ptcut and abs(x.eta) < etacut],
+            key=lambda x: x.pt
+        )
         event.numJets = len(event.good_jets)
         self.counters["jets"].inc("good", len(event.good_jets))
 
-        event.btagged_jets_bdisc = {}
-        event.buntagged_jets_bdisc = {}
-        for (btag_wp_name, btag_wp) in self.conf.jets["btagWPs"].items():
-            algo, wp = btag_wp
-            event.btagged_jets_bdisc[btag_wp_name] = filter(
-                lambda x: getattr(x, algo) > wp,
-                event.good_jets
-            )
-            event.buntagged_jets_bdisc[btag_wp_name] = filter(
-                lambda x: getattr(x, algo) <= wp,
-                event.good_jets
-            )
-            self.counters["jets"].inc(btag_wp_name,
-                len(event.btagged_jets_bdisc[btag_wp_name])
-            )
-            setattr(event, "nB"+btag_wp_name, len(event.btagged_jets_bdisc[btag_wp_name]))
-        event.buntagged_jets_bdisc = event.buntagged_jets_bdisc[self.conf.jets["btagWP"]]
-        event.btagged_jets_bdisc = event.btagged_jets_bdisc[self.conf.jets["btagWP"]]
+        event.btagged_jets_bdisc = []
+        event.buntagged_jets_bdisc = []
         event.n_tagwp_tagged_true_bjets = 0
-        for j in event.btagged_jets_bdisc:
-            if abs(j.mcFlavour) == 5:
-                event.n_tagwp_tagged_true_bjets += 1
+        for (algo, thresholds, names, isel) in self.btag_algos:
+            #number of jets by the number of working points they pass
+            npass = [0 for i in range(len(thresholds) + 1)]
+            for j in event.good_jets:
+                k = bisect.bisect_left(thresholds, getattr(j, algo))
+                npass[k] += 1
+                if isel is None:
+                    continue
+                if k > isel:
+                    event.btagged_jets_bdisc.append(j)
+                    if abs(j.mcFlavour) == 5:
+                        event.n_tagwp_tagged_true_bjets += 1
+                else:
+                    event.buntagged_jets_bdisc.append(j)
+            ntagged = 0
+            for i in reversed(range(len(names))):
+                ntagged += npass[i + 1]
+                self.counters["jets"].inc(names[i], ntagged)
+                setattr(event, "nB"+names[i], ntagged)
+
+        if self.btag_scan != None:
+            algo, thresholds = self.btag_scan
+            values = sorted([getattr(j, algo) for j in event.good_jets])
+            event.btag_scan = [len(values) - bisect.bisect_right(values, t) for t in thresholds]
+
         passes = len(event.good_jets) >= 4
         if passes:
             self.counters["processing"].inc("passes")
 
         return passes
 
+    def process_batch(self, batch):
+        from TTH.MEAnalysis.columnar import offsets_from_counts
+        pt = batch.column("Jet", "pt")
+        good = (pt > self.conf.jets["pt"]) & (np.abs(batch.column("Jet", "eta")) < self.conf.jets["eta"])
+
+        #keep the 9 leading good jets: rank the good jets by pt within each
+        #event, stable for equal pt as the per-event sort
+        ev = batch.event_index("Jet")
+        igood = np.nonzero(good)[0]
+        order = igood[np.lexsort((-pt[igood], ev[igood]))]
+        ev_sorted = ev[order]
+        rank = np.arange(len(order)) - np.searchsorted(ev_sorted, ev_sorted, side="left")
+        good[order[rank >= 9]] = False
+        batch.values["good_jets_mask"] = good
+        #the good jets of all the events in the order of event.good_jets
+        batch.values["good_jets_index"] = order[rank < 9]
+        batch.values["numJets"] = batch.count("Jet", good)
+        batch.values["good_jets_offsets"] = offsets_from_counts(batch.values["numJets"])
+        batch.values["n_Jet"] = batch.counts("Jet")
+
+        for (algo, thresholds, names, isel) in self.btag_algos:
+            #number of working points passed by each jet
+            k = np.searchsorted(thresholds, batch.column("Jet", algo), side="left")
+            for (i, name) in enumerate(names):
+                batch.values["nB" + name] = batch.count("Jet", good & (k > i))
+            if isel != None:
+                batch.values["btag_tagged"] = k > isel
+                true_b = np.abs(batch.column("Jet", "mcFlavour")) == 5
+                batch.values["n_tagwp_tagged_true_bjets"] = batch.count("Jet", good & (k > isel) & true_b)
+
+        if self.btag_scan != None:
+            algo, thresholds = self.btag_scan
+            thresholds = np.asarray(thresholds, dtype=np.float64)
+            nthr = len(thresholds)
+            order = np.argsort(thresholds, kind="mergesort")
+            #per-event histogram of the number of thresholds below each good jet,
+            #summed from the top it gives the number of jets above each threshold
+            k = np.searchsorted(thresholds[order], batch.column("Jet", algo)[good], side="left")
+            ev = batch.event_index("Jet")[good]
+            hist = np.bincount(ev * (nthr + 1) + k, minlength=len(batch) * (nthr + 1))
+            hist = hist.reshape(len(batch), nthr + 1)
+            above = np.cumsum(hist[:, ::-1], axis=1)[:, ::-1][:, 1:]
+            scan = np.empty_like(above)
+            scan[:, order] = above
+            batch.values["btag_scan"] = scan
+        return batch.values["numJets"] >= 4
+
+    def fill_event(self, event, batch, index):
+        offsets = batch.values["good_jets_offsets"]
+        idx = batch.values["good_jets_index"][offsets[index]:offsets[index + 1]]
+        first = batch.offsets("Jet")[index]
+        event.good_jets = [event.Jet[i] for i in idx - first]
+        event.numJets = len(event.good_jets)
+
+        tagged = batch.values["btag_tagged"][idx]
+        event.btagged_jets_bdisc = [j for (j, t) in zip(event.good_jets, tagged) if t]
+        event.buntagged_jets_bdisc = [j for (j, t) in zip(event.good_jets, tagged) if not t]
+        event.n_tagwp_tagged_true_bjets = int(batch.values["n_tagwp_tagged_true_bjets"][index])
+        for (algo, thresholds, names, isel) in self.btag_algos:
+            for name in names:
+                setattr(event, "nB"+name, int(batch.values["nB" + name][index]))
+
+        if self.btag_scan != None:
+            event.btag_scan = [int(n) for n in batch.values["btag_scan"][index]]
+
+    def count_batch(self, batch, index):
+        super(JetAnalyzer, self).count_batch(batch, index)
+        self.counters["jets"].inc("any", int(batch.values["n_Jet"][index]))
+        self.counters["jets"].inc("good", int(batch.values["numJets"][index]))
+        for (algo, thresholds, names, isel) in self.btag_algos:
+            for name in names:
+                self.counters["jets"].inc(name, int(batch.values["nB" + name][index]))
+
 
 class BTagLRAnalyzer(FilterAnalyzer):
     """
     Performs b-tag likelihood ratio calculations
     FIXME: doc
     """
+    consumes = ["good_jets", "btagged_jets_bdisc", "buntagged_jets_bdisc"]
+    produces = ["btag_lr_*", "btag_LR_4b_2b*", "btagged_jets", "buntagged_jets",
+        "btagged_jets_by_LR_4b_2b", "buntagged_jets_by_LR_4b_2b"
+    ]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(BTagLRAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
         self.conf = cfg_ana._conf
@@ -822,13 +1391,23 @@ class BTagLRAnalyzer(FilterAnalyzer):
 class MECategoryAnalyzer(FilterAnalyzer):
     """
     Performs ME categorization
-    FIXME: doc
+
+    Configuration:
+    Conf.mem["selectCategories"] (bool, default False): if True, only the
+        events in Conf.mem["MECategories"] with cat_btag H, for which the ME
+        is calculated, pass the analyzer.
     """
+    consumes = ["is_sl", "is_dl", "good_jets", "btagged_jets", "buntagged_jets",
+        "btag_LR_4b_2b", "Wmass"
+    ]
+    produces = ["cat", "cat_btag", "catn", "cat_btag_n", "wquark_candidate_jets"]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         self.conf = cfg_ana._conf
         super(MECategoryAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
         self.cat_map = {"NOCAT":-1, "cat1": 1, "cat2": 2, "cat3": 3, "cat6":6}
         self.btag_cat_map = {"NOCAT":-1, "L": 0, "H": 1}
+        self.cat_names = dict([(n, c) for (c, n) in self.cat_map.items()])
 
     def beginLoop(self, setup):
         super(MECategoryAnalyzer, self).beginLoop(setup)
@@ -876,96 +1455,214 @@ class MECategoryAnalyzer(FilterAnalyzer):
         event.cat_btag_n = self.btag_cat_map.get(cat, -1)
 
         passes = True
+        if self.conf.mem.get("selectCategories", False):
+            passes = cat in self.conf.mem["MECategories"] and cat_btag == "H"
         if passes:
             self.counters["processing"].inc("passes")
         return passes
 
+    def process_batch(self, batch):
+        #needs the W mass and the b-tag counts from earlier batch versions,
+        #the b-tag LR selection depends on the category itself
+        if self.conf.jets["untaggedSelection"] == "btagLR":
+            return None
+        nbtag = "nB" + self.conf.jets["btagWP"]
+        for k in ["is_sl", "is_dl", "numJets", "Wmass", nbtag]:
+            if not batch.values.has_key(k):
+                return None
+        nj = batch.values["numJets"]
+        wmass = batch.values["Wmass"]
+        is_sl = batch.values["is_sl"]
+        is_dl = batch.values["is_dl"]
+
+        catn = np.empty(len(batch), dtype=np.int64)
+        catn.fill(self.cat_map["NOCAT"])
+        cat1 = is_sl & (((nj == 6) & (wmass >= 60) & (wmass < 100)) |
+            ((nj > 6) & (wmass >= 72) & (wmass < 94))
+        )
+        cat2 = is_sl & ~cat1 & (nj >= 6)
+        cat3 = is_sl & (nj == 5)
+        cat6 = ~is_sl & is_dl & (nj >= 4)
+        for (name, sel) in [("cat1", cat1), ("cat2", cat2), ("cat3", cat3), ("cat6", cat6)]:
+            catn[sel] = self.cat_map[name]
+        batch.values["catn"] = catn
+        #the good jets passing the working point are the btagged_jets
+        batch.values["cat_btag_high"] = batch.values[nbtag] >= 4
+
+        if not self.conf.mem.get("selectCategories", False):
+            return np.ones(len(batch), dtype=np.bool_)
+        selected = np.zeros(len(batch), dtype=np.bool_)
+        for cat in self.conf.mem["MECategories"]:
+            selected |= catn == self.cat_map[cat]
+        return selected & batch.values["cat_btag_high"]
+
+    def fill_event(self, event, batch, index):
+        catn = int(batch.values["catn"][index])
+        cat = self.cat_names[catn]
+        if cat == "cat3":
+            event.wquark_candidate_jets = event.buntagged_jets
+        elif cat == "cat6":
+            event.wquark_candidate_jets = []
+        event.cat = cat
+        event.cat_btag = "H" if batch.values["cat_btag_high"][index] else "NOCAT"
+        event.catn = catn
+        event.cat_btag_n = self.btag_cat_map.get(cat, -1)
+
+    def count_batch(self, batch, index):
+        super(MECategoryAnalyzer, self).count_batch(batch, index)
+        self.counters["processing"].inc(self.cat_names[int(batch.values["catn"][index])])
+
 class WTagAnalyzer(FilterAnalyzer):
     """
     Performs W-mass calculation on pairs of untagged jets.
 
     Jets are considered untagged according to the b-tagging permutation which
     gives the highest likelihood of the event being a 4b+Nlight event.
+
+    The masses of all the pairs are computed at once from the four-momentum
+    arrays of the untagged jets. event.Wmasses holds the masses of all the
+    pairs by distance to the W mass, the W quark candidates are found with
+    a partial sort. find_best_pairs does the same for the jets of all the
+    events of a batch.
     """
+    consumes = ["good_jets", "buntagged_jets", "kinematics"]
+    produces = ["Wmass", "Wmasses", "wquark_candidate_jets"]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         self.conf = cfg_ana._conf
         super(WTagAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
 
     def beginLoop(self, setup):
         super(WTagAnalyzer, self).beginLoop(setup)
+        self.wmass = self.conf.jets.get("Wmass", 80.0)
 
-    def pair_mass(self, j1, j2):
+    def find_best_pair(self, jets, kin, k=2):
         """
-        Calculates the invariant mass of a two-particle system.
+        Finds the k pairs of jets whose invariant mass is closest to
+        Conf.jets["Wmass"], kin is the Kinematics of the jets. Returns the
+        masses of all the pairs sorted by the distance to Conf.jets["Wmass"]
+        and the sorted vector of [(mass, jet1, jet2)] of the k best pairs,
+        best first, with jet1 before jet2 in jets.
         """
-        lv1, lv2 = [lvec(j) for j in [j1, j2]]
-        tot = lv1 + lv2
-        return tot.M()
+        i, j = np.triu_indices(len(jets), 1)
+        ms = kin.pair_masses(i, j)
+        dist = np.abs(ms - self.wmass)
+        masses = [float(m) for m in ms[np.argsort(dist, kind="mergesort")]]
+
+        #partial sort: keep the pairs up to the k-th smallest distance,
+        #including ties, and sort only these in the order of the pairs
+        if k < len(dist):
+            kth = np.partition(dist, k - 1)[k - 1]
+            best = np.nonzero(dist <= kth)[0]
+        else:
+            best = np.arange(len(dist))
+        best = best[np.argsort(dist[best], kind="mergesort")][:k]
+        return masses, [(float(ms[b]), jets[i[b]], jets[j[b]]) for b in best]
 
-    def find_best_pair(self, jets):
+    def find_best_pairs(self, kin, offsets):
         """
-        Finds the pair of jets whose invariant mass is closest to mW=80 GeV.
-        Returns the sorted vector of [(mass, jet1, jet2)], best first.
+        Sorts the pairs of jets of several events by the distance of their
+        invariant mass to Conf.jets["Wmass"], as find_best_pair for each
+        event. kin is the Kinematics of the jets and offsets their jagged
+        offsets per event. Returns the indices (ia, ib) in kin of the jets
+        of the pairs, the event of each pair and the pair masses, ordered
+        by event and then by distance.
         """
-        ms = []
-        
-        #Keep track of index pairs already calculated
-        done_pairs = set([])
-        
-        #Double loop over all jets
-        for i in range(len(jets)):
-            for j in range(len(jets)):
-                
-                #Make sure we haven't calculated this index pair yet
-                if (i,j) not in done_pairs and i!=j:
-                    m = self.pair_mass(jets[i], jets[j])
-                    ms += [(m, jets[i], jets[j])]
-                    
-                    #M(i,j) is symmetric, hence add both pairs
-                    done_pairs.add((i,j))
-                    done_pairs.add((j,i))
-        ms = sorted(ms, key=lambda x: abs(x[0] - 80.0))
-        return ms
+        from TTH.MEAnalysis.columnar import triu_pairs
+        ia, ib, ev = triu_pairs(offsets)
+        ms = kin.pair_masses(ia, ib)
+        #in the order of the pairs for equal distances
+        order = np.lexsort((np.abs(ms - self.wmass), ev))
+        return ia[order], ib[order], ev[order], ms[order]
 
     def process(self, event):
         self.counters["processing"].inc("processed")
 
         event.Wmass = 0.0
-        
+        event.Wmasses = []
+
         event.wquark_candidate_jets = set([])
         #Need at least 2 untagged jets to calculate W mass
         if len(event.buntagged_jets)>=2:
-            bpair = self.find_best_pair(event.buntagged_jets)
-            
+            masses, bpair = self.find_best_pair(event.buntagged_jets,
+                event.kinematics.get(event.buntagged_jets)
+            )
+
             #Get the best mass
             event.Wmass = bpair[0][0]
-            
+
             #All masses
-            event.Wmasses = [bpair[i][0] for i in range(len(bpair))]
-            
-            for i in range(min(len(bpair), 2)):
+            event.Wmasses = masses
+
+            #The jets of the two best pairs are the W quark candidates
+            for i in range(len(bpair)):
                 event.wquark_candidate_jets.add(bpair[i][1])
                 event.wquark_candidate_jets.add(bpair[i][2])
-            
+
             if "reco" in self.conf.general["verbosity"]:
-                print "Wmass", event.Wmass, event.good_jets.index(bpair[1]), event.good_jets.index(bpair[2])
-        
+                print "Wmass", event.Wmass, event.good_jets.index(bpair[0][1]), event.good_jets.index(bpair[0][2])
+
         #If we can't calculate W mass, untagged jets become the candidate
         else:
             for jet in event.buntagged_jets:
                 event.wquark_candidate_jets.add(jet)
-                
-                
+
+
         passes = True
         if passes:
             self.counters["processing"].inc("passes")
         return passes
 
+    def process_batch(self, batch):
+        #the untagged jets are known in the batch only for the b-discriminator selection
+        if self.conf.jets["untaggedSelection"] != "btagCSV" or not batch.values.has_key("good_jets_index"):
+            return None
+        from TTH.MEAnalysis.columnar import offsets_from_counts
+        #the untagged good jets of all the events, in the order of event.buntagged_jets
+        idx = batch.values["good_jets_index"]
+        untagged = idx[~batch.values["btag_tagged"][idx]]
+        offsets = offsets_from_counts(np.bincount(batch.event_index("Jet")[untagged], minlength=len(batch)))
+        kin = Kinematics(*[
+            batch.column("Jet", attr)[untagged] for attr in ["pt", "eta", "phi", "mass"]
+        ])
+        ia, ib, ev, ms = self.find_best_pairs(kin, offsets)
+
+        first = offsets_from_counts(np.bincount(ev, minlength=len(batch)))
+        wmass = np.zeros(len(batch), dtype=np.float64)
+        has_pair = first[1:] > first[:-1]
+        wmass[has_pair] = ms[first[:-1][has_pair]]
+        batch.values["Wmass"] = wmass
+        batch.values["Wmasses"] = ms
+        batch.values["Wmasses_offsets"] = first
+        #the jets of the sorted pairs, as positions in event.buntagged_jets
+        batch.values["Wpairs"] = (ia - offsets[ev], ib - offsets[ev])
+        return np.ones(len(batch), dtype=np.bool_)
+
+    def fill_event(self, event, batch, index):
+        first = batch.values["Wmasses_offsets"]
+        lo, hi = first[index], first[index + 1]
+        event.Wmass = float(batch.values["Wmass"][index])
+        event.Wmasses = []
+        event.wquark_candidate_jets = set([])
+        if len(event.buntagged_jets) < 2:
+            for jet in event.buntagged_jets:
+                event.wquark_candidate_jets.add(jet)
+            return
+        #The jets of the two best pairs are the W quark candidates
+        ia, ib = batch.values["Wpairs"]
+        for k in range(lo, min(hi, lo + 2)):
+            event.wquark_candidate_jets.add(event.buntagged_jets[ia[k]])
+            event.wquark_candidate_jets.add(event.buntagged_jets[ib[k]])
+        event.Wmasses = [float(m) for m in batch.values["Wmasses"][lo:hi]]
+
 class GenRadiationModeAnalyzer(FilterAnalyzer):
     """
     Performs B/C counting
     FIXME: doc
     """
+    consumes = ["GenBQuarkFromTop", "good_jets", "kinematics"]
+    produces = ["nMatchSimB", "nMatchSimC"]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         self.conf = cfg_ana._conf
         super(GenRadiationModeAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
@@ -978,12 +1675,12 @@ class GenRadiationModeAnalyzer(FilterAnalyzer):
 
         event.nMatchSimB = 0
         event.nMatchSimC = 0
-        lv_bs = map(lvec, event.GenBQuarkFromTop)
-        for jet in event.good_jets:
-            lv_j = lvec(jet)
+        jets = event.kinematics.get(event.good_jets)
+        near_b = (jets.delta_r(event.kinematics.get(event.GenBQuarkFromTop)) < 0.5).any(axis=1)
+        for (ij, jet) in enumerate(event.good_jets):
 
-            if (lv_j.Pt() > 20 and abs(lv_j.Eta()) < 2.5):
-                if any([lv_b.DeltaR(lv_j) < 0.5 for lv_b in lv_bs]):
+            if (jets.pt[ij] > 20 and abs(jets.eta[ij]) < 2.5):
+                if near_b[ij]:
                     continue
                 absid = abs(jet.mcFlavour)
                 if absid == 5:
@@ -1000,6 +1697,14 @@ class GenRadiationModeAnalyzer(FilterAnalyzer):
 class GenTTHAnalyzer(FilterAnalyzer):
     """
     """
+    #jet.btagFlag of the good_jets is set by BTagLRAnalyzer with btagged_jets
+    consumes = ["GenLepFromTop", "GenNuFromTop", "GenBQuarkFromTop", "GenBQuarkFromH",
+        "GenWZQuark", "good_jets", "btagged_jets", "kinematics"
+    ]
+    produces = ["lep_top", "nu_top", "b_quarks_t", "b_quarks_h", "l_quarks_w",
+        "cat_gen", "n_cat_gen", "nMatch_*"
+    ]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         self.conf = cfg_ana._conf
         super(GenTTHAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
@@ -1057,17 +1762,15 @@ class GenTTHAnalyzer(FilterAnalyzer):
         matched_pairs = {}
 
         def match_jets_to_quarks(jetcoll, quarkcoll, label):
-            for ij, j in enumerate(jetcoll):
-                for iq, q in enumerate(quarkcoll):
-                    l1 = lvec(q)
-                    l2 = lvec(j)
-                    dr = l1.DeltaR(l2)
-                    if dr < 0.3:
-                        if matched_pairs.has_key(ij):
-                            if matched_pairs[ij][1] > dr:
-                                matched_pairs[ij] = (label, iq, dr)
-                        else:
-                            matched_pairs[ij] = (label, iq, dr)
+            drs = event.kinematics.get(jetcoll).delta_r(event.kinematics.get(quarkcoll))
+            #the pairs with dR < 0.3, by jet, then by quark
+            for (ij, iq) in zip(*np.nonzero(drs < 0.3)):
+                ij, iq, dr = int(ij), int(iq), float(drs[ij, iq])
+                if matched_pairs.has_key(ij):
+                    if matched_pairs[ij][1] > dr:
+                        matched_pairs[ij] = (label, iq, dr)
+                else:
+                    matched_pairs[ij] = (label, iq, dr)
         #print "GEN", len(event.GenWZQuark), len(event.GenBQuarkFromTop), len(event.GenBQuarkFromH)
         match_jets_to_quarks(event.good_jets, event.l_quarks_w, "wq")
         match_jets_to_quarks(event.good_jets, event.b_quarks_t, "tb")
@@ -1113,6 +1816,94 @@ class GenTTHAnalyzer(FilterAnalyzer):
             self.counters["processing"].inc("passes")
         return passes
 
+    def process_batch(self, batch):
+        #the matching needs the good jets from the JetAnalyzer batch version
+        if not batch.values.has_key("good_jets_index"):
+            return None
+        from TTH.MEAnalysis.columnar import jagged_pairs, offsets_from_counts
+        from TTH.MEAnalysis.kinematics import delta_r
+        n_lep = batch.counts("GenLepFromTop")
+        n_nu = batch.counts("GenNuFromTop")
+        n_bt = batch.counts("GenBQuarkFromTop")
+        #the first half of GenWZQuark, as in process
+        wz_offsets = batch.offsets("GenWZQuark")
+        n_wq = np.diff(wz_offsets) // 2
+
+        n_cat_gen = np.zeros(len(batch), dtype=np.int64) - 1
+        n_cat_gen[(n_lep == 1) & (n_nu == 1) & (n_wq == 2) & (n_bt == 2)] = 0
+        n_cat_gen[(n_lep == 2) & (n_nu == 2) & (n_wq == 0) & (n_bt == 2)] = 1
+        n_cat_gen[(n_lep == 0) & (n_nu == 0) & (n_wq == 4) & (n_bt == 2)] = 2
+        batch.values["n_cat_gen"] = n_cat_gen
+
+        #Jet-quark matches with dR < 0.3 in the order of process: by
+        #collection (wq, tb, hb), then by quark index. The match of a jet is
+        #replaced by a later one unless the current match has quark index 0.
+        jet_offsets = batch.offsets("Jet")
+        jet_eta = batch.column("Jet", "eta").astype(np.float64)
+        jet_phi = batch.column("Jet", "phi").astype(np.float64)
+        good = batch.values["good_jets_mask"]
+        matches = []
+        for (ilabel, (coll, offsets)) in enumerate([
+            ("GenWZQuark", offsets_from_counts(n_wq)),
+            ("GenBQuarkFromTop", batch.offsets("GenBQuarkFromTop")),
+            ("GenBQuarkFromH", batch.offsets("GenBQuarkFromH")),
+        ]):
+            ij, iq, ev = jagged_pairs(jet_offsets, offsets)
+            #index of the quark within its event
+            iq_local = iq - offsets[:-1][ev]
+            if coll == "GenWZQuark":
+                iq = wz_offsets[:-1][ev] + iq_local
+            sel = good[ij] & (delta_r(
+                jet_eta[ij], jet_phi[ij],
+                batch.column(coll, "eta").astype(np.float64)[iq],
+                batch.column(coll, "phi").astype(np.float64)[iq]
+            ) < 0.3)
+            matches += [(ij[sel], iq_local[sel], np.zeros(sel.sum(), dtype=np.int64) + ilabel)]
+        ij = np.concatenate([m[0] for m in matches])
+        iq = np.concatenate([m[1] for m in matches])
+        label = np.concatenate([m[2] for m in matches])
+
+        #the final match of each jet: the first one with quark index 0, else the last one
+        seq = label * 1000 + iq
+        priority = np.where(iq == 0, 1000000 - seq, seq)
+        order = np.lexsort((priority, ij))
+        last = np.ones(len(order), dtype=np.bool_)
+        last[:-1] = ij[order][1:] != ij[order][:-1]
+        final = order[last]
+
+        #the match label of every jet, -1 if unmatched
+        jet_label = np.zeros(len(good), dtype=np.int64) - 1
+        jet_label[ij[final]] = label[final]
+        batch.values["gen_match_label"] = jet_label
+        for (ilabel, name) in enumerate(["wq", "tb", "hb"]):
+            batch.values["nMatch_" + name] = batch.count("Jet", jet_label == ilabel)
+        return np.ones(len(batch), dtype=np.bool_)
+
+    def fill_event(self, event, batch, index):
+        event.l_quarks_w = event.GenWZQuark[0:len(event.GenWZQuark)/2]
+        event.b_quarks_t = event.GenBQuarkFromTop
+        event.b_quarks_h = event.GenBQuarkFromH
+        event.lep_top = event.GenLepFromTop
+        event.nu_top = event.GenNuFromTop
+        event.n_cat_gen = int(batch.values["n_cat_gen"][index])
+        event.cat_gen = [None, "sl", "dl", "fh"][event.n_cat_gen + 1]
+
+        for name in ["wq", "tb", "hb"]:
+            setattr(event, "nMatch_" + name, int(batch.values["nMatch_" + name][index]))
+        #the b-tag flags of the good jets are set per event by BTagLRAnalyzer
+        offsets = batch.values["good_jets_offsets"]
+        idx = batch.values["good_jets_index"][offsets[index]:offsets[index + 1]]
+        event.nMatch_wq_btag = 0
+        event.nMatch_tb_btag = 0
+        event.nMatch_hb_btag = 0
+        for (jet, mlabel) in zip(event.good_jets, batch.values["gen_match_label"][idx]):
+            if mlabel == 0 and jet.btagFlag < 0.5:
+                event.nMatch_wq_btag += 1
+            if mlabel == 1 and jet.btagFlag >= 0.5:
+                event.nMatch_tb_btag += 1
+            if mlabel == 2 and jet.btagFlag >= 0.5:
+                event.nMatch_hb_btag += 1
+
 class MEAnalyzer(FilterAnalyzer):
     """
     Performs ME calculation using external integrator
@@ -1125,10 +1916,29 @@ class MEAnalyzer(FilterAnalyzer):
     p_hypo_ttbb (double): probability for the tt+bb hypothesis
 
     """
+    input_branches = ["run", "lumi", "evt", "met_pt", "met_phi"]
+
+    consumes = ["input", "good_jets", "good_leptons", "btagged_jets", "buntagged_jets",
+        "btag_LR_4b_2b", "cat", "cat_btag", "wquark_candidate_jets", "GenBQuarkFromH",
+        "nMatch_wq", "nMatch_wq_btag", "nMatch_tb", "nMatch_tb_btag", "nMatch_hb", "nMatch_hb_btag",
+        "kinematics"
+    ]
+    produces = ["mem_results_tth", "mem_results_ttbb"]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         self.conf = cfg_ana._conf
         super(MEAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
 
+        self.memkeys = self.conf.mem["methodsToRun"]
+
+        #Number of integrator runs, reported by TTH.MEAnalysis.monitor
+        self.mem_calls = 0
+
+        #The integrator libraries are only needed to calculate the ME
+        self.calc_me = self.conf.mem["calcME"]
+        if not self.calc_me:
+            return
+        load_mem_libraries()
 
         self.configs = {
             "default": MEM.MEMConfig(),
@@ -1145,8 +1955,6 @@ class MEAnalyzer(FilterAnalyzer):
             "JetsPtOrderIntegrationRange": MEM.MEMConfig(),
         }
 
-        self.memkeys = self.conf.mem["methodsToRun"]
-
         self.configs["default"].defaultCfg()
         self.configs["NumPointsDouble"].defaultCfg(2.0)
         self.configs["NumPointsHalf"].defaultCfg(0.5)
@@ -1214,6 +2022,7 @@ class MEAnalyzer(FilterAnalyzer):
 
         objtype: specifies the object type
         kwargs: p4s: spherical 4-momentum (pt, eta, phi, M) as a tuple
+                p4c: cartesian 4-momentum (px, py, pz, E) as a tuple
                 obsdict: dict of additional observables to pass to MEM
         """
         if kwargs.has_key("p4s"):
@@ -1236,8 +2045,9 @@ class MEAnalyzer(FilterAnalyzer):
         self.counters["processing"].inc("processed")
 
         #Clean up any old MEM state
-        self.vars_to_integrate.clear()
-        self.integrator.next_event()
+        if self.calc_me:
+            self.vars_to_integrate.clear()
+            self.integrator.next_event()
 
         #Initialize members for tree filler
         event.mem_results_tth = []
@@ -1293,6 +2103,18 @@ class MEAnalyzer(FilterAnalyzer):
                 #print "Failed to match", k
                 return True
 
+        #Without the ME calculation, the MEM libraries are not loaded
+        if not self.calc_me:
+            event.mem_results_tth = [EmptyMEMOutput() for k in self.memkeys]
+            event.mem_results_ttbb = [EmptyMEMOutput() for k in self.memkeys]
+            return True
+
+        #The objects are added again for every hypothesis and configuration,
+        #their four-momenta are taken from the event kinematics cache
+        jets = list(event.btagged_jets) + list(event.wquark_candidate_jets)
+        jets_kin = event.kinematics.get(jets)
+        leptons_kin = event.kinematics.get(leptons)
+
         def add_objects():
             self.vars_to_integrate.clear()
             self.integrator.next_event()
@@ -1300,22 +2122,16 @@ class MEAnalyzer(FilterAnalyzer):
             if event.cat in ["cat2", "cat3"]:
                 self.vars_to_integrate.push_back(MEM.PSVar.cos_qbar1)
                 self.vars_to_integrate.push_back(MEM.PSVar.phi_qbar1)
-            for jet in event.btagged_jets:
+            for (i, jet) in enumerate(jets):
                 self.add_obj(
                     MEM.ObjectType.Jet,
-                    p4s=(jet.pt, jet.eta, jet.phi, jet.mass),
+                    p4c=jets_kin.p4c(i),
                     obsdict={MEM.Observable.BTAG: jet.btagFlag}
                 )
-            for jet in event.wquark_candidate_jets:
-                self.add_obj(
-                    MEM.ObjectType.Jet,
-                    p4s=(jet.pt, jet.eta, jet.phi, jet.mass),
-                    obsdict={MEM.Observable.BTAG: jet.btagFlag}
-                )
-            for lep in leptons:
+            for (i, lep) in enumerate(leptons):
                 self.add_obj(
                     MEM.ObjectType.Lepton,
-                    p4s=(lep.pt, lep.eta, lep.phi, lep.mass),
+                    p4c=leptons_kin.p4c(i),
                     obsdict={MEM.Observable.CHARGE: lep.charge}
                 )
             self.add_obj(
@@ -1333,27 +2149,24 @@ class MEAnalyzer(FilterAnalyzer):
         res = {}
         for hypo in [MEM.Hypothesis.TTH, MEM.Hypothesis.TTBB]:
             for confname in self.memkeys:
-                if self.conf.mem["calcME"]:
-                    conf = self.configs[confname]
-                    #print "MEM conf", confname, "hypo", hypo
-                    print "MEM conf", hypo, confname
-                    self.integrator.set_cfg(conf)
-                    add_objects()
-                    r = self.integrator.run(
-                        fstate,
-                        hypo,
-                        self.vars_to_integrate
-                    )
-                    res[(hypo, confname)] = r
-                else:
-                    r = MEM.MEMOutput()
-                    res[(hypo, confname)] = r
+                conf = self.configs[confname]
+                #print "MEM conf", confname, "hypo", hypo
+                print "MEM conf", hypo, confname
+                self.integrator.set_cfg(conf)
+                add_objects()
+                r = self.integrator.run(
+                    fstate,
+                    hypo,
+                    self.vars_to_integrate
+                )
+                self.mem_calls += 1
+                res[(hypo, confname)] = r
 
         p1 = res[(MEM.Hypothesis.TTH, "default")].p
         p2 = res[(MEM.Hypothesis.TTBB, "default")].p
 
         #In case of an erroneous calculation, print out event kinematics
-        if self.conf.mem["calcME"] and (p1<=0 or p2<=0 or (p1 / (p1+0.02*p2))<0.0001):
+        if p1<=0 or p2<=0 or (p1 / (p1+0.02*p2))<0.0001:
             print "MEM BADPROB", p1, p2
 
         #print out full MEM result dictionary
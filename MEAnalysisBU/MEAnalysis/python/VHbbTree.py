@@ -490,35 +490,254 @@ class GenNuFromTop:
     @staticmethod
     def make_array(event):
         return [GenNuFromTop(event.input, i) for i in range(event.input.nGenNuFromTop)]
+class _BranchProbe(int):
+    """
+    Stand-in for a tree branch: behaves as a zero-length counter and
+    returns its own branch name when indexed.
+    """
+    def __new__(cls, name):
+        obj = int.__new__(cls, 0)
+        obj.name = name
+        return obj
+
+    def __getitem__(self, n):
+        return self.name
+
+class _TreeProbe(object):
+    """
+    Stand-in for a TTree which records the branches that are read from it.
+    """
+    def __init__(self):
+        self.read = []
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        self.read.append(name)
+        return _BranchProbe(name)
+
+class _EventProbe(object):
+    def __init__(self):
+        self.input = _TreeProbe()
+
+_schemas = {}
+def collection_schema(cls):
+    """
+    Returns (counter, fields) for a collection class, where counter is the
+    name of the multiplicity branch and fields is a dict of
+    {attribute: branch}. Generated classes (vhbb_classgen) declare it as
+    cls.schema, otherwise it is found by running the class on a probe tree.
+    """
+    if hasattr(cls, "schema"):
+        return cls.schema
+    if not _schemas.has_key(cls):
+        ev = _EventProbe()
+        cls.make_array(ev)
+        counter = ev.input.read[-1]
+        fields = dict(cls(_TreeProbe(), 0).__dict__)
+        _schemas[cls] = (counter, fields)
+    return _schemas[cls]
+
+def collection_branches(classes):
+    """
+    Returns the list of branches read by the collection classes.
+    """
+    branches = []
+    for cls in classes:
+        counter, fields = collection_schema(cls)
+        branches += [counter] + sorted(set(fields.values()))
+    return branches
+
+class LazyCollection(object):
+    """
+    A list of collection objects, which is built by calling loader() only
+    on first access and cached afterwards.
+    """
+    def __init__(self, loader):
+        self._loader = loader
+        self._items = None
+
+    def materialize(self):
+        if self._items is None:
+            self._items = self._loader()
+            self._loader = None
+        return self._items
+
+    def is_materialized(self):
+        return self._items is not None
+
+    def __len__(self):
+        return len(self.materialize())
+
+    def __iter__(self):
+        return iter(self.materialize())
+
+    def __getitem__(self, i):
+        return self.materialize()[i]
+
+    def __contains__(self, x):
+        return x in self.materialize()
+
+    def __nonzero__(self):
+        return len(self.materialize()) > 0
+
+    def __add__(self, other):
+        return self.materialize() + list(other)
+
+    def __radd__(self, other):
+        return list(other) + self.materialize()
+
+    def __eq__(self, other):
+        if isinstance(other, LazyCollection):
+            other = other.materialize()
+        return self.materialize() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def index(self, x):
+        return self.materialize().index(x)
+
+    def count(self, x):
+        return self.materialize().count(x)
+
+    def __repr__(self):
+        if self._items is None:
+            return "LazyCollection(<not read>)"
+        return "LazyCollection({0})".format(repr(self._items))
+
 from PhysicsTools.HeppyCore.framework.analyzer import Analyzer
+from TTH.MEAnalysis.kinematics import KinematicsCache
 class EventAnalyzer(Analyzer):
+    """
+    Reads the VHbb collections from event.input (TTree) to event.XYZ.
+
+    Configuration:
+    cfg_ana.batchSize (int): if > 0, the collections are read for blocks of
+        batchSize entries at once into numpy arrays (TTH.MEAnalysis.columnar)
+        and event.XYZ are lists of per-particle views into these arrays.
+        If the events class reads a subset of the entries, the block holds
+        the next batchSize entries of tree.entry_list (see entrylists).
+        Otherwise, the collections are built particle-by-particle.
+    cfg_ana.lazy (bool, default False): event.XYZ are LazyCollection proxies,
+        which are read on first access, such that events rejected by a
+        filter before using a collection do not pay for reading it.
+
+    If event.input is a columnar store (TTH.MEAnalysis.columnstore), the
+    collections are views into its memory-mapped arrays.
+
+    With batchSize > 0, event.batch is the columnar.EventBatch of the
+    current block and event.batch_index the position of the event in it,
+    such that the following analyzers can select the whole block at once
+    with their process_batch method.
+
+    event.kinematics is a new TTH.MEAnalysis.kinematics.KinematicsCache for
+    every event, which holds the four-momenta of the particle lists used by
+    the analyzers.
+    """
+
+    #Collections which are put to the event, the name is the class name
+    collections = [
+        #GenBQuarkFromHafterISR,
+        #hJidx_sortcsv,
+        #aJCidx,
+        GenLepFromTop,
+        #GenVbosons,
+        #GenJet,
+        #GenHiggsBoson,
+        GenBQuarkFromH,
+        #hJCidx,
+        #GenTop,
+        #aJidx,
+        #hJets,
+        #GenLepFromTau,
+        #aLeptons,
+        #aJets,
+        selLeptons,
+        #hJ3Cidx,
+        #hJidx,
+        #TauGood,
+        #GenLep,
+        Jet,
+        #vLeptons,
+        #aJ3Cidx,
+        GenWZQuark,
+        GenBQuarkFromTop,
+        GenNuFromTop,
+        httCandidate,
+    ]
+
     def __init__(self, cfg_ana, cfg_comp, looperName):
         super(EventAnalyzer, self).__init__(cfg_ana, cfg_comp, looperName)
+        self.batchSize = getattr(cfg_ana, "batchSize", 0)
+        self.lazy = getattr(cfg_ana, "lazy", False)
+        self.block = None
+        self.batch = None
+
+    def read_block(self, event):
+        """
+        Returns the ColumnBlock containing the current entry of event.input,
+        reading the next batchSize entries if needed.
+        """
+        from TTH.MEAnalysis.columnar import ColumnBlock
+        tree = event.input
+        entry = tree.GetReadEntry()
+        if hasattr(tree, "column_block"):
+            return tree.column_block, entry
+        if self.block is None or self.block.source is not tree or not entry in self.block:
+            #events classes which read a subset of the entries give them in
+            #reading order as tree.entry_list, only the next batchSize of
+            #them are read instead of all the entries in between
+            entries = getattr(tree, "entry_list", None)
+            if entries is not None:
+                entries = entries[event.iEv:event.iEv + self.batchSize]
+            self.block = ColumnBlock.load(tree, entry, entry + self.batchSize, self.collections,
+                entries=entries
+            )
+            #the following analyzers expect the tree at the current entry
+            tree.GetEntry(entry)
+        return self.block, entry
+
+    def make_loader(self, event, cls):
+        """
+        Returns a function which reads the collection cls of the current entry.
+        """
+        if self.batchSize > 0 or hasattr(event.input, "column_block"):
+            def loader():
+                block, entry = self.read_block(event)
+                return block.collection(cls.__name__, entry)
+        else:
+            def loader():
+                return cls.make_array(event)
+        return loader
+
+    def set_batch(self, event):
+        """
+        Sets event.batch and event.batch_index for the current entry.
+        """
+        from TTH.MEAnalysis.columnar import EventBatch
+        block, entry = self.read_block(event)
+        pos = block.position(entry)
+        batch = self.batch
+        if batch is None or batch.block is not block or not pos in batch:
+            batch = EventBatch(block, pos, pos + self.batchSize)
+            self.batch = batch
+        event.batch = batch
+        event.batch_index = pos - batch.start
+
     def process(self, event):
-        #event.GenBQuarkFromHafterISR = GenBQuarkFromHafterISR.make_array(event)
-        #event.hJidx_sortcsv = hJidx_sortcsv.make_array(event)
-        #event.aJCidx = aJCidx.make_array(event)
-        event.GenLepFromTop = GenLepFromTop.make_array(event)
-        #event.GenVbosons = GenVbosons.make_array(event)
-        #event.GenJet = GenJet.make_array(event)
-        #event.GenHiggsBoson = GenHiggsBoson.make_array(event)
-        event.GenBQuarkFromH = GenBQuarkFromH.make_array(event)
-        #event.hJCidx = hJCidx.make_array(event)
-        #event.GenTop = GenTop.make_array(event)
-        #event.aJidx = aJidx.make_array(event)
-        #event.hJets = hJets.make_array(event)
-        #event.GenLepFromTau = GenLepFromTau.make_array(event)
-        #event.aLeptons = aLeptons.make_array(event)
-        #event.aJets = aJets.make_array(event)
-        event.selLeptons = selLeptons.make_array(event)
-        #event.hJ3Cidx = hJ3Cidx.make_array(event)
-        #event.hJidx = hJidx.make_array(event)
-        #event.TauGood = TauGood.make_array(event)
-        #event.GenLep = GenLep.make_array(event)
-        event.Jet = Jet.make_array(event)
-        #event.vLeptons = vLeptons.make_array(event)
-        #event.aJ3Cidx = aJ3Cidx.make_array(event)
-        event.GenWZQuark = GenWZQuark.make_array(event)
-        event.GenBQuarkFromTop = GenBQuarkFromTop.make_array(event)
-        event.GenNuFromTop = GenNuFromTop.make_array(event)
-        event.httCandidate = httCandidate.make_array(event)
+        if self.batchSize > 0:
+            self.set_batch(event)
+        event.kinematics = KinematicsCache()
+        for cls in self.collections:
+            loader = self.make_loader(event, cls)
+            if self.lazy:
+                setattr(event, cls.__name__, LazyCollection(loader))
+            else:
+                setattr(event, cls.__name__, loader())
+
+#Branches of the input tree read by EventAnalyzer
+EventAnalyzer.input_branches = collection_branches(EventAnalyzer.collections)
+#Event attributes read and set by EventAnalyzer, see TTH.MEAnalysis.scheduling
+EventAnalyzer.consumes = ["input"]
+EventAnalyzer.produces = [cls.__name__ for cls in EventAnalyzer.collections] + ["kinematics"]
@@ -0,0 +1,379 @@
+"""
+Columnar access to the VHbb ntuple collections.
+
+A ColumnBlock holds a range of consecutive TTree entries, or a list of
+entries, of a set of VHbbTree collections as flat numpy arrays, one array
+per branch, with jagged offsets per collection. Analyzers see the
+particles of one event through ColumnRecord views, which behave like the
+VHbbTree objects.
+
+An EventBatch is a range of positions of a block which is passed to the
+vectorized FilterAnalyzer.process_batch methods, see run_batch.
+"""
+import numpy as np
+
+try:
+    import root_numpy
+except ImportError:
+    root_numpy = None
+
+from TTH.MEAnalysis.VHbbTree import collection_schema
+
+#ROOT leaf type name -> numpy dtype
+leaf_dtypes = {
+    "Bool_t": np.bool_,
+    "Char_t": np.int8,
+    "UChar_t": np.uint8,
+    "Short_t": np.int16,
+    "UShort_t": np.uint16,
+    "Int_t": np.int32,
+    "UInt_t": np.uint32,
+    "Long64_t": np.int64,
+    "ULong64_t": np.uint64,
+    "Float_t": np.float32,
+    "Double_t": np.float64,
+}
+
+def branch_dtype(tree, branch):
+    leaf = tree.GetLeaf(branch)
+    if leaf == None:
+        raise KeyError("branch {0} not found in tree".format(branch))
+    return leaf_dtypes.get(leaf.GetTypeName(), np.float64)
+
+def draw_columns(tree, exprs, selection=""):
+    """
+    Evaluates up to 4 expressions for all the entries of tree passing the
+    selection with TTree::Draw and returns them as a list of float64 arrays.
+    """
+    n = int(tree.GetEntries())
+    tree.SetEstimate(n + 1)
+    nsel = int(tree.Draw(":".join(exprs), selection, "goff"))
+    getters = [tree.GetV1, tree.GetV2, tree.GetV3, tree.GetV4]
+    ret = []
+    for i in range(len(exprs)):
+        buf = getters[i]()
+        if nsel <= 0 or buf == None:
+            ret += [np.zeros(0)]
+            continue
+        buf.SetSize(nsel)
+        ret += [np.frombuffer(buf, dtype=np.float64, count=nsel).copy()]
+    return ret
+
+def offsets_from_counts(counts):
+    """
+    Converts per-event multiplicities to jagged offsets [0, c0, c0+c1, ...].
+    """
+    offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return offsets
+
+class ColumnRecord(object):
+    """
+    A single particle of a collection in a ColumnBlock.
+
+    Attributes of the collection are read from the column arrays on first
+    access and cached, other attributes can be set as on any python object.
+    """
+    def __init__(self, block, collection, index):
+        self._block = block
+        self._fields = block.fields[collection]
+        self._index = index
+
+    def __getattr__(self, attr):
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        try:
+            branch = self._fields[attr]
+        except KeyError:
+            raise AttributeError(attr)
+        val = self._block.columns[branch][self._index].item()
+        self.__dict__[attr] = val
+        return val
+
+class ColumnBlock(object):
+    """
+    The collections of the TTree entries [start, stop), or of the listed
+    entries, as numpy arrays. The entries are stored at consecutive
+    positions of the block, in the order in which they are read.
+
+    columns (dict of branch -> array): flat branch contents of the block
+    offsets (dict of collection -> array): per-position offsets into columns,
+        position i of collection c spans columns[b][offsets[c][i]:offsets[c][i+1]]
+    fields (dict of collection -> dict): attribute -> branch name
+    scalars (list of str): branches with one value per entry, also in columns
+    entries (array or None): the entries at each position if not a range
+    """
+    def __init__(self, start, stop, source=None, entries=None):
+        self.start = start
+        self.stop = stop
+        self.source = source
+        self.columns = {}
+        self.offsets = {}
+        self.fields = {}
+        self.scalars = []
+        self.entries = None
+        self.positions = None
+        if entries is not None:
+            self.entries = np.asarray(entries, dtype=np.int64)
+            self.positions = dict([(int(e), i) for (i, e) in enumerate(self.entries)])
+
+    def __len__(self):
+        if self.entries is not None:
+            return len(self.entries)
+        return self.stop - self.start
+
+    def __contains__(self, entry):
+        if self.positions is not None:
+            return self.positions.has_key(entry)
+        return self.start <= entry < self.stop
+
+    def position(self, entry):
+        """
+        Returns the position of a tree entry in the block.
+        """
+        if self.positions is not None:
+            return self.positions[entry]
+        return entry - self.start
+
+    def entry(self, i):
+        """
+        Returns the tree entry at position i of the block.
+        """
+        if self.entries is not None:
+            return int(self.entries[i])
+        return self.start + i
+
+    def counts(self, collection):
+        return np.diff(self.offsets[collection])
+
+    def collection(self, name, entry):
+        """
+        Returns the list of ColumnRecord of the collection for a single entry.
+        """
+        i = self.position(entry)
+        offsets = self.offsets[name]
+        return [ColumnRecord(self, name, k) for k in xrange(offsets[i], offsets[i+1])]
+
+    def scalar(self, branch, entry):
+        return self.columns[branch][self.position(entry)].item()
+
+    def column(self, name, attr, entry=None):
+        """
+        Returns the array of a collection attribute, for all entries in the
+        block or for a single entry.
+        """
+        col = self.columns[self.fields[name][attr]]
+        if entry is None:
+            return col
+        i = self.position(entry)
+        offsets = self.offsets[name]
+        return col[offsets[i]:offsets[i+1]]
+
+    @staticmethod
+    def load(tree, start, stop, classes, scalars=[], entries=None):
+        """
+        Reads the entries [start, stop) of the VHbbTree collection classes
+        and of the scalar branches from tree, or only the given entries (in
+        their order) if entries is not None, e.g. the next entries of an
+        entry list. The tree is left positioned at an arbitrary entry.
+        """
+        if entries is not None:
+            entries = np.asarray(entries, dtype=np.int64)
+            #a contiguous list is read as a range
+            if len(entries) > 0 and np.array_equal(entries, np.arange(entries[0], entries[0] + len(entries))):
+                start, stop, entries = int(entries[0]), int(entries[0]) + len(entries), None
+        if entries is not None:
+            block = ColumnBlock(None, None, tree, entries)
+        else:
+            stop = min(stop, int(tree.GetEntries()))
+            block = ColumnBlock(start, stop, tree)
+        block.scalars = list(scalars)
+        schemas = {}
+        for cls in classes:
+            schemas[cls.__name__] = collection_schema(cls)
+            block.fields[cls.__name__] = schemas[cls.__name__][1]
+
+        #root_numpy reads ranges, the listed entries are read one by one
+        if root_numpy != None and block.entries is None:
+            block._load_root_numpy(tree, schemas)
+        else:
+            block._load_buffers(tree, schemas)
+        return block
+
+    def _load_root_numpy(self, tree, schemas):
+        branches = []
+        for (counter, fields) in schemas.values():
+            branches += [counter] + sorted(set(fields.values()))
+        branches += self.scalars
+        arr = root_numpy.tree2array(tree, branches=branches,
+            start=self.start, stop=self.stop
+        )
+        for branch in self.scalars:
+            self.columns[branch] = np.array(arr[branch])
+        for (name, (counter, fields)) in schemas.items():
+            self.offsets[name] = offsets_from_counts(arr[counter])
+            for branch in set(fields.values()):
+                if len(arr) > 0:
+                    self.columns[branch] = np.concatenate(arr[branch])
+                else:
+                    self.columns[branch] = np.zeros(0)
+
+    def _load_buffers(self, tree, schemas):
+        n = len(self)
+        chunks = {}
+        counts = {}
+        dtypes = {}
+        for (name, (counter, fields)) in schemas.items():
+            counts[name] = np.zeros(n, dtype=np.int64)
+            for branch in fields.values():
+                chunks[branch] = []
+
+        for i in xrange(n):
+            tree.GetEntry(self.entry(i))
+            if i == 0:
+                for branch in chunks.keys():
+                    dtypes[branch] = branch_dtype(tree, branch)
+                for branch in self.scalars:
+                    self.columns[branch] = np.zeros(n, dtype=branch_dtype(tree, branch))
+            for branch in self.scalars:
+                self.columns[branch][i] = getattr(tree, branch)
+            for (name, (counter, fields)) in schemas.items():
+                c = int(getattr(tree, counter))
+                counts[name][i] = c
+                for branch in fields.values():
+                    #copy the whole branch buffer at once instead of indexing it per element
+                    buf = getattr(tree, branch)
+                    if hasattr(buf, "SetSize"):
+                        buf.SetSize(c)
+                    chunks[branch].append(np.frombuffer(buf, dtype=dtypes[branch], count=c).copy())
+
+        for (name, (counter, fields)) in schemas.items():
+            self.offsets[name] = offsets_from_counts(counts[name])
+        for (branch, chunk) in chunks.items():
+            if len(chunk) > 0:
+                self.columns[branch] = np.concatenate(chunk)
+            else:
+                self.columns[branch] = np.zeros(0)
+
+def jagged_pairs(offsets_a, offsets_b):
+    """
+    Returns the flat indices (ia, ib) of all the pairs of elements of two
+    jagged collections within the same event, and the event of each pair.
+    Pairs are ordered by event, then by ia, then by ib.
+    """
+    na = np.diff(offsets_a)
+    nb = np.diff(offsets_b)
+    npairs = na * nb
+    ev = np.repeat(np.arange(len(na)), npairs)
+    first = offsets_from_counts(npairs)[:-1]
+    k = np.arange(len(ev)) - first[ev]
+    ia = offsets_a[:-1][ev] + k // np.maximum(nb[ev], 1)
+    ib = offsets_b[:-1][ev] + k % np.maximum(nb[ev], 1)
+    return ia, ib, ev
+
+def triu_pairs(offsets):
+    """
+    Returns the flat indices (ia, ib) with ia < ib of all the pairs of
+    elements of a jagged collection within the same event, and the event of
+    each pair, in the order of np.triu_indices within each event.
+    """
+    ia, ib, ev = jagged_pairs(offsets, offsets)
+    sel = ia < ib
+    return ia[sel], ib[sel], ev[sel]
+
+class EventBatch(object):
+    """
+    The positions [start, stop) of a ColumnBlock as columnar arrays,
+    passed to FilterAnalyzer.process_batch. The events of the batch are
+    indexed from 0 to len(batch).
+
+    values (dict of str -> array): per-event or per-particle results of the
+        analyzers which already processed the batch, e.g. "is_sl", "numJets"
+    masks (dict of analyzer name -> bool array or None): the events passing
+        each analyzer, None if the analyzer has no batch version
+    """
+    def __init__(self, block, start, stop):
+        self.block = block
+        self.start = start
+        self.stop = min(stop, len(block))
+        self.values = {}
+        self.masks = {}
+        self._offsets = {}
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __contains__(self, position):
+        return self.start <= position < self.stop
+
+    def offsets(self, collection):
+        """
+        Returns the offsets of the collection relative to the first event of the batch.
+        """
+        if not self._offsets.has_key(collection):
+            o = self.block.offsets[collection][self.start:self.stop + 1]
+            self._offsets[collection] = np.asarray(o - o[0], dtype=np.int64)
+        return self._offsets[collection]
+
+    def counts(self, collection):
+        return np.diff(self.offsets(collection))
+
+    def event_index(self, collection):
+        """
+        Returns the event (relative to start) of every particle of the collection.
+        """
+        return np.repeat(np.arange(len(self)), self.counts(collection))
+
+    def column(self, collection, attr):
+        """
+        Returns the flat array of a collection attribute for the batch. The
+        floating point attributes are returned as float64, such that they
+        compare to the cuts as the python floats of the ColumnRecords.
+        """
+        o = self.block.offsets[collection]
+        first = o[self.start]
+        last = o[self.stop]
+        col = np.asarray(self.block.columns[self.block.fields[collection][attr]][first:last])
+        if col.dtype.kind == "f":
+            col = col.astype(np.float64)
+        return col
+
+    def scalar(self, branch):
+        return np.asarray(self.block.columns[branch][self.start:self.stop])
+
+    def count(self, collection, mask):
+        """
+        Returns the per-event number of particles of the collection passing the mask.
+        """
+        return np.bincount(self.event_index(collection)[mask], minlength=len(self))
+
+    def mask(self, analyzer):
+        """
+        Returns the pass mask of the analyzer, running its process_batch on
+        the first call.
+        """
+        if not self.masks.has_key(analyzer.name):
+            self.masks[analyzer.name] = analyzer.process_batch(self)
+        return self.masks[analyzer.name]
+
+def run_batch(analyzer, process, event):
+    """
+    Processes an event with the analyzer using the batch version of the
+    analyzer (process_batch) if it has one for the batch of the event:
+    analyzer.count_batch increments the counters of the event, the events
+    failing the batch selection are rejected and the attributes of the
+    passing events are set from the batch results by analyzer.fill_event,
+    such that neither the counters nor the event attributes depend on the
+    batching. Other events are processed with the per-event process method.
+    """
+    batch = getattr(event, "batch", None)
+    if batch is None:
+        return process(event)
+    mask = batch.mask(analyzer)
+    if mask is None:
+        return process(event)
+    analyzer.count_batch(batch, event.batch_index)
+    if not mask[event.batch_index]:
+        return False
+    analyzer.fill_event(event, batch, event.batch_index)
+    return True
@@ -0,0 +1,209 @@
+"""
+On-disk columnar store of the VHbb ntuple branches used by the analysis.
+
+The store is converted once from the ntuples of a sample and is a directory
+with one .npy file per branch, one <collection>.offsets.npy file per jagged
+collection and a meta.json file describing the layout:
+    entries (int): number of events
+    collections (dict): collection -> {"counter": nXYZ, "fields": {attr: branch}}
+    scalars (list of str): branches with one value per event
+    files (list of str): the converted input files
+
+The arrays are opened with numpy memory mapping, such that repeated passes
+over the store read the pages from the OS file cache without decompression.
+ColumnStoreEvents is an events_class for the heppy looper reading a store,
+EventAnalyzer reads the collections from its ColumnBlock.
+
+Usage:
+python columnstore.py --out /path/to/store file1.root [file2.root ...]
+"""
+import argparse, json, os
+import numpy as np
+import ROOT
+
+from TTH.MEAnalysis.VHbbTree import EventAnalyzer, collection_schema
+from TTH.MEAnalysis.columnar import ColumnBlock, branch_dtype, draw_columns
+
+#Branches with one value per event, read by the analyzers and the tree producer
+default_scalars = [
+    "run", "lumi", "evt", "xsec", "nTrueInt", "puWeight", "genWeight",
+    "numJets", "lheNj", "lheNb", "lheNc", "lheNg", "met_pt", "met_phi",
+]
+
+def branch_path(path, branch):
+    return os.path.join(path, branch + ".npy")
+
+def offsets_path(path, collection):
+    return os.path.join(path, collection + ".offsets.npy")
+
+def convert(files, path, tree_name="tree", classes=EventAnalyzer.collections,
+    scalars=default_scalars, block_size=10000):
+    """
+    Converts the collections and scalar branches of the input files to a
+    store in the directory path. Scalar branches which are not in the tree
+    are skipped. Returns the number of converted events.
+    """
+    chain = ROOT.TChain(tree_name)
+    for fn in files:
+        chain.Add(fn)
+    n = int(chain.GetEntries())
+    chain.GetEntry(0)
+    scalars = [b for b in scalars if chain.GetBranch(b) != None]
+    schemas = dict([(cls.__name__, collection_schema(cls)) for cls in classes])
+
+    chain.SetBranchStatus("*", False)
+    for (counter, fields) in schemas.values():
+        for branch in [counter] + fields.values():
+            chain.SetBranchStatus(branch, True)
+    for branch in scalars:
+        chain.SetBranchStatus(branch, True)
+
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    #first pass over the counters only, to size the output arrays
+    open_memmap = np.lib.format.open_memmap
+    offsets = {}
+    columns = {}
+    for (name, (counter, fields)) in schemas.items():
+        counts = draw_columns(chain, [counter])[0].astype(np.int64)
+        offsets[name] = open_memmap(offsets_path(path, name), mode="w+",
+            dtype=np.int64, shape=(n + 1, )
+        )
+        offsets[name][0] = 0
+        np.cumsum(counts, out=offsets[name][1:])
+        total = int(offsets[name][-1])
+        for branch in set(fields.values()):
+            columns[branch] = open_memmap(branch_path(path, branch), mode="w+",
+                dtype=branch_dtype(chain, branch), shape=(total, )
+            )
+    for branch in scalars:
+        columns[branch] = open_memmap(branch_path(path, branch), mode="w+",
+            dtype=branch_dtype(chain, branch), shape=(n, )
+        )
+
+    #second pass, filling the arrays block by block
+    for start in xrange(0, n, block_size):
+        block = ColumnBlock.load(chain, start, start + block_size, classes, scalars)
+        for branch in scalars:
+            columns[branch][block.start:block.stop] = block.columns[branch]
+        for (name, (counter, fields)) in schemas.items():
+            first = int(offsets[name][block.start])
+            last = int(offsets[name][block.stop])
+            for branch in set(fields.values()):
+                columns[branch][first:last] = block.columns[branch]
+    for arr in columns.values() + offsets.values():
+        arr.flush()
+
+    meta = {
+        "entries": n,
+        "collections": dict([
+            (name, {"counter": counter, "fields": fields})
+            for (name, (counter, fields)) in schemas.items()
+        ]),
+        "scalars": scalars,
+        "files": list(files),
+    }
+    of = open(os.path.join(path, "meta.json"), "w")
+    of.write(json.dumps(meta, indent=2))
+    of.close()
+    return n
+
+class _ArrayDict(dict):
+    """
+    Dict of arrays which memory-maps each file on first access.
+    """
+    def __init__(self, path_func):
+        self.path_func = path_func
+
+    def __missing__(self, key):
+        arr = np.load(self.path_func(key), mmap_mode="r")
+        self[key] = arr
+        return arr
+
+class ColumnStore(object):
+    """
+    A converted store, exposing all the events as a single ColumnBlock.
+    """
+    def __init__(self, path):
+        self.path = path
+        inf = open(os.path.join(path, "meta.json"))
+        self.meta = json.load(inf)
+        inf.close()
+        self.entries = self.meta["entries"]
+        self.scalars = set(self.meta["scalars"])
+
+        self.block = ColumnBlock(0, self.entries, self)
+        self.block.columns = _ArrayDict(lambda b: branch_path(path, b))
+        self.block.offsets = _ArrayDict(lambda c: offsets_path(path, c))
+        self.block.scalars = self.meta["scalars"]
+        for (name, coll) in self.meta["collections"].items():
+            self.block.fields[str(name)] = dict([
+                (str(attr), str(branch)) for (attr, branch) in coll["fields"].items()
+            ])
+
+    def __len__(self):
+        return self.entries
+
+class ColumnStoreEntry(object):
+    """
+    Stands in for the TTree as event.input: the scalar branches are read
+    as attributes of the current entry, the collections are in column_block.
+    """
+    def __init__(self, store):
+        self.store = store
+        self.column_block = store.block
+        self.entry = -1
+
+    def GetEntry(self, entry):
+        self.entry = entry
+
+    def GetReadEntry(self):
+        return self.entry
+
+    def GetEntries(self):
+        return self.store.entries
+
+    def GetTreeNumber(self):
+        return 0
+
+    def __getattr__(self, name):
+        if name.startswith("_") or not name in self.store.scalars:
+            raise AttributeError(name)
+        return self.column_block.scalar(name, self.entry)
+
+class ColumnStoreEvents(object):
+    """
+    events_class for the heppy looper reading the stores given as the
+    component files, which are processed one after the other.
+    """
+    def __init__(self, files, tree_name=None):
+        self.stores = [ColumnStore(path) for path in files]
+        self.inputs = [ColumnStoreEntry(store) for store in self.stores]
+        self.offsets = [0]
+        for store in self.stores:
+            self.offsets += [self.offsets[-1] + len(store)]
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def __getitem__(self, index):
+        for i in range(len(self.stores)):
+            if index < self.offsets[i + 1]:
+                self.inputs[i].GetEntry(index - self.offsets[i])
+                return self.inputs[i]
+        raise IndexError(index)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Converts VHbb ntuples to a columnar store")
+    parser.add_argument("files", type=str, nargs="+", help="input ROOT files")
+    parser.add_argument("--out", type=str, required=True, help="output directory")
+    parser.add_argument("--tree", type=str, default="tree", help="name of the TTree")
+    parser.add_argument("--block-size", type=int, default=10000, help="entries read at once")
+    parser.add_argument("--scalars", type=str, nargs="*", default=default_scalars,
+        help="branches with one value per event"
+    )
+    args = parser.parse_args()
+
+    n = convert(args.files, args.out, args.tree, scalars=args.scalars, block_size=args.block_size)
+    print "converted {0} events to {1}".format(n, args.out)
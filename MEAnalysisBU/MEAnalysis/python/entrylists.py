@@ -0,0 +1,348 @@
+"""
+Cache of the entries of the input files which pass the event selection,
+and per-file (run, lumi, evt) indices to read whitelisted events directly.
+
+The passing entry numbers of a file are stored as an .npy index, keyed on
+the fingerprint of the file (ROOT UUID, size and number of entries) and
+on a hash of the selection configuration (Conf.leptons and the jet pt
+and eta cuts). The indices are written by the skim stage
+(MEAnalysis_skim.py), later runs with an unchanged selection read only the
+surviving entries with SkimmedChain.
+
+The event indices are built once per file from the run, lumi and evt
+branches and used by EventIDChain to seek to the events of
+Conf.general["eventWhitelist"].
+
+SampledChain reads a seeded random subset of the entries of all files,
+optionally stratified by e.g. the jet multiplicity, for short test runs
+which are representative of the whole sample. Jobs which each process a
+part of a sample use their own seed (job_seed), such that they do not all
+draw the same subset.
+"""
+import hashlib, json, os
+import numpy as np
+import ROOT
+
+def file_fingerprint(pfn, tree_name="tree"):
+    """
+    Returns a string identifying the contents of a ROOT file.
+    """
+    tf = ROOT.TFile.Open(pfn)
+    if tf == None or tf.IsZombie():
+        raise IOError("could not open {0}".format(pfn))
+    tree = tf.Get(tree_name)
+    nentries = int(tree.GetEntries()) if tree != None else -1
+    fp = "{0}|{1}|{2}".format(tf.GetUUID().AsString(), int(tf.GetSize()), nentries)
+    tf.Close()
+    return fp
+
+def selection_hash(conf):
+    """
+    Returns a hash of the configuration of the event selection, i.e. of the
+    keys read by the selection of LeptonAnalyzer and JetAnalyzer, such that
+    e.g. changing the b-tag working point or the W mass keeps the skims.
+    """
+    sel = {
+        "leptons": conf.leptons,
+        "jets": dict([(k, conf.jets[k]) for k in ["pt", "eta"]]),
+    }
+    return hashlib.sha1(json.dumps(sel, sort_keys=True, default=str)).hexdigest()[:16]
+
+class EntryListCache(object):
+    """
+    Directory of the .npy entry indices.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, fingerprint, selection):
+        return os.path.join(self.cache_dir, "{0}_{1}.npy".format(
+            hashlib.sha1(fingerprint).hexdigest(), selection
+        ))
+
+    def load(self, fingerprint, selection):
+        """
+        Returns the sorted array of passing entries, or None if the file
+        has not been skimmed with this selection.
+        """
+        path = self.path(fingerprint, selection)
+        if not os.path.isfile(path):
+            return None
+        return np.load(path)
+
+    def save(self, fingerprint, selection, entries):
+        path = self.path(fingerprint, selection)
+        #write to a temporary file first, such that concurrent jobs never read a partial index
+        tmp = "{0}.{1}.tmp".format(path, os.getpid())
+        of = open(tmp, "wb")
+        np.save(of, np.array(sorted(entries), dtype=np.int64))
+        of.close()
+        os.rename(tmp, path)
+
+class EntryListChain(object):
+    """
+    Reads a subset of the entries of the component files, as returned by
+    file_entries for each file. Behaves as the heppy Chain for the looper.
+    """
+    def __init__(self, files, tree_name=None):
+        if tree_name is None:
+            tree_name = "tree"
+        self.files = files
+        self.tree_name = tree_name
+        self.chain = ROOT.TChain(tree_name)
+        entries = []
+        offset = 0
+        for fn in files:
+            self.chain.Add(fn)
+            fp = file_fingerprint(fn, tree_name)
+            nentries = int(fp.split("|")[-1])
+            index = self.file_entries(fn, fp, nentries)
+            if index is None:
+                index = np.arange(nentries, dtype=np.int64)
+            entries += [index + offset]
+            offset += nentries
+        if len(entries) > 0:
+            self.entries = np.concatenate(entries)
+        else:
+            self.entries = np.zeros(0, dtype=np.int64)
+        self.nentries_total = offset
+        #the entries in reading order, for the batch reading of EventAnalyzer
+        self.chain.entry_list = self.entries
+
+    def file_entries(self, fn, fingerprint, nentries):
+        """
+        Returns the sorted array of entries to read from a file, None for all.
+        """
+        return None
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __getitem__(self, index):
+        self.chain.GetEntry(int(self.entries[index]))
+        return self.chain
+
+class SkimmedChain(EntryListChain):
+    """
+    Reads only the entries of the component files passing the selection,
+    as found in the EntryListCache. Files without an index for the current
+    selection are read completely.
+
+    Use make_skimmed_chain to configure the cache and the selection.
+    """
+    cache = None
+    selection = None
+
+    def __init__(self, files, tree_name=None):
+        self.nskimmed = 0
+        super(SkimmedChain, self).__init__(files, tree_name)
+        print "SkimmedChain: {0} of {1} entries selected, {2}/{3} files skimmed".format(
+            len(self.entries), self.nentries_total, self.nskimmed, len(files)
+        )
+
+    def file_entries(self, fn, fingerprint, nentries):
+        index = self.cache.load(fingerprint, self.selection)
+        if index is None:
+            print "SkimmedChain: no entry list for {0}, reading all entries".format(fn)
+        else:
+            self.nskimmed += 1
+        return index
+
+def make_skimmed_chain(cache_dir, selection):
+    """
+    Returns a SkimmedChain class using the entry lists in cache_dir for
+    the selection hash, to be used as the events_class of the heppy configuration.
+    """
+    class _SkimmedChain(SkimmedChain):
+        pass
+    _SkimmedChain.cache = EntryListCache(cache_dir)
+    _SkimmedChain.selection = selection
+    return _SkimmedChain
+
+def build_event_index(tree):
+    """
+    Returns the (run, lumi, evt) of all entries of tree as an (N, 3) int64
+    array, reading only these branches in one TTree::Draw pass.
+    """
+    from TTH.MEAnalysis.columnar import draw_columns
+    cols = draw_columns(tree, ["run", "lumi", "evt"])
+    index = np.zeros((len(cols[0]), 3), dtype=np.int64)
+    for i in range(3):
+        #rounding, as the values are evaluated as doubles
+        index[:, i] = np.rint(cols[i])
+    return index
+
+class EventIndexCache(object):
+    """
+    Directory of the per-file (run, lumi, evt) indices, built on first use.
+    """
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def path(self, fingerprint):
+        return os.path.join(self.cache_dir, "{0}_evtid.npy".format(
+            hashlib.sha1(fingerprint).hexdigest()
+        ))
+
+    def get(self, fn, fingerprint, tree_name="tree"):
+        """
+        Returns the event index of the file fn, building and storing it if needed.
+        """
+        path = self.path(fingerprint)
+        if os.path.isfile(path):
+            return np.load(path)
+        tf = ROOT.TFile.Open(fn)
+        index = build_event_index(tf.Get(tree_name))
+        tf.Close()
+        tmp = "{0}.{1}.tmp".format(path, os.getpid())
+        of = open(tmp, "wb")
+        np.save(of, index)
+        of.close()
+        os.rename(tmp, path)
+        return index
+
+def id_keys(ids):
+    """
+    Returns the rows of an (N, 3) array of (run, lumi, evt) as single
+    values, which can be compared and sorted in one pass.
+    """
+    ids = np.ascontiguousarray(ids, dtype=np.int64)
+    return ids.view(np.dtype((np.void, ids.dtype.itemsize * 3))).ravel()
+
+def find_events(index, events):
+    """
+    Returns the sorted entries of an event index matching any of the
+    (run, lumi, evt) tuples in events.
+    """
+    events = np.array(list(events), dtype=np.int64).reshape(-1, 3)
+    match = np.in1d(id_keys(index), id_keys(events))
+    return np.nonzero(match)[0].astype(np.int64)
+
+class EventIDChain(EntryListChain):
+    """
+    Reads only the entries of the component files with (run, lumi, evt) in
+    the whitelist, found with the event indices of the files.
+
+    Use make_eventid_chain to configure the index directory and the whitelist.
+    """
+    cache = None
+    whitelist = []
+
+    def __init__(self, files, tree_name=None):
+        super(EventIDChain, self).__init__(files, tree_name)
+        print "EventIDChain: found {0} of {1} whitelisted events".format(
+            len(self.entries), len(self.whitelist)
+        )
+
+    def file_entries(self, fn, fingerprint, nentries):
+        return find_events(self.cache.get(fn, fingerprint, self.tree_name), self.whitelist)
+
+def make_eventid_chain(cache_dir, whitelist):
+    """
+    Returns an EventIDChain class using the event indices in cache_dir for
+    the list of (run, lumi, evt), to be used as the events_class of the heppy configuration.
+    """
+    class _EventIDChain(EventIDChain):
+        pass
+    _EventIDChain.cache = EventIndexCache(cache_dir)
+    _EventIDChain.whitelist = list(whitelist)
+    return _EventIDChain
+
+def sample_entries(keys, n, seed):
+    """
+    Returns a reproducible random subset of n of the entries 0..len(keys)-1
+    as a sorted array. If keys is an array of per-entry values (e.g. the jet
+    multiplicity), the entries are sampled in each stratum of equal key in
+    proportion to its size (largest remainder rounding), otherwise keys is
+    the number of entries.
+    """
+    rng = np.random.RandomState(seed)
+    if not hasattr(keys, "__len__"):
+        keys = np.zeros(int(keys), dtype=np.int64)
+    ntot = len(keys)
+    if n >= ntot:
+        return np.arange(ntot, dtype=np.int64)
+
+    strata, inverse = np.unique(keys, return_inverse=True)
+    sizes = np.bincount(inverse)
+    quota = sizes * float(n) / ntot
+    alloc = np.floor(quota).astype(np.int64)
+    order = np.argsort(-(quota - alloc), kind="mergesort")
+    alloc[order[:n - alloc.sum()]] += 1
+
+    selected = []
+    for k in range(len(strata)):
+        idx = np.nonzero(inverse == k)[0]
+        selected += [rng.choice(idx, alloc[k], replace=False)]
+    return np.sort(np.concatenate(selected)).astype(np.int64)
+
+class SampledChain(EntryListChain):
+    """
+    Reads a seeded random subset of nevents entries spread over all the
+    component files, optionally stratified by the value of a cheap
+    per-entry expression such as the number of jets (stratify).
+
+    Use make_sampled_chain to configure the sampling.
+    """
+    nevents = 0
+    seed = 1
+    stratify = None
+
+    def __init__(self, files, tree_name=None):
+        if tree_name is None:
+            tree_name = "tree"
+        #sample globally, then split the selected entries by file
+        keys = []
+        bounds = [0]
+        for fn in files:
+            tf = ROOT.TFile.Open(fn)
+            if tf == None or tf.IsZombie():
+                raise IOError("could not open {0}".format(fn))
+            tree = tf.Get(tree_name)
+            nentries = int(tree.GetEntries())
+            if self.stratify != None:
+                from TTH.MEAnalysis.columnar import draw_columns
+                keys += [draw_columns(tree, [self.stratify])[0]]
+            else:
+                keys += [np.zeros(nentries)]
+            bounds += [bounds[-1] + nentries]
+            tf.Close()
+        keys = np.concatenate(keys) if len(keys) > 0 else np.zeros(0)
+        selected = sample_entries(keys, self.nevents, self.seed)
+        self.sampled = {}
+        for (ifile, fn) in enumerate(files):
+            lo, hi = np.searchsorted(selected, [bounds[ifile], bounds[ifile + 1]])
+            self.sampled[fn] = selected[lo:hi] - bounds[ifile]
+
+        super(SampledChain, self).__init__(files, tree_name)
+        print "SampledChain: sampled {0} of {1} entries, seed {2}, stratified by {3}".format(
+            len(self.entries), self.nentries_total, self.seed, self.stratify
+        )
+
+    def file_entries(self, fn, fingerprint, nentries):
+        return self.sampled[fn]
+
+def job_seed(seed, files, first_event=0):
+    """
+    Returns the sampling seed of a job processing files from first_event,
+    derived from the configured seed.
+    """
+    key = json.dumps([seed, list(files), first_event])
+    return int(hashlib.sha1(key).hexdigest()[:8], 16)
+
+def make_sampled_chain(nevents, seed=1, stratify=None):
+    """
+    Returns a SampledChain class reading nevents entries sampled with the
+    seed, stratified by the expression stratify (e.g. "nJet") if given,
+    to be used as the events_class of the heppy configuration.
+    """
+    class _SampledChain(SampledChain):
+        pass
+    _SampledChain.nevents = nevents
+    _SampledChain.seed = seed
+    _SampledChain.stratify = stratify
+    return _SampledChain
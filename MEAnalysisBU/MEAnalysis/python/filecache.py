@@ -0,0 +1,315 @@
+"""
+Local disk cache for the input sample files.
+
+Files are stored under a content address derived from the LFN, the file
+size and the checksum, such that a changed file is never served from the
+cache. The least recently used files are evicted when the cache exceeds
+its quota. A Prefetcher copies the next file of a list to the cache in a
+background thread while the current one is processed.
+
+CachedChain is an events_class for the heppy looper which reads the
+component files one by one through the cache. The size, checksum and
+number of entries of the files are taken from a catalog, a JSON file
+{lfn: {"size": bytes, "checksum": adler32, "entries": entries}} written
+once with
+
+python filecache.py --catalog catalog.json file1.root file2.root ...
+
+The catalog must list every file of the components, such that the chain
+is set up without opening the remote files one after another.
+"""
+import argparse, bisect, hashlib, json, os, shutil, subprocess, threading, zlib
+import ROOT
+
+def lfn_of(pfn):
+    """
+    Returns the LFN (/store/...) of a PFN, or the PFN if it is not of that type.
+    """
+    idx = pfn.find("/store/")
+    if idx >= 0:
+        return pfn[idx:]
+    return pfn
+
+def adler32(path, blocksize=1024*1024):
+    """
+    Returns the adler32 checksum of a file as an 8-digit hex string.
+    """
+    val = 1
+    f = open(path, "rb")
+    while True:
+        data = f.read(blocksize)
+        if not data:
+            break
+        val = zlib.adler32(data, val)
+    f.close()
+    return "{0:08x}".format(val & 0xffffffff)
+
+def copy_file(pfn, dest):
+    """
+    Copies a file from a PFN (root://, dcap://, file:// or a local path) to dest.
+    """
+    if pfn.startswith("root://"):
+        subprocess.check_call(["xrdcp", "-f", "-s", pfn, dest])
+    elif pfn.startswith("dcap://"):
+        subprocess.check_call(["dccp", pfn, dest])
+    else:
+        if pfn.startswith("file://"):
+            pfn = pfn[len("file://"):]
+        shutil.copyfile(pfn, dest)
+
+class FileCache(object):
+    """
+    Content-addressed file cache in a local directory with LRU eviction.
+
+    cache_dir (str): directory of the cached files
+    quota (int): maximum total size of the cached files in bytes
+    """
+    def __init__(self, cache_dir, quota, copy=copy_file):
+        self.cache_dir = cache_dir
+        self.quota = quota
+        self.copy = copy
+        self.lock = threading.Lock()
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def key(self, lfn, size=None, checksum=None):
+        return hashlib.sha1("{0}|{1}|{2}".format(lfn, size, checksum)).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + ".root")
+
+    def lookup(self, lfn, size=None, checksum=None):
+        """
+        Returns the local path of a cached file or None.
+        """
+        path = self.path(self.key(lfn, size, checksum))
+        if os.path.isfile(path):
+            #the modification time is the last use for the LRU eviction
+            os.utime(path, None)
+            return path
+        return None
+
+    def fetch(self, lfn, pfn, size=None, checksum=None, keep=[]):
+        """
+        Returns the local path of a file, copying it from pfn if it is not
+        cached. Raises IOError if the copy does not match size or checksum.
+        The files with local paths in keep are not evicted. A file larger
+        than the quota is not cached, pfn is returned to read it directly.
+        """
+        path = self.lookup(lfn, size, checksum)
+        if path != None:
+            return path
+        if size != None and size > self.quota:
+            print "FileCache: {0} is larger than the quota, not cached".format(pfn)
+            return pfn
+
+        path = self.path(self.key(lfn, size, checksum))
+        tmp = "{0}.part{1}".format(path, threading.current_thread().ident)
+        try:
+            self.copy(pfn, tmp)
+            if size != None and os.path.getsize(tmp) != size:
+                raise IOError("size mismatch for {0}: {1} != {2}".format(
+                    pfn, os.path.getsize(tmp), size)
+                )
+            if checksum != None and adler32(tmp) != checksum:
+                raise IOError("checksum mismatch for {0}".format(pfn))
+            if os.path.getsize(tmp) > self.quota:
+                print "FileCache: {0} is larger than the quota, not cached".format(pfn)
+                return pfn
+            os.rename(tmp, path)
+        finally:
+            if os.path.isfile(tmp):
+                os.remove(tmp)
+        self.evict(keep=keep + [path])
+        return path
+
+    def entries(self):
+        """
+        Returns the cached files as a list of (last use, size, path), oldest first.
+        """
+        ret = []
+        for fn in os.listdir(self.cache_dir):
+            if not fn.endswith(".root"):
+                continue
+            path = os.path.join(self.cache_dir, fn)
+            st = os.stat(path)
+            ret += [(st.st_mtime, st.st_size, path)]
+        return sorted(ret)
+
+    def evict(self, keep=[]):
+        """
+        Removes the least recently used files until the cache is within its quota.
+        """
+        with self.lock:
+            entries = self.entries()
+            total = sum([e[1] for e in entries])
+            for (mtime, size, path) in entries:
+                if total <= self.quota:
+                    break
+                if path in keep:
+                    continue
+                os.remove(path)
+                total -= size
+
+class Prefetcher(object):
+    """
+    Fetches a list of files to a FileCache, copying the next `ahead` files
+    in a background thread while the current one is used.
+
+    files (list of (lfn, pfn, size, checksum)): files in the order of use
+    """
+    def __init__(self, cache, files, ahead=1):
+        self.cache = cache
+        self.files = files
+        self.ahead = ahead
+        self.threads = {}
+        self.paths = {}
+        self.errors = {}
+
+    def _fetch(self, k, keep):
+        lfn, pfn, size, checksum = self.files[k]
+        try:
+            self.paths[k] = self.cache.fetch(lfn, pfn, size, checksum, keep=keep)
+        except Exception as e:
+            self.errors[k] = e
+
+    def _start(self, k, keep):
+        if k >= len(self.files) or self.threads.has_key(k):
+            return
+        th = threading.Thread(target=self._fetch, args=(k, keep))
+        th.daemon = True
+        self.threads[k] = th
+        th.start()
+
+    def get(self, k):
+        """
+        Returns the local path of file k, waiting for its copy if needed,
+        and starts copying the following files.
+        """
+        self._start(k, [])
+        self.threads[k].join()
+        if self.errors.has_key(k):
+            #the fetch is started again by the next get
+            del self.threads[k]
+            raise self.errors.pop(k)
+        path = self.paths[k]
+        for i in range(k + 1, k + 1 + self.ahead):
+            self._start(i, [path])
+        return path
+
+class CachedChain(object):
+    """
+    Reads the files of a component one by one from a local FileCache, the
+    next file being copied in the background. Behaves as the heppy Chain
+    for the looper, but event.input is the TTree of the current file.
+
+    Use make_cached_chain to configure the cache and the catalog, which
+    gives the number of entries of the files.
+    """
+    cache = None
+    ahead = 1
+    catalog = {}
+
+    def __init__(self, files, tree_name=None):
+        if tree_name is None:
+            tree_name = "tree"
+        self.tree_name = tree_name
+        self.files = files
+
+        missing = [pfn for pfn in files if not self.catalog.get(lfn_of(pfn), {}).has_key("entries")]
+        if len(missing) > 0:
+            raise ValueError("CachedChain: {0} of {1} files are not in the catalog, add them with\n"
+                "python filecache.py --catalog CATALOG {2}".format(len(missing), len(files), " ".join(missing))
+            )
+
+        self.entries = []
+        prefetch = []
+        for pfn in files:
+            lfn = lfn_of(pfn)
+            info = self.catalog[lfn]
+            self.entries += [int(info["entries"])]
+            prefetch += [(lfn, pfn, info.get("size", None), info.get("checksum", None))]
+        self.offsets = [0]
+        for n in self.entries:
+            self.offsets += [self.offsets[-1] + n]
+
+        self.prefetcher = Prefetcher(self.cache, prefetch, self.ahead)
+        self.ifile = -1
+        self.tfile = None
+        self.tree = None
+
+    def __len__(self):
+        return self.offsets[-1]
+
+    def open_file(self, ifile):
+        if self.tfile != None:
+            self.tfile.Close()
+        path = self.prefetcher.get(ifile)
+        self.tfile = ROOT.TFile.Open(path)
+        self.tree = self.tfile.Get(self.tree_name)
+        self.ifile = ifile
+
+    def __getitem__(self, index):
+        ifile = bisect.bisect_right(self.offsets, index) - 1
+        if ifile != self.ifile:
+            self.open_file(ifile)
+        self.tree.GetEntry(index - self.offsets[ifile])
+        return self.tree
+
+def file_info(pfn, tree_name="tree"):
+    """
+    Returns (entries of the tree, size in bytes) of a file.
+    """
+    tf = ROOT.TFile.Open(pfn)
+    if tf == None or tf.IsZombie():
+        raise IOError("could not open {0}".format(pfn))
+    ret = (int(tf.Get(tree_name).GetEntries()), int(tf.GetSize()))
+    tf.Close()
+    return ret
+
+def read_catalog(path):
+    """
+    Returns the catalog {lfn: {"size", "checksum", "entries"}} of a JSON file.
+    """
+    inf = open(path)
+    ret = json.load(inf)
+    inf.close()
+    return ret
+
+def make_cached_chain(cache_dir, quota, ahead=1, catalog=None):
+    """
+    Returns a CachedChain class using a FileCache in cache_dir, to be used
+    as the events_class of the heppy configuration. catalog is the path of
+    the file catalog, see the module doc, which is required to construct
+    the chain.
+    """
+    class _CachedChain(CachedChain):
+        pass
+    _CachedChain.cache = FileCache(cache_dir, quota)
+    _CachedChain.ahead = ahead
+    if catalog != None:
+        _CachedChain.catalog = read_catalog(catalog)
+    return _CachedChain
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Writes the catalog of the input files for the file cache")
+    parser.add_argument("--catalog", type=str, required=True, help="output JSON file, updated if it exists")
+    parser.add_argument("--tree", type=str, default="tree")
+    parser.add_argument("files", type=str, nargs="+", help="PFNs of the files")
+    args = parser.parse_args()
+
+    catalog = {}
+    if os.path.isfile(args.catalog):
+        catalog = read_catalog(args.catalog)
+    for pfn in args.files:
+        entries, size = file_info(pfn, args.tree)
+        info = {"size": size, "entries": entries}
+        #the checksum needs to read the whole file, only done for local files
+        local = pfn[len("file://"):] if pfn.startswith("file://") else pfn
+        if os.path.isfile(local):
+            info["checksum"] = adler32(local)
+        catalog[lfn_of(pfn)] = info
+        print lfn_of(pfn), info
+    of = open(args.catalog, "w")
+    of.write(json.dumps(catalog, indent=2, sort_keys=True))
+    of.close()
@@ -0,0 +1,165 @@
+"""
+Four-momenta of the particles of an event as numpy arrays.
+
+EventAnalyzer puts a KinematicsCache to event.kinematics for every event.
+event.kinematics.get(particles) returns the Kinematics of a list of
+particles, i.e. their pt, eta, phi, mass, px, py, pz and E as contiguous
+arrays. The four-momentum of each particle is computed on the first
+request of a list containing it and shared by all the analyzers for the
+rest of the event, such that e.g. event.btagged_jets, a subset of
+event.good_jets, is indexed from the arrays of event.good_jets instead of
+being converted again.
+"""
+import numpy as np
+
+def delta_r(eta1, phi1, eta2, phi2):
+    dphi = np.mod(phi1 - phi2 + np.pi, 2 * np.pi) - np.pi
+    return np.sqrt((eta1 - eta2)**2 + dphi**2)
+
+def momenta(pt, eta, phi, mass):
+    """
+    Returns the (px, py, pz, E) arrays of particles given by pt, eta, phi
+    and mass, as TLorentzVector.SetPtEtaPhiM.
+    """
+    pt, eta, phi, mass = [np.asarray(x, dtype=np.float64) for x in [pt, eta, phi, mass]]
+    px = pt * np.cos(phi)
+    py = pt * np.sin(phi)
+    pz = pt * np.sinh(eta)
+    e = np.sqrt(px**2 + py**2 + pz**2 + mass**2)
+    return px, py, pz, e
+
+def invariant_mass(px, py, pz, e):
+    """
+    Returns the invariant mass of four-momentum arrays, negative for
+    space-like momenta as TLorentzVector.M.
+    """
+    m2 = e**2 - px**2 - py**2 - pz**2
+    return np.sign(m2) * np.sqrt(np.abs(m2))
+
+class Kinematics(object):
+    """
+    The four-momenta of n particles as float64 arrays of length n:
+    pt, eta, phi, mass, px, py, pz, e.
+    """
+    attributes = ["pt", "eta", "phi", "mass", "px", "py", "pz", "e"]
+
+    def __init__(self, pt, eta, phi, mass):
+        self.pt, self.eta, self.phi, self.mass = [
+            np.asarray(x, dtype=np.float64) for x in [pt, eta, phi, mass]
+        ]
+        self.px, self.py, self.pz, self.e = momenta(self.pt, self.eta, self.phi, self.mass)
+
+    @staticmethod
+    def from_arrays(arrays):
+        """
+        Returns the Kinematics of the already computed arrays, in the order
+        of Kinematics.attributes.
+        """
+        ret = object.__new__(Kinematics)
+        for (attr, arr) in zip(Kinematics.attributes, arrays):
+            setattr(ret, attr, arr)
+        return ret
+
+    def take(self, indices):
+        """
+        Returns the Kinematics of the particles at indices.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return Kinematics.from_arrays([getattr(self, attr)[indices] for attr in Kinematics.attributes])
+
+    @staticmethod
+    def concatenate(kins):
+        return Kinematics.from_arrays([
+            np.concatenate([getattr(k, attr) for k in kins]) for attr in Kinematics.attributes
+        ])
+
+    @staticmethod
+    def of(particles):
+        """
+        Returns the Kinematics of objects with pt, eta, phi, mass.
+        """
+        return Kinematics(*[
+            [getattr(p, attr) for p in particles] for attr in ["pt", "eta", "phi", "mass"]
+        ])
+
+    def __len__(self):
+        return len(self.pt)
+
+    def p4c(self, i):
+        """
+        Returns (px, py, pz, E) of particle i, e.g. for the TLorentzVector constructor.
+        """
+        return (float(self.px[i]), float(self.py[i]), float(self.pz[i]), float(self.e[i]))
+
+    def delta_r(self, other):
+        """
+        Returns the matrix of the delta R between the particles (rows) and
+        the particles of the Kinematics other (columns).
+        """
+        return delta_r(self.eta[:, None], self.phi[:, None], other.eta[None, :], other.phi[None, :])
+
+    def pair_masses(self, ia=None, ib=None):
+        """
+        Returns the matrix of the invariant masses of all the pairs of
+        particles, or the masses of the pairs (ia[k], ib[k]) if given.
+        """
+        if ia is not None:
+            return invariant_mass(self.px[ia] + self.px[ib], self.py[ia] + self.py[ib],
+                self.pz[ia] + self.pz[ib], self.e[ia] + self.e[ib]
+            )
+        return invariant_mass(
+            self.px[:, None] + self.px[None, :], self.py[:, None] + self.py[None, :],
+            self.pz[:, None] + self.pz[None, :], self.e[:, None] + self.e[None, :]
+        )
+
+    def mass_of(self, indices):
+        """
+        Returns the invariant mass of the sum of the particles at indices.
+        """
+        i = list(indices)
+        return float(invariant_mass(self.px[i].sum(), self.py[i].sum(), self.pz[i].sum(), self.e[i].sum()))
+
+class KinematicsCache(object):
+    """
+    The Kinematics of the particles of one event, by the identity of the
+    particles. Each particle is converted once, with the first list it is
+    requested in; other lists, e.g. subsets or reorderings, are indexed
+    from the arrays of the lists their particles were converted with.
+    """
+    def __init__(self):
+        #id of the particle -> (particle, Kinematics, index in it)
+        #the particles are kept, such that their ids are not reused during the event
+        self.particles = {}
+        #ids of the particles of a list -> Kinematics
+        self.lists = {}
+
+    def get(self, particles):
+        particles = list(particles)
+        key = tuple([id(p) for p in particles])
+        if self.lists.has_key(key):
+            return self.lists[key]
+
+        missing = [p for p in particles if not self.particles.has_key(id(p))]
+        if len(missing) > 0:
+            kin = Kinematics.of(missing)
+            for (i, p) in enumerate(missing):
+                self.particles[id(p)] = (p, kin, i)
+
+        #runs of consecutive particles converted with the same list
+        runs = []
+        for p in particles:
+            _, kin, i = self.particles[id(p)]
+            if len(runs) > 0 and runs[-1][0] is kin:
+                runs[-1][1].append(i)
+            else:
+                runs.append((kin, [i]))
+        if len(runs) == 0:
+            ret = Kinematics.of([])
+        elif len(runs) == 1 and runs[0][1] == range(len(runs[0][0])):
+            ret = runs[0][0]
+        elif len(runs) == 1:
+            ret = runs[0][0].take(runs[0][1])
+        else:
+            ret = Kinematics.concatenate([kin.take(idx) for (kin, idx) in runs])
+        self.lists[key] = ret
+        return ret
@@ -0,0 +1,211 @@
+"""
+Heppy looper with periodic checkpoints and resume for long MEM jobs.
+
+Every checkpointEvents events or checkpointSeconds seconds, MELooper saves
+the output trees (TTree::AutoSave), pickles the counters of the analyzers
+and records the next event to process in checkpoint.json in the looper
+directory. A job started with resumeFrom=<directory of an interrupted job>
+skips the events already done and, at write(), merges the partial output
+files and counters of the interrupted jobs with its own.
+
+With statusSeconds > 0, the progress is written to status.json and
+status.prom in the looper directory, see TTH.MEAnalysis.monitor. With
+memoryCheck, the growth of the memory use is monitored, see
+TTH.MEAnalysis.memcheck.
+"""
+import json, os, pickle, time
+import ROOT
+
+from PhysicsTools.HeppyCore.framework.looper import Looper
+from TTH.MEAnalysis.monitor import StatusMonitor
+
+def read_checkpoint(path):
+    inf = open(os.path.join(path, "checkpoint.json"))
+    ret = json.load(inf)
+    inf.close()
+    return ret
+
+def find_checkpoint(name):
+    """
+    Returns the most recent directory of the looper name (name, name_1, ...)
+    with a checkpoint, or None.
+    """
+    parent = os.path.dirname(name) or "."
+    base = os.path.basename(name)
+    found = []
+    for d in os.listdir(parent):
+        if d == base or (d.startswith(base + "_") and d[len(base)+1:].isdigit()):
+            path = os.path.join(parent, d)
+            if os.path.isfile(os.path.join(path, "checkpoint.json")):
+                found += [(read_checkpoint(path)["time"], path)]
+    if len(found) == 0:
+        return None
+    return sorted(found)[-1][1]
+
+def read_counters(path):
+    """
+    Returns {analyzer name: counters} saved at the last checkpoint of a looper directory.
+    """
+    inf = open(os.path.join(path, "checkpoint_counters.pck"), "rb")
+    counters = pickle.load(inf)
+    inf.close()
+    return counters
+
+def add_counters(target, source):
+    """
+    Adds the heppy Counters source to target.
+    """
+    for counter in source.counters:
+        #Counters has no item assignment, the counter is added in place
+        total = target[counter.name]
+        total += counter
+
+def merge_files(inputs, output):
+    """
+    Merges the ROOT files inputs (trees and histograms) into output.
+    """
+    merger = ROOT.TFileMerger(False)
+    merger.OutputFile(output, "RECREATE")
+    for fn in inputs:
+        merger.AddFile(fn)
+    if not merger.Merge():
+        raise IOError("could not merge {0} into {1}".format(inputs, output))
+
+class MELooper(Looper):
+    """
+    Looper with checkpoints, see the module doc.
+
+    checkpointEvents (int): events between checkpoints, 0 to disable
+    checkpointSeconds (float): seconds between checkpoints, 0 to disable
+    resumeFrom (str): directory of an interrupted job to resume
+    statusSeconds (float): seconds between status updates, 0 to disable
+    memoryCheck (dict): arguments of memcheck.MemoryMonitor, None to disable
+    """
+    def __init__(self, name, config, nEvents=None, firstEvent=0,
+        checkpointEvents=0, checkpointSeconds=0, resumeFrom=None, statusSeconds=0,
+        memoryCheck=None, **kwargs):
+
+        self.parts = []
+        if resumeFrom != None:
+            chk = read_checkpoint(resumeFrom)
+            if chk["complete"]:
+                raise ValueError("{0} is already complete".format(resumeFrom))
+            #the events of the original job which are not done yet
+            firstEvent = chk["nextEvent"]
+            nEvents = chk["endEvent"] - firstEvent
+            self.parts = chk["parts"] + [os.path.abspath(resumeFrom)]
+            print "MELooper: resuming {0} from event {1}".format(resumeFrom, firstEvent)
+
+        super(MELooper, self).__init__(name, config, nEvents=nEvents, firstEvent=firstEvent, **kwargs)
+        self.checkpointEvents = checkpointEvents
+        self.checkpointSeconds = checkpointSeconds
+        self.endEvent = len(self.events)
+        if nEvents != None:
+            self.endEvent = min(firstEvent + int(nEvents), self.endEvent)
+        self.nextEvent = firstEvent
+        self.eventsSinceCheckpoint = 0
+        self.lastCheckpoint = time.time()
+        self.monitor = None
+        if statusSeconds > 0:
+            self.monitor = StatusMonitor(self, statusSeconds)
+        self.memcheck = None
+        if memoryCheck != None:
+            from TTH.MEAnalysis.memcheck import MemoryMonitor
+            self.memcheck = MemoryMonitor(self.name, **memoryCheck)
+
+    def process(self, iEv):
+        ret = super(MELooper, self).process(iEv)
+        self.nextEvent = iEv + 1
+        if self.monitor != None:
+            self.monitor.update(iEv)
+        if self.memcheck != None:
+            self.memcheck.update()
+        self.eventsSinceCheckpoint += 1
+        if ((self.checkpointEvents > 0 and self.eventsSinceCheckpoint >= self.checkpointEvents) or
+            (self.checkpointSeconds > 0 and time.time() - self.lastCheckpoint >= self.checkpointSeconds)):
+            self.checkpoint()
+        return ret
+
+    def output_trees(self):
+        """
+        Returns the TTrees filled by the analyzers.
+        """
+        trees = []
+        for analyzer in self.analyzers:
+            tree = getattr(analyzer, "tree", None)
+            #the heppy tree producers wrap the TTree
+            tree = getattr(tree, "tree", tree)
+            if tree != None and hasattr(tree, "AutoSave"):
+                trees += [tree]
+        return trees
+
+    def output_files(self):
+        """
+        Returns the paths of the files of the output services.
+        """
+        ret = []
+        for service in self.setup.services.values():
+            f = getattr(service, "file", None)
+            if f != None and hasattr(f, "GetName"):
+                ret += [f.GetName()]
+        return ret
+
+    def checkpoint(self, complete=False):
+        """
+        Saves the output trees and counters and writes checkpoint.json. The
+        output files are already closed when the job is complete.
+        """
+        if not complete:
+            for tree in self.output_trees():
+                tree.AutoSave("SaveSelf")
+        counters = dict([(a.name, a.counters) for a in self.analyzers])
+        of = open(os.path.join(self.name, "checkpoint_counters.pck"), "wb")
+        pickle.dump(counters, of)
+        of.close()
+
+        chk = {
+            "firstEvent": self.firstEvent,
+            "endEvent": self.endEvent,
+            "nextEvent": self.nextEvent,
+            "lastEntry": self.nextEvent - 1,
+            "parts": self.parts,
+            "complete": complete,
+            "time": time.time(),
+        }
+        #write to a temporary file first, such that a killed job leaves a valid checkpoint
+        fn = os.path.join(self.name, "checkpoint.json")
+        of = open(fn + ".tmp", "w")
+        of.write(json.dumps(chk, indent=2))
+        of.close()
+        os.rename(fn + ".tmp", fn)
+        self.eventsSinceCheckpoint = 0
+        self.lastCheckpoint = time.time()
+
+    def merge_counters(self):
+        """
+        Adds the counters of the interrupted jobs to the counters of the analyzers.
+        """
+        for part in self.parts:
+            counters = read_counters(part)
+            for analyzer in self.analyzers:
+                if not counters.has_key(analyzer.name):
+                    continue
+                add_counters(analyzer.counters, counters[analyzer.name])
+
+    def write(self):
+        if self.memcheck != None:
+            self.memcheck.write()
+        files = self.output_files()
+        self.merge_counters()
+        super(MELooper, self).write()
+        for fn in files:
+            partial = [os.path.join(part, os.path.basename(fn)) for part in self.parts]
+            partial = [p for p in partial if os.path.isfile(p)]
+            if len(partial) == 0:
+                continue
+            merged = fn + ".merged"
+            merge_files(partial + [fn], merged)
+            os.rename(merged, fn)
+        self.checkpoint(complete=True)
+        if self.monitor != None:
+            self.monitor.write(done=True)
@@ -0,0 +1,239 @@
+"""
+Memory growth instrumentation of a heppy job.
+
+Every N events, MemoryMonitor records the resident memory (RSS) of the
+process and optionally
+- the number of live ROOT objects by class, from the ROOT object table
+  (TObject::SetObjectStat, only for TObjects created after the monitor),
+- the number of Python proxies of C++ objects by class, e.g. MEM.Object,
+- a tracemalloc snapshot, compared to the previous one (needs the
+  tracemalloc module, python 3 or the pytracemalloc patch for python 2).
+
+If the RSS grows linearly with the number of processed events, i.e. a
+straight line fits the samples after the warm-up well and its slope is
+above warnSlope bytes per event, a warning with the fastest growing
+classes and allocation sites is printed. The samples and the summary are
+written to memcheck.json in the looper directory.
+"""
+import gc, json, os, resource
+
+try:
+    import tracemalloc as pytracemalloc
+except ImportError:
+    pytracemalloc = None
+
+import ROOT
+
+def rss_bytes():
+    """
+    Returns the resident memory of the process in bytes.
+    """
+    try:
+        inf = open("/proc/self/statm")
+        resident = int(inf.read().split()[1])
+        inf.close()
+        return resident * os.sysconf("SC_PAGE_SIZE")
+    except (IOError, OSError):
+        #peak RSS in kB on Linux, the best estimate without /proc
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def root_object_counts():
+    """
+    Returns {class name: live instances} of the ROOT object table.
+    """
+    ROOT.gObjectTable.UpdateInstCount()
+    counts = {}
+    for cl in ROOT.gROOT.GetListOfClasses():
+        n = cl.GetInstanceCount()
+        if n > 0:
+            counts[cl.GetName()] = int(n)
+    return counts
+
+def is_proxy(obj):
+    """
+    Returns True if obj is a python proxy of a C++ object.
+    """
+    meta = type(type(obj)).__name__
+    return meta == "PyRootType" or meta.startswith("CPPScope")
+
+def proxy_counts():
+    """
+    Returns {class name: number} of the live C++ object proxies.
+
+    The PyROOT proxies are not tracked by the garbage collector, so they are
+    found as the referents of the tracked objects (lists, dicts, instances,
+    frames) which hold them. Proxies held only by other proxies or by C++
+    are not counted.
+    """
+    proxies = {}
+    for obj in gc.get_objects():
+        if is_proxy(obj):
+            proxies[id(obj)] = obj
+        for ref in gc.get_referents(obj):
+            if is_proxy(ref):
+                proxies[id(ref)] = ref
+    counts = {}
+    for obj in proxies.values():
+        name = type(obj).__name__
+        counts[name] = counts.get(name, 0) + 1
+    return counts
+
+def linear_fit(xs, ys):
+    """
+    Returns (slope, r2) of the least squares line through the points.
+    """
+    n = float(len(xs))
+    mx = sum(xs) / n
+    my = sum(ys) / n
+    sxx = sum([(x - mx)**2 for x in xs])
+    syy = sum([(y - my)**2 for y in ys])
+    sxy = sum([(x - mx)*(y - my) for (x, y) in zip(xs, ys)])
+    if sxx == 0:
+        return (0.0, 0.0)
+    slope = sxy / sxx
+    r2 = sxy**2 / (sxx * syy) if syy > 0 else 0.0
+    return (slope, r2)
+
+def growth(first, last, n=10):
+    """
+    Returns the n keys of the count dicts with the largest increase.
+    """
+    diff = [(last[k] - first.get(k, 0), k) for k in last.keys()]
+    diff = sorted([d for d in diff if d[0] > 0], reverse=True)[:n]
+    return [{"name": k, "increase": d, "count": last[k]} for (d, k) in diff]
+
+class MemoryMonitor(object):
+    """
+    Samples the memory use every events processed events, see the module doc.
+
+    outdir (str): directory of memcheck.json
+    events (int): events between samples
+    rootObjects (bool): count the ROOT objects and proxies by class
+    tracemalloc (int): if > 0, trace the python allocations with this many frames
+    warmup (int): samples which are not used in the fit
+    warnSlope (float): bytes per event above which the growth is reported
+    minR2 (float): minimum r2 of the fit to consider the growth linear
+    """
+    def __init__(self, outdir, events=1000, rootObjects=True, tracemalloc=0,
+        warmup=2, warnSlope=1024.0, minR2=0.9):
+        self.outdir = outdir
+        self.events = events
+        self.root_objects = rootObjects
+        self.tracemalloc = tracemalloc
+        self.warmup = warmup
+        self.warn_slope = warnSlope
+        self.min_r2 = minR2
+
+        self.processed = 0
+        self.samples = []
+        self.first_counts = None
+        self.warned_rss = None
+        self.snapshot = None
+        self.allocations = []
+
+        if self.root_objects:
+            ROOT.TObject.SetObjectStat(True)
+        if self.tracemalloc > 0:
+            if pytracemalloc is None:
+                print "MemoryMonitor: tracemalloc is not available, not tracing allocations"
+                self.tracemalloc = 0
+            else:
+                pytracemalloc.start(self.tracemalloc)
+        self.sample()
+
+    def update(self):
+        """
+        Called after each event, samples the memory every self.events events.
+        """
+        self.processed += 1
+        if self.processed % self.events == 0:
+            self.sample()
+            self.check()
+
+    def counts(self):
+        counts = {}
+        counts.update(root_object_counts())
+        for (k, v) in proxy_counts().items():
+            counts["proxy " + k] = v
+        return counts
+
+    def sample(self):
+        s = {"events": self.processed, "rss": rss_bytes()}
+        if self.root_objects:
+            s["counts"] = self.counts()
+            if self.first_counts is None:
+                self.first_counts = s["counts"]
+        if self.tracemalloc > 0:
+            snapshot = pytracemalloc.take_snapshot()
+            if self.snapshot != None:
+                stats = snapshot.compare_to(self.snapshot, "lineno")[:10]
+                self.allocations = [
+                    {"site": str(st.traceback), "size_diff": st.size_diff, "count_diff": st.count_diff}
+                    for st in stats
+                ]
+            self.snapshot = snapshot
+        self.samples += [s]
+
+    def fit(self):
+        """
+        Returns (slope in bytes per event, r2) of the RSS after the warm-up,
+        None if there are not enough samples.
+        """
+        samples = self.samples[self.warmup:]
+        if len(samples) < 3:
+            return None
+        return linear_fit([s["events"] for s in samples], [s["rss"] for s in samples])
+
+    def check(self):
+        """
+        Prints a warning if the RSS grows linearly with the events. Repeated
+        only after the RSS grew by half since the last warning.
+        """
+        fit = self.fit()
+        if fit is None:
+            return
+        slope, r2 = fit
+        rss = self.samples[-1]["rss"]
+        if slope < self.warn_slope or r2 < self.min_r2:
+            return
+        if self.warned_rss != None and rss < 1.5 * self.warned_rss:
+            return
+        self.warned_rss = rss
+        print "MemoryMonitor WARNING: RSS {0:.1f} MB after {1} events, growing by {2:.1f} kB/event (r2={3:.3f})".format(
+            rss / 1024.0**2, self.processed, slope / 1024.0, r2
+        )
+        for g in self.summary()["growth"]:
+            print "    {0}: +{1} (now {2})".format(g["name"], g["increase"], g["count"])
+        for a in self.allocations:
+            print "    {0}: {1:+d} bytes, {2:+d} blocks".format(a["site"], a["size_diff"], a["count_diff"])
+
+    def summary(self):
+        fit = self.fit()
+        ret = {
+            "events": self.processed,
+            "rss_first": self.samples[0]["rss"],
+            "rss_last": self.samples[-1]["rss"],
+            "slope": fit[0] if fit != None else None,
+            "r2": fit[1] if fit != None else None,
+            "linear_growth": fit != None and fit[0] >= self.warn_slope and fit[1] >= self.min_r2,
+            "growth": [],
+            "allocations": self.allocations,
+        }
+        if self.root_objects:
+            ret["growth"] = growth(self.first_counts, self.samples[-1]["counts"])
+        return ret
+
+    def write(self):
+        """
+        Samples the memory once more and writes memcheck.json.
+        """
+        if self.samples[-1]["events"] != self.processed:
+            self.sample()
+        out = {
+            "summary": self.summary(),
+            "samples": [{"events": s["events"], "rss": s["rss"]} for s in self.samples],
+        }
+        of = open(os.path.join(self.outdir, "memcheck.json"), "w")
+        of.write(json.dumps(out, indent=2))
+        of.close()
+        return out
@@ -0,0 +1,138 @@
+"""
+Progress monitor of a heppy job.
+
+Every few seconds, StatusMonitor writes the progress of the looper to
+status.json and status.prom (Prometheus text format, e.g. for the node
+exporter textfile collector) in the looper directory:
+the current entry, the number of processed events, the overall and recent
+event rates, the ETA, the MEM integrations per second and, for the
+profiled analyzers (see TTH.MEAnalysis.profiling), the events per second
+of each analyzer alone.
+
+watch_jobs.py combines the status files of many local jobs.
+"""
+import json, os, socket, time
+
+def write_atomic(path, text):
+    #write to a temporary file first, such that readers never see a partial file
+    tmp = "{0}.{1}.tmp".format(path, os.getpid())
+    of = open(tmp, "w")
+    of.write(text)
+    of.close()
+    os.rename(tmp, path)
+
+#Prometheus metrics: (name, key in the status, help)
+metrics = [
+    ("events_processed", "processed", "events processed by the job"),
+    ("current_entry", "entry", "last entry processed"),
+    ("end_entry", "endEvent", "entry at which the job stops"),
+    ("events_per_second", "rate", "events per second since the start"),
+    ("events_per_second_recent", "rate_recent", "events per second since the last update"),
+    ("mem_calls_per_second", "mem_rate", "MEM integrations per second"),
+    ("eta_seconds", "eta", "estimated seconds until the job is done"),
+    ("last_update_timestamp", "time", "time of the last update"),
+    ("done", "done", "1 if the job has finished"),
+]
+
+def prometheus_text(statuses):
+    """
+    Returns the metrics of a list of job statuses in the Prometheus text
+    format, labeled with the job (host:looper directory).
+    """
+    lines = []
+    def sample(name, labels, value):
+        lab = ",".join(['{0}="{1}"'.format(k, labels[k]) for k in sorted(labels.keys())])
+        lines.append("heppy_{0}{{{1}}} {2}".format(name, lab, value))
+
+    for (name, key, help) in metrics:
+        lines.append("# HELP heppy_{0} {1}".format(name, help))
+        lines.append("# TYPE heppy_{0} gauge".format(name))
+        for status in statuses:
+            if status[key] != None:
+                sample(name, {"job": status["job"]}, int(status[key]) if key == "done" else status[key])
+
+    name = "analyzer_events_per_second"
+    lines.append("# HELP heppy_{0} events per second of the analyzer alone".format(name))
+    lines.append("# TYPE heppy_{0} gauge".format(name))
+    for status in statuses:
+        for (analyzer, rate) in sorted(status["analyzers"].items()):
+            sample(name, {"job": status["job"], "analyzer": analyzer}, rate)
+    return "\n".join(lines) + "\n"
+
+class StatusMonitor(object):
+    """
+    Writes the status of a looper to its directory every interval seconds.
+    """
+    def __init__(self, looper, interval=30):
+        self.looper = looper
+        self.interval = interval
+        self.start = time.time()
+        self.last = self.start
+        self.processed = 0
+        self.last_processed = 0
+        self.entry = None
+
+    def mem_calls(self):
+        return sum([getattr(a, "mem_calls", 0) for a in self.looper.analyzers])
+
+    def analyzer_rates(self):
+        """
+        Returns {analyzer name: events per second of its process calls}.
+        """
+        rates = {}
+        for analyzer in self.looper.analyzers:
+            profile = getattr(analyzer, "profile", None)
+            if profile != None and profile.wall > 0:
+                rates[analyzer.name] = profile.ncalls / profile.wall
+        return rates
+
+    def update(self, iEv):
+        """
+        Called after each event, writes the status if the interval has passed.
+        """
+        self.processed += 1
+        self.entry = iEv
+        if time.time() - self.last >= self.interval:
+            self.write()
+
+    def status(self, done=False):
+        now = time.time()
+        elapsed = now - self.start
+        rate = self.processed / elapsed if elapsed > 0 else None
+        recent = None
+        if now > self.last and self.processed > self.last_processed:
+            recent = (self.processed - self.last_processed) / (now - self.last)
+        end = self.looper.endEvent
+        remaining = end - (self.entry + 1 if self.entry != None else self.looper.firstEvent)
+        eta = None
+        if done:
+            eta = 0
+        elif recent or rate:
+            eta = remaining / (recent or rate)
+        return {
+            #the looper directories of different jobs have the same basename
+            "job": "{0}:{1}".format(socket.gethostname(), os.path.abspath(self.looper.name)),
+            "host": socket.gethostname(),
+            "pid": os.getpid(),
+            "start": self.start,
+            "time": now,
+            "firstEvent": self.looper.firstEvent,
+            "endEvent": end,
+            "entry": self.entry,
+            "processed": self.processed,
+            "rate": rate,
+            "rate_recent": recent,
+            "mem_calls": self.mem_calls(),
+            "mem_rate": self.mem_calls() / elapsed if elapsed > 0 else None,
+            "eta": eta,
+            "done": done,
+            "analyzers": self.analyzer_rates(),
+        }
+
+    def write(self, done=False):
+        status = self.status(done)
+        write_atomic(os.path.join(self.looper.name, "status.json"), json.dumps(status, indent=2))
+        write_atomic(os.path.join(self.looper.name, "status.prom"), prometheus_text([status]))
+        self.last = status["time"]
+        self.last_processed = self.processed
+        return status
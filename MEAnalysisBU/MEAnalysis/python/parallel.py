@@ -0,0 +1,281 @@
+"""
+Multi-process execution of the heppy loopers.
+
+run_sharded splits the entry range of a component into contiguous shards
+which are processed by MELoopers in separate worker processes, each with
+its own analyzers (and hence its own MEM integrator). The shards are
+written to NAME/shard_<i>. The ROOT output files are then merged in shard
+order, such that the entries of the merged trees are in input order, and
+the heppy counters are summed into NAME/<analyzer>/.
+
+run_components processes several components concurrently, one MELooper
+per component in a bounded pool of worker processes, the largest
+components first. Each component writes its own looper directory and a
+summary of all of them is written at the end.
+
+The worker processes are forked, such that the configuration does not
+need to be pickled. Every task runs in its own process (run_tasks), such
+that a task which raises, crashes or exceeds the timeout is reported as
+failed while the other tasks continue.
+"""
+import json, multiprocessing, os, pickle, Queue, time, traceback
+
+from TTH.MEAnalysis.looper import MELooper, read_counters, add_counters, merge_files
+
+def shard_ranges(first, end, nshards):
+    """
+    Returns [(firstEvent, nEvents)] of nshards contiguous ranges covering
+    the entries first..end-1, the sizes differing by at most one.
+    """
+    ntot = max(end - first, 0)
+    nshards = max(min(nshards, ntot), 1)
+    ranges = []
+    start = first
+    for i in range(nshards):
+        n = ntot / nshards + (1 if i < ntot % nshards else 0)
+        ranges += [(start, n)]
+        start += n
+    return ranges
+
+def free_name(name):
+    """
+    Returns name, or name_1, name_2 ... if it exists, as the heppy Looper.
+    """
+    ret = name
+    i = 0
+    while os.path.exists(ret):
+        i += 1
+        ret = "{0}_{1}".format(name, i)
+    return ret
+
+def _run_task(func, itask, results):
+    try:
+        ret = (itask, func(itask), None)
+    except Exception:
+        ret = (itask, None, traceback.format_exc())
+    results.put(ret)
+
+def run_tasks(func, ntasks, nworkers, timeout=None):
+    """
+    Calls func(i) for i in 0..ntasks-1, each in its own forked process with
+    at most nworkers at a time, in the order of i. Returns the list of
+    (result, error) by task, error is the traceback if func raised, or a
+    message if the process exited without a result (e.g. a segfault) or
+    ran longer than timeout seconds and was killed.
+    """
+    results = multiprocessing.Queue()
+    out = [None for i in range(ntasks)]
+    pending = range(ntasks)
+    running = {}
+    def collect(wait):
+        try:
+            while True:
+                itask, ret, error = results.get(True, wait)
+                out[itask] = (ret, error)
+                wait = 0.01
+        except Queue.Empty:
+            pass
+
+    while len(pending) > 0 or len(running) > 0:
+        while len(pending) > 0 and len(running) < max(nworkers, 1):
+            itask = pending.pop(0)
+            proc = multiprocessing.Process(target=_run_task, args=(func, itask, results))
+            proc.start()
+            running[itask] = (proc, time.time())
+        collect(1.0)
+        for (itask, (proc, t0)) in running.items():
+            if timeout != None and proc.is_alive() and time.time() - t0 > timeout:
+                proc.terminate()
+                proc.join()
+                if out[itask] is None:
+                    out[itask] = (None, "killed after the timeout of {0} s".format(timeout))
+            if not proc.is_alive():
+                proc.join()
+                #the result may still be in the queue after the process exited
+                collect(0.1)
+                if out[itask] is None:
+                    out[itask] = (None, "process exited with code {0} without a result".format(proc.exitcode))
+                del running[itask]
+    return out
+
+#(name, config, firstEvent, nEvents, looper arguments) of the shards,
+#set before the workers are forked
+_shards = []
+
+def run_shard(ishard):
+    name, config, firstEvent, nEvents, kwargs = _shards[ishard]
+    looper = MELooper(name, config, nEvents=nEvents, firstEvent=firstEvent, **kwargs)
+    looper.loop()
+    looper.write()
+    return looper.name
+
+def root_files(path):
+    """
+    Returns the paths of the ROOT files below path, relative to path.
+    """
+    ret = []
+    for (dirpath, dirnames, filenames) in os.walk(path):
+        for fn in sorted(filenames):
+            if fn.endswith(".root"):
+                ret += [os.path.relpath(os.path.join(dirpath, fn), path)]
+    return sorted(ret)
+
+def merge_shards(name, shard_dirs):
+    """
+    Merges the output files and counters of the shard directories, in
+    their order, into the directory name.
+    """
+    for rel in root_files(shard_dirs[0]):
+        inputs = [os.path.join(d, rel) for d in shard_dirs if os.path.isfile(os.path.join(d, rel))]
+        out = os.path.join(name, rel)
+        if not os.path.isdir(os.path.dirname(out)):
+            os.makedirs(os.path.dirname(out))
+        merge_files(inputs, out)
+
+    merged = read_counters(shard_dirs[0])
+    for d in shard_dirs[1:]:
+        for (analyzer, counters) in read_counters(d).items():
+            if merged.has_key(analyzer):
+                add_counters(merged[analyzer], counters)
+            else:
+                merged[analyzer] = counters
+    for (analyzer, counters) in merged.items():
+        outdir = os.path.join(name, analyzer)
+        if not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        counters.write(outdir)
+    of = open(os.path.join(name, "checkpoint_counters.pck"), "wb")
+    pickle.dump(merged, of)
+    of.close()
+    return merged
+
+def run_sharded(name, config, nshards, firstEvent=0, nEvents=None, timeout=None, **kwargs):
+    """
+    Processes the entries firstEvent..firstEvent+nEvents-1 (all if nEvents
+    is None) of the single component of config in nshards worker processes
+    and merges the results into the directory name, see the module doc.
+    Returns the directory.
+
+    If shards fail (see run_tasks), the finished shards are merged and
+    listed in shards.json with the failed ones, and RuntimeError is raised.
+    The checkpoint is then not written, such that the job is processed
+    again with --resume.
+    """
+    if len(config.components) != 1:
+        raise ValueError("run_sharded needs a configuration with one component")
+    comp = config.components[0]
+    events = config.events_class(comp.files, comp.tree_name)
+    end = len(events)
+    if nEvents != None:
+        end = min(firstEvent + int(nEvents), end)
+    del events
+    ranges = shard_ranges(firstEvent, end, nshards)
+
+    name = free_name(name)
+    os.makedirs(name)
+    del _shards[:]
+    for (i, (first, n)) in enumerate(ranges):
+        _shards.append((os.path.join(name, "shard_{0}".format(i)), config, first, n, kwargs))
+
+    t0 = time.time()
+    results = run_tasks(run_shard, len(ranges), len(ranges), timeout)
+    shards = []
+    for (i, ((d, error), (first, n))) in enumerate(zip(results, ranges)):
+        shards += [{"dir": d, "firstEvent": first, "nEvents": n, "error": error}]
+        if error != None:
+            print "run_sharded: shard {0} (entries {1}..{2}) failed\n{3}".format(i, first, first + n - 1, error)
+    shard_dirs = [sh["dir"] for sh in shards if sh["error"] is None]
+    failed = [i for (i, sh) in enumerate(shards) if sh["error"] != None]
+    if len(shard_dirs) > 0:
+        merge_shards(name, shard_dirs)
+
+    if len(failed) > 0:
+        of = open(os.path.join(name, "shards.json"), "w")
+        of.write(json.dumps({"shards": shards, "failed": failed, "wall": time.time() - t0}, indent=2))
+        of.close()
+        raise RuntimeError("run_sharded: shards {0} of {1} failed, the other {2} are merged in {3}".format(
+            failed, len(ranges), len(shard_dirs), name)
+        )
+
+    #the same record as a complete MELooper, such that --resume skips the job
+    chk = {
+        "firstEvent": firstEvent,
+        "endEvent": end,
+        "nextEvent": end,
+        "lastEntry": end - 1,
+        "parts": [],
+        "complete": True,
+        "time": time.time(),
+        "shards": shards,
+        "wall": time.time() - t0,
+    }
+    of = open(os.path.join(name, "checkpoint.json"), "w")
+    of.write(json.dumps(chk, indent=2))
+    of.close()
+    print "run_sharded: {0} entries in {1} shards merged into {2} in {3:.1f} s".format(
+        end - firstEvent, len(ranges), name, chk["wall"]
+    )
+    return name
+
+#(name, config, looper arguments) of the components, set before the workers are forked
+_components = []
+
+def run_component(icomp):
+    """
+    Runs the looper of a component, returns its summary.
+    """
+    name, config, kwargs = _components[icomp]
+    t0 = time.time()
+    looper = MELooper(name, config, **kwargs)
+    looper.loop()
+    looper.write()
+    return {"name": name, "dir": looper.name, "events": looper.nextEvent - looper.firstEvent,
+        "error": None, "wall": time.time() - t0}
+
+def component_size(config):
+    """
+    Returns the number of input files of the component of config, used to
+    start the largest components first.
+    """
+    return sum([len(comp.files) for comp in config.components])
+
+def run_components(jobs, nworkers, summary="components.json", timeout=None):
+    """
+    Runs the jobs, a list of (name, config, looper arguments) with one
+    component per configuration, in nworkers processes. A component which
+    fails (see run_tasks) is reported in the summary, the others continue.
+    Writes the summary of the components to the file summary and returns it.
+    """
+    order = sorted(range(len(jobs)), key=lambda i: -component_size(jobs[i][1]))
+    del _components[:]
+    #the largest components first
+    _components.extend([jobs[i] for i in order])
+
+    t0 = time.time()
+    results = [None for job in jobs]
+    for (i, (res, error)) in enumerate(run_tasks(run_component, len(order), nworkers, timeout)):
+        if error != None:
+            print "run_components: {0} failed\n{1}".format(jobs[order[i]][0], error)
+            res = {"name": jobs[order[i]][0], "dir": None, "events": 0, "error": error, "wall": None}
+        results[order[i]] = res
+
+    out = {
+        "wall": time.time() - t0,
+        "workers": nworkers,
+        "components": results,
+        "failed": [r["name"] for r in results if r["error"] != None],
+    }
+    of = open(summary, "w")
+    of.write(json.dumps(out, indent=2))
+    of.close()
+
+    print "{0:40s} {1:>10s} {2:>10s} {3}".format("component", "events", "time [s]", "directory")
+    for r in results:
+        print "{0:40s} {1:10d} {2:>10s} {3}".format(
+            r["name"], r["events"], "-" if r["wall"] is None else "{0:.1f}".format(r["wall"]),
+            r["dir"] if r["error"] is None else "FAILED"
+        )
+    print "{0} components in {1:.1f} s, {2} failed, summary in {3}".format(
+        len(results), out["wall"], len(out["failed"]), summary
+    )
+    return out
@@ -0,0 +1,125 @@
+"""
+Timing and pass-rate profiling of the analyzers of a heppy sequence.
+
+profile_process replaces the process method of an analyzer instance by a
+wrapper which measures the wall and CPU time of every call, fills a
+latency histogram with logarithmic bins and keeps the slowest events with
+their (run, lumi, evt). FilterAnalyzer profiles itself, other analyzers
+(e.g. the tree producer) can be profiled with profiled(cls).
+
+At endLoop, the profile is written to profile.json and profile.csv in the
+analyzer directory.
+"""
+import bisect, heapq, json, os, time
+
+#Upper edges of the latency histogram bins in seconds, 4 bins per decade from 1 us to 100 s
+latency_bins = [10**(-6 + 0.25*i) for i in range(33)]
+
+def event_id(event):
+    """
+    Returns (run, lumi, evt) of the event, or None if not available.
+    """
+    try:
+        return (int(event.input.run), int(event.input.lumi), int(event.input.evt))
+    except Exception:
+        return None
+
+class ProcessProfile(object):
+    """
+    Accumulates the timing of the process calls of one analyzer.
+    """
+    nslowest = 10
+
+    def __init__(self, name):
+        self.name = name
+        self.ncalls = 0
+        self.npass = 0
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.wall_max = 0.0
+        #counts per bin, the last bin is the overflow
+        self.hist = [0 for i in range(len(latency_bins) + 1)]
+        #min-heap of (wall time, iEv, (run, lumi, evt))
+        self.slowest = []
+
+    def add(self, event, wall, cpu, passes):
+        self.ncalls += 1
+        if passes:
+            self.npass += 1
+        self.wall += wall
+        self.cpu += cpu
+        self.wall_max = max(self.wall_max, wall)
+        self.hist[bisect.bisect_left(latency_bins, wall)] += 1
+        #the event ID is only read for events among the slowest
+        if len(self.slowest) < self.nslowest:
+            heapq.heappush(self.slowest, (wall, getattr(event, "iEv", -1), event_id(event)))
+        elif wall > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (wall, getattr(event, "iEv", -1), event_id(event)))
+
+    def summary(self):
+        return {
+            "analyzer": self.name,
+            "processed": self.ncalls,
+            "passes": self.npass,
+            "pass_rate": float(self.npass) / self.ncalls if self.ncalls > 0 else None,
+            "wall_total": self.wall,
+            "cpu_total": self.cpu,
+            "wall_mean": self.wall / self.ncalls if self.ncalls > 0 else None,
+            "cpu_mean": self.cpu / self.ncalls if self.ncalls > 0 else None,
+            "wall_max": self.wall_max,
+            "latency_bins": latency_bins,
+            "latency_hist": self.hist,
+            "slowest": [
+                {"wall": wall, "iEv": iev, "id": evid}
+                for (wall, iev, evid) in sorted(self.slowest, reverse=True)
+            ],
+        }
+
+    def write(self, outdir):
+        """
+        Writes profile.json with the full summary and profile.csv with one
+        row per latency bin to outdir.
+        """
+        summary = self.summary()
+        of = open(os.path.join(outdir, "profile.json"), "w")
+        of.write(json.dumps(summary, indent=2))
+        of.close()
+
+        of = open(os.path.join(outdir, "profile.csv"), "w")
+        of.write("analyzer,low,high,count\n")
+        edges = [0.0] + latency_bins + [float("inf")]
+        for i in range(len(self.hist)):
+            of.write("{0},{1:.3g},{2:.3g},{3}\n".format(self.name, edges[i], edges[i+1], self.hist[i]))
+        of.close()
+        return summary
+
+def profile_process(analyzer, name=None):
+    """
+    Replaces analyzer.process by a timed wrapper and returns its ProcessProfile.
+    """
+    process = analyzer.process
+    profile = ProcessProfile(name if name != None else analyzer.name)
+    def timed_process(event):
+        t0 = time.time()
+        c0 = time.clock()
+        ret = process(event)
+        profile.add(event, time.time() - t0, time.clock() - c0, ret != False)
+        return ret
+    analyzer.process = timed_process
+    return profile
+
+def profiled(cls):
+    """
+    Returns a subclass of the analyzer class cls which profiles its process
+    calls and writes the profile at endLoop.
+    """
+    class _Profiled(cls):
+        def __init__(self, cfg_ana, cfg_comp, looperName):
+            super(_Profiled, self).__init__(cfg_ana, cfg_comp, looperName)
+            self.profile = profile_process(self)
+
+        def endLoop(self, setup):
+            super(_Profiled, self).endLoop(setup)
+            self.profile.write(self.dirName)
+    _Profiled.__name__ = cls.__name__
+    return _Profiled
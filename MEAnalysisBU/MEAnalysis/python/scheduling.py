@@ -0,0 +1,165 @@
+"""
+Dependency-based ordering of the analyzers of a heppy sequence.
+
+Analyzer classes declare the event attributes they read and write as the
+class attributes consumes and produces (lists of names, produces may
+contain fnmatch patterns such as "nB*"). Attributes set on the objects of
+a collection, e.g. jet.btagFlag, are declared by the event attribute set
+together with them. Analyzers without declarations are barriers which keep
+their position in the sequence.
+
+validate_sequence checks that every consumed attribute is produced earlier
+in the sequence. schedule_sequence reorders the declared analyzers between
+barriers: an analyzer stays after every earlier analyzer it shares an
+attribute with (read after write, write after write and write after read),
+and among the analyzers which are ready, the one with the lowest cost per
+rejected event runs first, using the profiles of a previous job
+(profile.json, see TTH.MEAnalysis.profiling).
+"""
+import fnmatch, json, os
+
+#Attributes of the event set by the looper
+looper_attributes = ["input", "iEv", "setup"]
+
+def declarations(ana):
+    """
+    Returns (consumes, produces) of an analyzer configuration, or None if
+    the analyzer class does not declare them.
+    """
+    cls = ana.class_object
+    consumes = getattr(cls, "consumes", None)
+    produces = getattr(cls, "produces", None)
+    if consumes is None or produces is None:
+        return None
+    return (list(consumes), list(produces))
+
+def fixed_prefix(pattern):
+    """
+    Returns the part of an fnmatch pattern before its first wildcard.
+    """
+    for (i, c) in enumerate(pattern):
+        if c in "*?[":
+            return pattern[:i]
+    return pattern
+
+def overlap(a, b):
+    """
+    Returns True if the names or patterns a and b may denote the same
+    attribute. Two patterns overlap if one fixed prefix starts with the
+    other, e.g. "nMatch*" and "nMatch_*".
+    """
+    if a == b:
+        return True
+    pa, pb = fixed_prefix(a), fixed_prefix(b)
+    if pa == a:
+        return fnmatch.fnmatchcase(a, b)
+    if pb == b:
+        return fnmatch.fnmatchcase(b, a)
+    return pa.startswith(pb) or pb.startswith(pa)
+
+def matches(name, patterns):
+    for p in patterns:
+        if overlap(name, p):
+            return True
+    return False
+
+def shares(names, patterns):
+    """
+    Returns True if any of the names or patterns overlaps any of the patterns.
+    """
+    for n in names:
+        if matches(n, patterns):
+            return True
+    return False
+
+def validate_sequence(sequence):
+    """
+    Raises ValueError if an analyzer consumes an attribute that is not
+    produced by an earlier analyzer. Attributes after an undeclared
+    analyzer cannot be checked and are assumed to be produced.
+    """
+    produced = list(looper_attributes)
+    undeclared = None
+    errors = []
+    for ana in sequence:
+        decl = declarations(ana)
+        if decl is None:
+            undeclared = ana.name
+            continue
+        consumes, produces = decl
+        for attr in consumes:
+            if not matches(attr, produced) and undeclared is None:
+                errors += ["{0} consumes {1}, which is not produced before it".format(ana.name, attr)]
+        produced += produces
+    if len(errors) > 0:
+        raise ValueError("invalid analyzer sequence:\n" + "\n".join(errors))
+
+def load_profiles(looper_dir):
+    """
+    Returns {analyzer name: profile summary} from the profile.json files
+    in the analyzer directories of a previous job.
+    """
+    profiles = {}
+    if looper_dir is None or not os.path.isdir(looper_dir):
+        return profiles
+    for d in os.listdir(looper_dir):
+        fn = os.path.join(looper_dir, d, "profile.json")
+        if os.path.isfile(fn):
+            inf = open(fn)
+            prof = json.load(inf)
+            inf.close()
+            profiles[prof["analyzer"]] = prof
+    return profiles
+
+def rank(profile):
+    """
+    Returns the mean time per rejected event of an analyzer, lower runs earlier.
+    Analyzers which never reject, or without a profile, have an infinite rank.
+    """
+    if profile is None or profile.get("wall_mean", None) is None:
+        return float("inf")
+    rejection = 1.0 - profile["pass_rate"]
+    if rejection <= 0.0:
+        return float("inf")
+    return profile["wall_mean"] / rejection
+
+def order_segment(analyzers, profiles):
+    """
+    Orders a list of declared analyzer configurations, see the module doc.
+    """
+    n = len(analyzers)
+    decls = [declarations(ana) for ana in analyzers]
+    after = [set([]) for i in range(n)]
+    for j in range(n):
+        cj, pj = decls[j]
+        for i in range(j):
+            ci, pi = decls[i]
+            if shares(cj, pi) or shares(pj, pi) or shares(ci, pj):
+                after[j].add(i)
+
+    order = []
+    done = set([])
+    while len(order) < n:
+        ready = [j for j in range(n) if not j in done and after[j].issubset(done)]
+        #stable for equal ranks: the original position decides
+        best = min(ready, key=lambda j: (rank(profiles.get(analyzers[j].name, None)), j))
+        order += [best]
+        done.add(best)
+    return [analyzers[j] for j in order]
+
+def schedule_sequence(sequence, profiles={}):
+    """
+    Returns the analyzer configurations of the sequence, reordered between
+    the undeclared analyzers according to the dependencies and profiles.
+    """
+    ret = []
+    segment = []
+    for ana in sequence:
+        if declarations(ana) is None:
+            ret += order_segment(segment, profiles) + [ana]
+            segment = []
+        else:
+            segment += [ana]
+    ret += order_segment(segment, profiles)
+    validate_sequence(ret)
+    return ret
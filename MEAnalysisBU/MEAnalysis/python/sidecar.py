@@ -0,0 +1,274 @@
+"""
+Sidecar files with the per-event results of the analyzers before the MEM.
+
+The lepton, jet, b-tag likelihood, W-tag, category and generator matching
+results do not depend on the MEM configuration. SidecarWriterAnalyzer
+stores them for the events which reach it, and a MEM-only job
+(Conf.general["sidecar"]["memOnly"]) restores them with
+SidecarReaderAnalyzer instead of running these analyzers again.
+
+The selected jets and leptons are stored as indices into the input
+collections (Jet, selLeptons), the b-tagged, untagged and W candidate jets
+as indices into good_jets. The generator quarks, which are reordered and
+decorated by the analyzers, are stored by value. The events are keyed on
+(run, lumi, evt).
+
+Each job of a sample writes DIR/<sample>/<first event>.npz with the arrays
+id (N, 3): run, lumi, evt
+s_<attribute> (N): the scalar attributes
+n_<list> (N), i_<list>: the counts and flat indices of the object lists
+n_<list> (N), v_<list>_<variable>: the counts and flat values of the stored objects
+"""
+import glob, os
+import numpy as np
+
+#event attribute -> input collection of the objects
+indexed_lists = {
+    "good_jets": "Jet",
+    "good_leptons": "selLeptons",
+}
+
+#Subsets of good_jets
+jet_subsets = ["btagged_jets", "buntagged_jets", "wquark_candidate_jets"]
+
+#Attributes set on the good jets by the analyzers
+jet_attributes = ["btagFlag"]
+
+#Generator particle lists stored by value, -1 if a variable is not set
+stored_lists = ["b_quarks_t", "b_quarks_h", "l_quarks_w", "lep_top", "nu_top"]
+stored_variables = ["pt", "eta", "phi", "mass", "pdgId", "is_hadr", "jet_delR", "subjet_delR"]
+
+#Scalar event attributes as (attribute, dtype, default), the defaults are
+#those of the tree producer
+scalars = [
+    ("is_sl", np.bool_, False),
+    ("is_dl", np.bool_, False),
+    ("numJets", np.int32, 0),
+    ("Wmass", np.float64, 0.0),
+    ("btag_LR_4b_2b", np.float64, 0.0),
+    ("btag_LR_4b_2b_old", np.float64, 0.0),
+    ("btag_LR_4b_2b_alt", np.float64, 0.0),
+    ("cat", "S8", ""),
+    ("cat_btag", "S8", ""),
+    ("catn", np.int32, -1),
+    ("cat_btag_n", np.int32, -1),
+    ("cat_gen", "S8", ""),
+    ("n_cat_gen", np.int32, -1),
+    ("nMatchSimB", np.int32, 0),
+    ("nMatchSimC", np.int32, 0),
+    ("n_tagwp_tagged_true_bjets", np.int32, 0),
+    ("n_lr_tagged_true_bjets", np.int32, 0),
+    ("GenQ_jet_sumdelR", np.float64, -1.0),
+    ("GenQ_subjet_sumdelR", np.float64, -1.0),
+]
+
+def scalar_attributes(conf):
+    """
+    Returns the scalar attributes to store, including the number of
+    b-tagged jets for each working point of the configuration (nB<wp>).
+    """
+    attrs = list(scalars)
+    for m in ["wq", "tb", "hb"]:
+        for b in ["", "_btag"]:
+            attrs += [("nMatch_" + m + b, np.int32, 0)]
+    for wp in sorted(conf.jets["btagWPs"].keys()):
+        attrs += [("nB" + wp, np.int32, 0)]
+    return attrs
+
+def index_of(obj, coll):
+    """
+    Returns the position of the object obj in the list coll by identity.
+    """
+    for (i, x) in enumerate(coll):
+        if x is obj:
+            return i
+    raise ValueError("object not found in its input collection")
+
+def event_id(event):
+    return (int(event.input.run), int(event.input.lumi), int(event.input.evt))
+
+class StoredObject(object):
+    """
+    A generator particle restored from the sidecar.
+    """
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+class SidecarWriter(object):
+    """
+    Accumulates the results of the events and saves them to a sidecar file.
+    """
+    def __init__(self, conf):
+        self.scalars = scalar_attributes(conf)
+        self.ids = []
+        self.values = dict([(name, []) for (name, dtype, default) in self.scalars])
+        self.counts = {}
+        self.indices = {}
+        for l in indexed_lists.keys() + jet_subsets + stored_lists:
+            self.counts[l] = []
+            self.indices[l] = []
+        self.jet_values = dict([(v, []) for v in jet_attributes])
+        self.stored = dict([
+            (l, dict([(v, []) for v in stored_variables])) for l in stored_lists
+        ])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, event):
+        self.ids += [event_id(event)]
+        for (name, dtype, default) in self.scalars:
+            v = getattr(event, name, default)
+            self.values[name] += [default if v is None else v]
+
+        for (l, coll) in indexed_lists.items():
+            objs = getattr(event, l)
+            incoll = getattr(event, coll)
+            self.counts[l] += [len(objs)]
+            self.indices[l] += [index_of(o, incoll) for o in objs]
+        for j in event.good_jets:
+            for v in jet_attributes:
+                self.jet_values[v] += [getattr(j, v, -1)]
+
+        for l in jet_subsets:
+            #wquark_candidate_jets may be a set, store in the order of good_jets
+            subset = getattr(event, l)
+            idx = sorted([index_of(o, event.good_jets) for o in subset])
+            self.counts[l] += [len(idx)]
+            self.indices[l] += idx
+
+        for l in stored_lists:
+            objs = getattr(event, l, [])
+            self.counts[l] += [len(objs)]
+            for o in objs:
+                for v in stored_variables:
+                    self.stored[l][v] += [getattr(o, v, -1)]
+
+    def save(self, path):
+        arrays = {"id": np.array(self.ids, dtype=np.int64).reshape(-1, 3)}
+        for (name, dtype, default) in self.scalars:
+            arrays["s_" + name] = np.array(self.values[name], dtype=dtype)
+        for l in indexed_lists.keys() + jet_subsets:
+            arrays["n_" + l] = np.array(self.counts[l], dtype=np.int32)
+            arrays["i_" + l] = np.array(self.indices[l], dtype=np.int32)
+        for v in jet_attributes:
+            arrays["v_good_jets_" + v] = np.array(self.jet_values[v], dtype=np.float32)
+        for l in stored_lists:
+            arrays["n_" + l] = np.array(self.counts[l], dtype=np.int32)
+            for v in stored_variables:
+                arrays["v_{0}_{1}".format(l, v)] = np.array(self.stored[l][v], dtype=np.float64)
+
+        outdir = os.path.dirname(path)
+        if outdir != "" and not os.path.isdir(outdir):
+            os.makedirs(outdir)
+        #write to a temporary file first, such that readers never see a partial file
+        tmp = "{0}.{1}.tmp".format(path, os.getpid())
+        of = open(tmp, "wb")
+        np.savez_compressed(of, **arrays)
+        of.close()
+        os.rename(tmp, path)
+
+def sidecar_files(sidecar_dir, sample):
+    return sorted(glob.glob(os.path.join(sidecar_dir, sample, "*.npz")))
+
+def offsets(counts):
+    ret = np.zeros(len(counts) + 1, dtype=np.int64)
+    np.cumsum(counts, out=ret[1:])
+    return ret
+
+class SidecarTable(object):
+    """
+    The sidecar files of a sample, with the events found by their (run, lumi, evt).
+    """
+    def __init__(self, files, conf):
+        self.scalars = scalar_attributes(conf)
+        parts = [np.load(fn) for fn in files]
+        def cat(key, dtype):
+            if len(parts) == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.concatenate([p[key] for p in parts])
+
+        self.ids = cat("id", np.int64).reshape(-1, 3)
+        self.values = {}
+        for (name, dtype, default) in self.scalars:
+            self.values[name] = cat("s_" + name, dtype).tolist()
+        self.offsets = {}
+        self.indices = {}
+        self.stored = {}
+        for l in indexed_lists.keys() + jet_subsets + stored_lists:
+            self.offsets[l] = offsets(cat("n_" + l, np.int32))
+        #the indices are relative to each event, no shift is needed after concatenation
+        for l in indexed_lists.keys() + jet_subsets:
+            self.indices[l] = cat("i_" + l, np.int32).tolist()
+        self.jet_values = dict([
+            (v, cat("v_good_jets_" + v, np.float32).tolist()) for v in jet_attributes
+        ])
+        for l in stored_lists:
+            self.stored[l] = dict([
+                (v, cat("v_{0}_{1}".format(l, v), np.float64).tolist()) for v in stored_variables
+            ])
+        for p in parts:
+            p.close()
+        self.rows = dict([(tuple(x), i) for (i, x) in enumerate(self.ids.tolist())])
+
+    def __len__(self):
+        return len(self.ids)
+
+    def event_ids(self):
+        return [tuple(x) for x in self.ids.tolist()]
+
+    def find(self, event):
+        """
+        Returns the row of the event, None if it is not in the sidecar.
+        """
+        return self.rows.get(event_id(event), None)
+
+    def read_event(self, event, row):
+        """
+        Sets the stored attributes of the event from the row.
+        """
+        for (name, dtype, default) in self.scalars:
+            setattr(event, name, self.values[name][row])
+        for (l, coll) in indexed_lists.items():
+            lo, hi = self.offsets[l][row], self.offsets[l][row + 1]
+            incoll = getattr(event, coll)
+            setattr(event, l, [incoll[i] for i in self.indices[l][lo:hi]])
+
+        lo = self.offsets["good_jets"][row]
+        for (i, j) in enumerate(event.good_jets):
+            for v in jet_attributes:
+                setattr(j, v, self.jet_values[v][lo + i])
+
+        for l in jet_subsets:
+            lo, hi = self.offsets[l][row], self.offsets[l][row + 1]
+            setattr(event, l, [event.good_jets[i] for i in self.indices[l][lo:hi]])
+
+        for l in stored_lists:
+            lo, hi = self.offsets[l][row], self.offsets[l][row + 1]
+            stored = self.stored[l]
+            setattr(event, l, [
+                StoredObject(**dict([(v, stored[v][k]) for v in stored_variables]))
+                for k in range(lo, hi)
+            ])
+        #the category is compared to the strings of the configuration
+        if event.cat_gen == "":
+            event.cat_gen = None
+
+def load_sidecar(sidecar_dir, sample, conf):
+    """
+    Returns the SidecarTable of all the sidecar files of the sample.
+    """
+    return SidecarTable(sidecar_files(sidecar_dir, sample), conf)
+
+def sidecar_event_ids(sidecar_dir, samples):
+    """
+    Returns the (run, lumi, evt) of all the events in the sidecars of the
+    samples, read from the id arrays only.
+    """
+    ret = []
+    for sample in samples:
+        for fn in sidecar_files(sidecar_dir, sample):
+            f = np.load(fn)
+            ret += [tuple(x) for x in f["id"].tolist()]
+            f.close()
+    return ret
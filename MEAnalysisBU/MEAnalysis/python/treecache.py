@@ -0,0 +1,86 @@
+"""
+TTreeCache setup and read statistics for the input TTree/TChain.
+
+The configuration is a dict, by default Conf.general["treeCache"]:
+    size (int): cache size in bytes, 0 disables the cache
+    learnEntries (int): number of entries in the learning phase, during
+        which the cache finds out which branches are read
+    asyncPrefetch (bool): prefetch the next cache block in a separate thread
+"""
+import ROOT
+
+default_conf = {
+    "size": 30 * 1024 * 1024,
+    "learnEntries": 100,
+    "asyncPrefetch": True,
+}
+
+def enable_async_prefetch(enable=True):
+    """
+    Enables asynchronous prefetching, must be called before the files are opened.
+    """
+    ROOT.gEnv.SetValue("TFile.AsyncPrefetching", 1 if enable else 0)
+
+def configure_cache(tree, conf):
+    """
+    Sets up the TTreeCache of a TTree or TChain.
+    """
+    size = conf.get("size", default_conf["size"])
+    tree.SetCacheSize(size)
+    if size > 0:
+        tree.SetCacheLearnEntries(conf.get("learnEntries", default_conf["learnEntries"]))
+
+def cache_efficiency(tree):
+    """
+    Returns the fraction of reads served by the TTreeCache of the current
+    file, or None if there is no cache.
+    """
+    f = tree.GetCurrentFile()
+    if f == None:
+        return None
+    cache = f.GetCacheRead(tree.GetTree())
+    if cache == None or not hasattr(cache, "GetEfficiency"):
+        return None
+    return cache.GetEfficiency()
+
+class ReadStats(object):
+    """
+    Counts the bytes read, the read calls and the cache hit rate of a job.
+
+    The byte and call counts are the global TFile counters, taken relative
+    to begin(). The hit rate is averaged over the files, weighted by the
+    number of entries processed in each file.
+    """
+    def __init__(self):
+        self.begin()
+
+    def begin(self):
+        self.bytes0 = ROOT.TFile.GetFileBytesRead()
+        self.calls0 = ROOT.TFile.GetFileReadCalls()
+        self.nfiles = 0
+        self.nentries = 0
+        self.hits = 0.0
+        self.nentries_cached = 0
+
+    def file_done(self, eff, nentries):
+        """
+        Adds a file with the cache efficiency eff (or None), where nentries
+        were processed.
+        """
+        self.nfiles += 1
+        self.nentries += nentries
+        if eff != None:
+            self.hits += eff * nentries
+            self.nentries_cached += nentries
+
+    def summary(self):
+        bytes_read = ROOT.TFile.GetFileBytesRead() - self.bytes0
+        read_calls = ROOT.TFile.GetFileReadCalls() - self.calls0
+        return {
+            "files": self.nfiles,
+            "entries": self.nentries,
+            "bytes_read": int(bytes_read),
+            "read_calls": int(read_calls),
+            "bytes_per_call": float(bytes_read) / read_calls if read_calls > 0 else 0.0,
+            "cache_hit_rate": self.hits / self.nentries_cached if self.nentries_cached > 0 else None,
+        }
@@ -0,0 +1,115 @@
+"""
+Generates compact particle record classes for the collections of a VHbb
+TTree, as a replacement of the hand-maintained classes in VHbbTree.py.
+
+The generated classes use __slots__ instead of a per-instance __dict__ and
+make_array looks up every branch of the collection only once per event.
+
+Usage:
+python vhbb_classgen.py input.root [--tree tree] > VHbbTreeSlots.py
+"""
+import argparse
+
+#Collections whose class name differs from the branch prefix
+default_renames = {
+    "httCandidates": "httCandidate",
+}
+
+#Attributes which are set on the collection objects by the analyzers,
+#e.g. MECoreAnalyzers.BTagLRAnalyzer sets jet.btagFlag
+default_extra_slots = [
+    "btagFlag",
+    "is_hadr",
+    "jet_delR",
+    "subjet_delR",
+]
+
+def tree_schema(tree, renames=default_renames):
+    """
+    Finds the collections of a TTree by grouping the leaves by their
+    counter leaf (nXYZ).
+
+    Returns a dict of {class name: (counter, [(attribute, branch), ...])}.
+    """
+    schema = {}
+    for leaf in tree.GetListOfLeaves():
+        counter = leaf.GetLeafCount()
+        if counter == None:
+            continue
+        counter = counter.GetName()
+        branch = leaf.GetName()
+        prefix = counter[1:] if counter.startswith("n") else counter
+        if branch == prefix:
+            attr = branch
+        elif branch.startswith(prefix + "_"):
+            attr = branch[len(prefix)+1:]
+        else:
+            attr = branch
+        name = renames.get(prefix, prefix)
+        if not schema.has_key(name):
+            schema[name] = (counter, [])
+        schema[name][1].append((attr, branch))
+    return schema
+
+def classes_schema(classes):
+    """
+    Returns the schema (as in tree_schema) of existing VHbbTree classes.
+    """
+    from TTH.MEAnalysis.VHbbTree import collection_schema
+    schema = {}
+    for cls in classes:
+        counter, fields = collection_schema(cls)
+        schema[cls.__name__] = (counter, sorted(fields.items(), key=lambda x: x[1]))
+    return schema
+
+def emit_class(name, counter, fields, extra_slots=default_extra_slots):
+    """
+    Returns the python source of a __slots__ record class.
+    """
+    attrs = [attr for (attr, branch) in fields]
+    slots = attrs + [s for s in extra_slots if s not in attrs]
+    lines = []
+    lines += ["class {0}(object):".format(name)]
+    lines += ["    __slots__ = ["]
+    lines += ["        \"{0}\",".format(s) for s in slots]
+    lines += ["    ]"]
+    lines += ["    schema = (\"{0}\", {{".format(counter)]
+    lines += ["        \"{0}\": \"{1}\",".format(attr, branch) for (attr, branch) in fields]
+    lines += ["    })"]
+    lines += ["    def __init__(self, {0}):".format(", ".join(attrs))]
+    lines += ["        self.{0} = {0}".format(attr) for attr in attrs]
+    lines += ["    @staticmethod"]
+    lines += ["    def make_array(event):"]
+    lines += ["        tree = event.input"]
+    lines += ["        n = tree.{0}".format(counter)]
+    lines += ["        if n == 0:"]
+    lines += ["            return []"]
+    lines += ["        _{0} = tree.{1}".format(i, branch) for (i, (attr, branch)) in enumerate(fields)]
+    lines += ["        return [{0}({1}) for i in xrange(n)]".format(
+        name, ", ".join(["_{0}[i]".format(i) for i in range(len(fields))])
+    )]
+    return "\n".join(lines) + "\n"
+
+def emit_module(schema, extra_slots=default_extra_slots):
+    """
+    Returns the python source of a module with one class per collection.
+    """
+    out = "#Automatically generated by TTH/MEAnalysis/python/vhbb_classgen.py, do not edit\n"
+    for name in sorted(schema.keys()):
+        counter, fields = schema[name]
+        out += emit_class(name, counter, fields, extra_slots)
+    return out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generates __slots__ classes from a VHbb TTree")
+    parser.add_argument("infile", type=str, help="input ROOT file")
+    parser.add_argument("--tree", type=str, default="tree", help="name of the TTree")
+    parser.add_argument("--extra-slots", type=str, nargs="*", default=default_extra_slots,
+        help="attributes which analyzers may set on the objects"
+    )
+    args = parser.parse_args()
+
+    import ROOT
+    tf = ROOT.TFile.Open(args.infile)
+    tree = tf.Get(args.tree)
+    print emit_module(tree_schema(tree), args.extra_slots)
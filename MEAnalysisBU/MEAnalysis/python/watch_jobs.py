@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+Shows the progress of the local heppy jobs from the status.json files
+written by TTH.MEAnalysis.monitor, e.g.
+
+python watch_jobs.py 'jobs/*/Loop_*' --interval 60 --prom /var/lib/node_exporter/heppy.prom
+
+Jobs which have not updated their status for --stale seconds are marked
+STUCK (or killed), finished jobs DONE.
+"""
+import argparse, glob, json, os, time
+
+from TTH.MEAnalysis.monitor import prometheus_text, write_atomic
+
+def find_statuses(patterns):
+    """
+    Returns the statuses of the looper directories matching the glob patterns.
+    """
+    statuses = []
+    for pattern in patterns:
+        for d in sorted(glob.glob(pattern)):
+            fn = os.path.join(d, "status.json")
+            if not os.path.isfile(fn):
+                continue
+            inf = open(fn)
+            status = json.load(inf)
+            inf.close()
+            status["dir"] = d
+            statuses += [status]
+    return statuses
+
+def state(status, stale):
+    if status["done"]:
+        return "DONE"
+    if time.time() - status["time"] > stale:
+        return "STUCK"
+    return "RUN"
+
+def format_seconds(t):
+    if t is None:
+        return "-"
+    t = int(t)
+    return "{0}:{1:02d}:{2:02d}".format(t / 3600, (t / 60) % 60, t % 60)
+
+def format_rate(r):
+    return "-" if r is None else "{0:.1f}".format(r)
+
+def show(statuses, stale, analyzers):
+    print "{0:40s} {1:>5s} {2:>10s} {3:>10s} {4:>8s} {5:>8s} {6:>8s} {7:>9s}".format(
+        "job", "state", "entry", "end", "ev/s", "recent", "mem/s", "ETA"
+    )
+    total_rate = 0.0
+    nstate = {}
+    for status in statuses:
+        st = state(status, stale)
+        nstate[st] = nstate.get(st, 0) + 1
+        if st == "RUN":
+            total_rate += status["rate_recent"] or status["rate"] or 0.0
+        print "{0:40s} {1:>5s} {2:>10s} {3:>10d} {4:>8s} {5:>8s} {6:>8s} {7:>9s}".format(
+            status["dir"][-40:], st, str(status["entry"]), status["endEvent"],
+            format_rate(status["rate"]), format_rate(status["rate_recent"]),
+            format_rate(status["mem_rate"]), format_seconds(status["eta"])
+        )
+        if analyzers:
+            for (name, rate) in sorted(status["analyzers"].items(), key=lambda x: x[1]):
+                print "    {0:36s} {1:>10.1f} ev/s".format(name, rate)
+    print "{0} jobs, {1}, {2:.1f} ev/s in the running jobs".format(
+        len(statuses), ", ".join(["{0} {1}".format(v, k) for (k, v) in sorted(nstate.items())]),
+        total_rate
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shows the progress of the local heppy jobs")
+    parser.add_argument("patterns", type=str, nargs="*", default=["Loop_*"],
+        help="glob patterns of the looper directories"
+    )
+    parser.add_argument("--stale", type=float, default=600,
+        help="seconds without a status update after which a job is stuck"
+    )
+    parser.add_argument("--analyzers", action="store_true",
+        help="show the events per second of each analyzer"
+    )
+    parser.add_argument("--interval", type=float, default=0,
+        help="refresh every N seconds, 0 to show once"
+    )
+    parser.add_argument("--prom", type=str, default=None,
+        help="also write the metrics of all the jobs to this Prometheus text file"
+    )
+    args = parser.parse_args()
+
+    while True:
+        statuses = find_statuses(args.patterns)
+        show(statuses, args.stale, args.analyzers)
+        if args.prom != None:
+            write_atomic(args.prom, prometheus_text(statuses))
+        if args.interval <= 0:
+            break
+        time.sleep(args.interval)
+        print
@@ -0,0 +1,79 @@
+"""
+Reads the EventAnalyzer branches of the input files with and without the
+TTreeCache and prints the bytes read, read calls, cache hit rate and time.
+
+Usage:
+python test/bench_readcache.py file1.root [file2.root ...] [--entries N]
+python test/bench_readcache.py /path/to/file.root --xrootd-port 1094
+
+With --xrootd-port, a local xrootd server is started on the directory of
+the files and they are read through root://localhost:PORT//path, as a
+stand-in for a remote storage element.
+"""
+import argparse, os, subprocess, time
+import ROOT
+
+from TTH.MEAnalysis.VHbbTree import EventAnalyzer
+from TTH.MEAnalysis.treecache import ReadStats, configure_cache, cache_efficiency, enable_async_prefetch
+
+def read(files, nentries, cache_conf):
+    chain = ROOT.TChain("tree")
+    for fn in files:
+        chain.Add(fn)
+    chain.SetBranchStatus("*", False)
+    for br in EventAnalyzer.input_branches:
+        chain.SetBranchStatus(br, True)
+    if cache_conf != None:
+        configure_cache(chain, cache_conf)
+    else:
+        chain.SetCacheSize(0)
+
+    stats = ReadStats()
+    nentries = min(nentries, int(chain.GetEntries()))
+    t0 = time.time()
+    tree_number = -1
+    nfile = 0
+    eff = None
+    for i in xrange(nentries):
+        chain.GetEntry(i)
+        if chain.GetTreeNumber() != tree_number:
+            if tree_number >= 0:
+                stats.file_done(eff, nfile)
+            tree_number = chain.GetTreeNumber()
+            nfile = 0
+        nfile += 1
+        eff = cache_efficiency(chain)
+    stats.file_done(eff, nfile)
+    summary = stats.summary()
+    summary["time"] = time.time() - t0
+    return summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("files", type=str, nargs="+")
+    parser.add_argument("--entries", type=int, default=10000)
+    parser.add_argument("--cache-size", type=int, default=30*1024*1024)
+    parser.add_argument("--learn-entries", type=int, default=100)
+    parser.add_argument("--xrootd-port", type=int, default=0)
+    args = parser.parse_args()
+
+    files = args.files
+    server = None
+    if args.xrootd_port > 0:
+        files = [os.path.abspath(fn) for fn in files]
+        exportdir = os.path.dirname(files[0])
+        server = subprocess.Popen(["xrootd", "-p", str(args.xrootd_port), exportdir])
+        time.sleep(2)
+        files = ["root://localhost:{0}/{1}".format(args.xrootd_port, fn) for fn in files]
+
+    try:
+        for (label, prefetch, cache_conf) in [
+            ("no cache", False, None),
+            ("cache", False, {"size": args.cache_size, "learnEntries": args.learn_entries}),
+            ("cache+async", True, {"size": args.cache_size, "learnEntries": args.learn_entries}),
+        ]:
+            enable_async_prefetch(prefetch)
+            print label, read(files, args.entries, cache_conf)
+    finally:
+        if server != None:
+            server.terminate()
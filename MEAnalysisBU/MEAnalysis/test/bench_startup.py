@@ -0,0 +1,53 @@
+"""
+Measures the startup time of the MEAnalysis jobs: importing ROOT, the
+analyzers, configuring MEAnalysis_heppy (reading the configuration and
+the samples, building the sequence) and loading the MEM libraries, each
+in a fresh python process.
+
+Usage:
+python test/bench_startup.py [--repeat N]
+
+ME_CONF can be set as for MEAnalysis_heppy.py.
+"""
+import argparse, subprocess, sys, time
+
+stages = [
+    ("python", "pass"),
+    ("import ROOT", "import ROOT"),
+    ("import MECoreAnalyzers", "import TTH.MEAnalysis.MECoreAnalyzers"),
+    ("configure MEAnalysis_heppy", "import TTH.MEAnalysis.MEAnalysis_heppy"),
+    ("load MEM libraries",
+        "import TTH.MEAnalysis.MECoreAnalyzers as m; m.load_mem_libraries()"),
+]
+
+#prints the time spent in the statement, without the interpreter startup
+template = "import time; t0 = time.time(); {0}; print 'STAGE_TIME', time.time() - t0"
+
+def run(stmt):
+    """
+    Returns (time of the statement, time of the process) in seconds.
+    """
+    t0 = time.time()
+    out = subprocess.check_output([sys.executable, "-c", template.format(stmt)])
+    total = time.time() - t0
+    for line in out.splitlines():
+        if line.startswith("STAGE_TIME"):
+            return (float(line.split()[1]), total)
+    raise ValueError("no timing in the output of {0}".format(stmt))
+
+def median(xs):
+    xs = sorted(xs)
+    return xs[len(xs)/2]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    print "{0:30s} {1:>10s} {2:>10s} {3:>10s}".format("stage", "min [s]", "median [s]", "process [s]")
+    for (label, stmt) in stages:
+        times = [run(stmt) for i in range(args.repeat)]
+        print "{0:30s} {1:10.3f} {2:10.3f} {3:10.3f}".format(
+            label, min([t[0] for t in times]), median([t[0] for t in times]),
+            median([t[1] for t in times])
+        )
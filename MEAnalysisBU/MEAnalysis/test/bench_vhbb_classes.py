@@ -0,0 +1,123 @@
+"""
+Compares the construction time and memory of the VHbbTree collection
+classes with the generated __slots__ classes (vhbb_classgen) and the
+array-backed ColumnRecord views (columnar).
+
+Usage:
+python test/bench_vhbb_classes.py [input.root] [--entries N]
+
+Without an input file, a synthetic in-memory tree is used.
+"""
+import argparse, sys, time
+import numpy as np
+
+from TTH.MEAnalysis import VHbbTree
+from TTH.MEAnalysis.columnar import ColumnBlock, collection_schema
+from TTH.MEAnalysis.vhbb_classgen import classes_schema, emit_module
+
+classes = [VHbbTree.Jet, VHbbTree.selLeptons, VHbbTree.GenBQuarkFromTop]
+
+class SyntheticLeaf(object):
+    def GetTypeName(self):
+        return "Float_t"
+
+class SyntheticTree(object):
+    """
+    Minimal stand-in for a TTree with random collection contents.
+    """
+    def __init__(self, nentries, classes, seed=1):
+        rng = np.random.RandomState(seed)
+        self.nentries = nentries
+        self.entry = 0
+        self.counts = {}
+        self.data = {}
+        for cls in classes:
+            counter, fields = collection_schema(cls)
+            self.counts[counter] = rng.randint(0, 12, size=nentries)
+            for branch in fields.values():
+                self.data[branch] = [
+                    rng.uniform(0, 100, size=n).astype(np.float32)
+                    for n in self.counts[counter]
+                ]
+
+    def GetEntries(self):
+        return self.nentries
+
+    def GetEntry(self, i):
+        self.entry = i
+
+    def GetReadEntry(self):
+        return self.entry
+
+    def GetLeaf(self, branch):
+        return SyntheticLeaf()
+
+    def __getattr__(self, name):
+        if name.startswith("__"):
+            raise AttributeError(name)
+        if self.counts.has_key(name):
+            return int(self.counts[name][self.entry])
+        return self.data[name][self.entry]
+
+class Event(object):
+    pass
+
+def object_size(obj):
+    size = sys.getsizeof(obj)
+    if hasattr(obj, "__dict__"):
+        size += sys.getsizeof(obj.__dict__)
+    return size
+
+def bench_make_array(tree, classes, nentries):
+    ev = Event()
+    ev.input = tree
+    objs = []
+    t0 = time.time()
+    for i in xrange(nentries):
+        tree.GetEntry(i)
+        for cls in classes:
+            objs += cls.make_array(ev)
+    dt = time.time() - t0
+    return dt, objs
+
+def bench_columnar(tree, classes, nentries):
+    objs = []
+    t0 = time.time()
+    block = ColumnBlock.load(tree, 0, nentries, classes)
+    for i in xrange(nentries):
+        for cls in classes:
+            objs += block.collection(cls.__name__, i)
+    #ColumnRecord attributes are read on access, include one access per object
+    for o in objs:
+        o.pt
+    dt = time.time() - t0
+    return dt, objs
+
+def report(label, dt, objs, nentries):
+    mem = sum(object_size(o) for o in objs)
+    print "{0:<12} {1:8.3f} s {2:10.1f} us/event {3:10d} objects {4:8.1f} B/object".format(
+        label, dt, 1e6 * dt / max(nentries, 1), len(objs), float(mem) / max(len(objs), 1)
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("infile", type=str, nargs="?", default=None)
+    parser.add_argument("--entries", type=int, default=2000)
+    args = parser.parse_args()
+
+    if args.infile is None:
+        tree = SyntheticTree(args.entries, classes)
+    else:
+        import ROOT
+        tf = ROOT.TFile.Open(args.infile)
+        tree = tf.Get("tree")
+    nentries = min(args.entries, int(tree.GetEntries()))
+
+    #generate the __slots__ classes from the same schema
+    gen = {}
+    exec emit_module(classes_schema(classes)) in gen
+    gen_classes = [gen[cls.__name__] for cls in classes]
+
+    report("VHbbTree", *(bench_make_array(tree, classes, nentries) + (nentries, )))
+    report("slots", *(bench_make_array(tree, gen_classes, nentries) + (nentries, )))
+    report("columnar", *(bench_columnar(tree, classes, nentries) + (nentries, )))
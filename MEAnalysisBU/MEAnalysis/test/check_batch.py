@@ -0,0 +1,162 @@
+"""
+Checks that the batch versions of the filter analyzers (process_batch,
+count_batch and fill_event, see columnar.run_batch) pass the same events,
+increment the same counters and set the same event attributes as their
+per-event process.
+
+Usage:
+python test/check_batch.py
+"""
+import shutil, sys, tempfile
+import numpy as np
+
+import PhysicsTools.HeppyCore.framework.config as cfg
+import TTH.MEAnalysis.MECoreAnalyzers as MECoreAnalyzers
+from TTH.MEAnalysis.MEAnalysis_cfg_heppy import Conf
+from TTH.MEAnalysis.columnar import ColumnBlock, ColumnRecord, EventBatch, offsets_from_counts
+
+class Event(object):
+    pass
+
+def add_collection(block, rng, name, counts, values):
+    """
+    Adds the collection name with counts[i] particles at the position i,
+    values is a dict of attribute -> (choices, dtype) of the particles.
+    """
+    block.offsets[name] = offsets_from_counts(counts)
+    block.fields[name] = {}
+    for (attr, (choices, dtype)) in sorted(values.items()):
+        branch = name + "_" + attr
+        block.fields[name][attr] = branch
+        block.columns[branch] = rng.choice(choices, counts.sum()).astype(dtype)
+
+def make_block(rng, n):
+    """
+    Returns a block of n events, the values are drawn from a few choices
+    around and at the cuts such that all the lepton categories are populated
+    and many jets have equal pt.
+    """
+    block = ColumnBlock(0, n)
+    add_collection(block, rng, "selLeptons", rng.randint(0, 4, n), {
+        "pt": ([8.0, 15.0, 20.0, 25.0, 30.0, 35.0], np.float32),
+        "eta": ([-2.4, -2.3, -1.0, 0.5, 2.1, 2.15], np.float32),
+        "pdgId": ([11, -11, 13, -13, 15], np.int32),
+        "relIso03": ([0.03, 0.1, 0.11, 0.12, 0.13, 0.15, 0.18, 0.2, 0.3], np.float32),
+        "tightId": ([0, 1, 1], np.int32),
+        "looseIdPOG": ([0, 1, 1], np.int32),
+    })
+    add_collection(block, rng, "Jet", rng.randint(0, 18, n), {
+        "pt": ([25.0, 30.0, 40.0, 40.0, 55.0, 70.0], np.float32),
+        "eta": ([-2.7, -2.5, -1.0, 0.5, 2.4], np.float32),
+        "phi": ([-3.0, 0.0, 1.5], np.float32),
+        "mass": ([5.0, 10.0], np.float32),
+        "btagCSV": ([0.1, 0.423, 0.6, 0.814, 0.95], np.float32),
+        "mcFlavour": ([5, -5, 0, 4], np.int32),
+    })
+    return block
+
+def leading_cut(block, conf):
+    """
+    Returns the number of events with more than 9 good jets, of which the
+    9 leading ones are selected.
+    """
+    n = 0
+    for i in range(len(block)):
+        good = [j for j in block.collection("Jet", i) if j.pt > conf.jets["pt"] and abs(j.eta) < conf.jets["eta"]]
+        if len(good) > 9:
+            n += 1
+    return n
+
+def make_analyzer(cls, conf, looper_dir):
+    ana = cls(cfg.Analyzer(cls, "check", _conf=conf, nosubdir=True), None, looper_dir)
+    ana.beginLoop(None)
+    return ana
+
+def normalize(v):
+    """
+    Returns v with the particles replaced by their index in the block.
+    """
+    if isinstance(v, ColumnRecord):
+        return ("particle", v._index)
+    if isinstance(v, (list, tuple)):
+        return [normalize(x) for x in v]
+    return (type(v).__name__, v)
+
+def attributes(event):
+    return dict([
+        (k, normalize(v)) for (k, v) in event.__dict__.items() if not k in ["batch", "batch_index"]
+    ])
+
+def counts(ana):
+    return [(counter.name, [list(item) for item in counter]) for counter in ana.counters.counters]
+
+def compare(cls, conf, block, batch_size, looper_dir, errors):
+    """
+    Processes all the events of the block with the batch version and with
+    process, and compares the results. Returns the number of passing events.
+    """
+    batched = make_analyzer(cls, conf, looper_dir)
+    single = make_analyzer(cls, conf, looper_dir)
+    npass = 0
+    for i in range(len(block)):
+        if i % batch_size == 0:
+            batch = EventBatch(block, i, i + batch_size)
+        events = []
+        for ana in [batched, single]:
+            event = Event()
+            for name in block.offsets.keys():
+                setattr(event, name, block.collection(name, i))
+            events += [event]
+        events[0].batch = batch
+        events[0].batch_index = i - batch.start
+        passes = batched.process(events[0])
+        if passes != cls.process(single, events[1]):
+            errors += ["{0} event {1}: passes {2} in the batch".format(cls.__name__, i, passes)]
+            continue
+        if not passes:
+            continue
+        npass += 1
+        a, b = attributes(events[0]), attributes(events[1])
+        for k in sorted(set(a.keys()) | set(b.keys())):
+            if a.get(k, None) != b.get(k, None):
+                errors += ["{0} event {1} {2}: {3} in the batch, {4} in process".format(
+                    cls.__name__, i, k, a.get(k, None), b.get(k, None))
+                ]
+    if batch.masks.get(batched.name, None) is None:
+        errors += ["{0} has no batch mask".format(cls.__name__)]
+    if counts(batched) != counts(single):
+        errors += ["{0} counters {1} in the batch, {2} in process".format(
+            cls.__name__, counts(batched), counts(single))
+        ]
+    print cls.__name__, "passes", npass, "of", len(block)
+    return npass
+
+if __name__ == "__main__":
+    looper_dir = tempfile.mkdtemp()
+    conf = Conf()
+    conf.general["verbosity"] = []
+    rng = np.random.RandomState(1)
+    block = make_block(rng, 2000)
+    errors = []
+
+    if compare(MECoreAnalyzers.LeptonAnalyzer, conf, block, 300, looper_dir, errors) == 0:
+        errors += ["no event passes the LeptonAnalyzer"]
+
+    #the 9 leading jets are ranked by pt, in input order for equal pt
+    ncut = leading_cut(block, conf)
+    print "events with more than 9 good jets", ncut
+    if ncut == 0:
+        errors += ["the leading jet selection is not exercised"]
+    if compare(MECoreAnalyzers.JetAnalyzer, conf, block, 300, looper_dir, errors) == 0:
+        errors += ["no event passes the JetAnalyzer"]
+
+    #unsorted thresholds, some equal to the discriminator values
+    conf.jets["btagScan"] = ("btagCSV", [0.9, 0.1, 0.5, np.float32(0.6), 0.0])
+    compare(MECoreAnalyzers.JetAnalyzer, conf, block, 300, looper_dir, errors)
+    shutil.rmtree(looper_dir)
+
+    if len(errors) > 0:
+        print "\n".join(errors[:20])
+        print "FAILED"
+        sys.exit(1)
+    print "OK"
@@ -0,0 +1,94 @@
+"""
+Checks that a columnar store converted with columnstore.convert holds the
+collections and scalar branches of the input tree, over several blocks and
+input files.
+
+Usage:
+python test/check_columnstore.py
+"""
+import array, os, shutil, sys, tempfile
+import ROOT
+
+from TTH.MEAnalysis.VHbbTree import Jet, collection_schema
+from TTH.MEAnalysis.columnstore import convert, ColumnStore, ColumnStoreEvents
+
+def value(entry, k, ibranch):
+    """
+    The value of the branch ibranch for the particle k of the entry, exact in float.
+    """
+    return entry * 100.0 + k + ibranch * 0.5
+
+def multiplicity(entry):
+    return (entry * 7) % 5
+
+def write_tree(fn, nentries, first):
+    """
+    Writes a tree with the Jet collection and the run branch, the entries
+    are numbered from first.
+    """
+    counter, fields = collection_schema(Jet)
+    branches = sorted(set(fields.values()))
+    of = ROOT.TFile(fn, "RECREATE")
+    tree = ROOT.TTree("tree", "tree")
+    n = array.array("i", [0])
+    run = array.array("i", [0])
+    tree.Branch(counter, n, counter + "/I")
+    tree.Branch("run", run, "run/I")
+    bufs = []
+    for branch in branches:
+        buf = array.array("f", [0.0] * 10)
+        tree.Branch(branch, buf, "{0}[{1}]/F".format(branch, counter))
+        bufs += [buf]
+    for entry in range(first, first + nentries):
+        n[0] = multiplicity(entry)
+        run[0] = entry
+        for (ibranch, buf) in enumerate(bufs):
+            for k in range(n[0]):
+                buf[k] = value(entry, k, ibranch)
+        tree.Fill()
+    of.Write()
+    of.Close()
+    return branches
+
+if __name__ == "__main__":
+    tmp = tempfile.mkdtemp()
+    files = [os.path.join(tmp, "a.root"), os.path.join(tmp, "b.root")]
+    branches = write_tree(files[0], 23, 0)
+    write_tree(files[1], 17, 23)
+    path = os.path.join(tmp, "store")
+    n = convert(files, path, classes=[Jet], scalars=["run", "evt"], block_size=10)
+    print "converted", n, "events"
+
+    errors = []
+    if n != 40:
+        errors += ["converted {0} of 40 events".format(n)]
+    store = ColumnStore(path)
+    if store.meta["scalars"] != ["run"]:
+        errors += ["scalars {0}, evt is not in the tree".format(store.meta["scalars"])]
+    counter, fields = collection_schema(Jet)
+    for entry in range(n):
+        jets = store.block.collection("Jet", entry)
+        if len(jets) != multiplicity(entry):
+            errors += ["entry {0}: {1} jets, expected {2}".format(entry, len(jets), multiplicity(entry))]
+            continue
+        for (k, jet) in enumerate(jets):
+            for (attr, branch) in fields.items():
+                v = getattr(jet, attr)
+                if v != value(entry, k, branches.index(branch)):
+                    errors += ["entry {0} jet {1} {2} = {3}".format(entry, k, attr, v)]
+
+    #the store as the input of the looper, two stores one after the other
+    events = ColumnStoreEvents([path, path])
+    if len(events) != 2 * n:
+        errors += ["ColumnStoreEvents has {0} events".format(len(events))]
+    for index in [0, 22, 23, 39, 40, 79]:
+        ev = events[index]
+        if ev.run != index % n or ev.GetReadEntry() != index % n:
+            errors += ["event {0}: run {1}, entry {2}".format(index, ev.run, ev.GetReadEntry())]
+    shutil.rmtree(tmp)
+
+    if len(errors) > 0:
+        print "\n".join(errors[:20])
+        print "FAILED"
+        sys.exit(1)
+    print "OK"
@@ -0,0 +1,96 @@
+"""
+Checks the four-momenta, invariant masses and delta R of
+TTH.MEAnalysis.kinematics against ROOT.TLorentzVector, and the sharing of
+the converted particles by the KinematicsCache.
+
+Usage:
+python test/check_kinematics.py
+"""
+import random, sys
+import numpy as np
+import ROOT
+
+from TTH.MEAnalysis.kinematics import Kinematics, KinematicsCache, invariant_mass
+
+class Particle(object):
+    """
+    A particle which counts the reads of its kinematic attributes.
+    """
+    reads = 0
+
+    def __init__(self, pt, eta, phi, mass):
+        self._p4 = (pt, eta, phi, mass)
+
+    def __getattr__(self, attr):
+        if not attr in ["pt", "eta", "phi", "mass"]:
+            raise AttributeError(attr)
+        Particle.reads += 1
+        return self._p4[["pt", "eta", "phi", "mass"].index(attr)]
+
+def lorentz(p):
+    v = ROOT.TLorentzVector()
+    v.SetPtEtaPhiM(p.pt, p.eta, p.phi, p.mass)
+    return v
+
+def close(a, b, tolerance=1e-9):
+    return abs(a - b) <= tolerance * max(1.0, abs(b))
+
+def check_kinematics(kin, particles, errors):
+    """
+    Compares the momenta, pair masses and delta R of kin with the
+    TLorentzVectors of the particles.
+    """
+    vecs = [lorentz(p) for p in particles]
+    for (i, v) in enumerate(vecs):
+        if not all([close(x, y) for (x, y) in zip(kin.p4c(i), (v.Px(), v.Py(), v.Pz(), v.E()))]):
+            errors += ["particle {0}: {1}, expected {2}".format(i, kin.p4c(i), (v.Px(), v.Py(), v.Pz(), v.E()))]
+    masses = kin.pair_masses()
+    dr = kin.delta_r(kin)
+    ia, ib = np.triu_indices(len(vecs), 1)
+    pairs = kin.pair_masses(ia, ib)
+    for (k, (i, j)) in enumerate(zip(ia, ib)):
+        m = (vecs[i] + vecs[j]).M()
+        if not close(masses[i, j], m, 1e-6) or not close(pairs[k], m, 1e-6):
+            errors += ["pair ({0}, {1}): mass {2} and {3}, expected {4}".format(i, j, masses[i, j], pairs[k], m)]
+        if not close(dr[i, j], vecs[i].DeltaR(vecs[j]), 1e-6):
+            errors += ["pair ({0}, {1}): delta R {2}, expected {3}".format(i, j, dr[i, j], vecs[i].DeltaR(vecs[j]))]
+
+if __name__ == "__main__":
+    rng = random.Random(1)
+    errors = []
+
+    #phi on both sides of +-pi, to check the wrapping of delta R
+    jets = [Particle(rng.uniform(20, 200), rng.uniform(-2.5, 2.5), rng.choice([-1, 1]) * rng.uniform(2.8, 3.14),
+        rng.uniform(0, 20)) for i in range(6)
+    ]
+    leptons = [Particle(rng.uniform(20, 100), rng.uniform(-2.5, 2.5), rng.uniform(-3.14, 3.14), 0.0) for i in range(2)]
+    check_kinematics(Kinematics.of(jets), jets, errors)
+
+    #space-like momenta have a negative mass, as TLorentzVector.M
+    m = invariant_mass(np.array([1.0]), np.array([0.0]), np.array([0.0]), np.array([0.5]))[0]
+    print "space-like mass", m
+    if not close(m, ROOT.TLorentzVector(1.0, 0.0, 0.0, 0.5).M()):
+        errors += ["space-like mass {0}, expected {1}".format(m, ROOT.TLorentzVector(1.0, 0.0, 0.0, 0.5).M())]
+
+    #each particle is converted once, subsets and mixed lists reuse the arrays
+    cache = KinematicsCache()
+    Particle.reads = 0
+    kin_jets = cache.get(jets)
+    reads = Particle.reads
+    if cache.get(jets) is not kin_jets:
+        errors += ["the same list is converted again"]
+    subsets = [jets[4:1:-1], jets[::2], leptons + jets[:3] + leptons[:1], []]
+    for particles in subsets:
+        check_kinematics(cache.get(particles), particles, errors)
+    Particle.reads = 0
+    for particles in subsets:
+        cache.get(particles)
+    print "attribute reads", reads, "for the jets", Particle.reads, "for the subsets"
+    if reads != 4 * len(jets) or Particle.reads != 0:
+        errors += ["particles are converted more than once"]
+
+    if len(errors) > 0:
+        print "\n".join(errors[:20])
+        print "FAILED"
+        sys.exit(1)
+    print "OK"
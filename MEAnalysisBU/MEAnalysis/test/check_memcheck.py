@@ -0,0 +1,43 @@
+"""
+Checks that memcheck.proxy_counts finds the proxies of C++ objects leaked
+into python containers and instance attributes.
+
+Usage:
+python test/check_memcheck.py
+"""
+import sys
+import ROOT
+
+from TTH.MEAnalysis.memcheck import proxy_counts
+
+class Holder(object):
+    pass
+
+def leak(n):
+    held = []
+    for i in range(n):
+        held += [ROOT.TLorentzVector(i, 0, 0, i)]
+    holder = Holder()
+    holder.vector = ROOT.TVector3(1, 2, 3)
+    return held, holder
+
+if __name__ == "__main__":
+    n = 100
+    before = proxy_counts()
+    held, holder = leak(n)
+    after = proxy_counts()
+
+    nvec = after.get("TLorentzVector", 0) - before.get("TLorentzVector", 0)
+    n3 = after.get("TVector3", 0) - before.get("TVector3", 0)
+    print "leaked TLorentzVector counted", nvec, "of", n
+    print "leaked TVector3 counted", n3, "of", 1
+    if nvec != n or n3 != 1:
+        print "FAILED"
+        sys.exit(1)
+    del held, holder
+    released = proxy_counts().get("TLorentzVector", 0) - before.get("TLorentzVector", 0)
+    print "TLorentzVector after release", released
+    if released != 0:
+        print "FAILED"
+        sys.exit(1)
+    print "OK"
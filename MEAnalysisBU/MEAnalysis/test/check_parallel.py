@@ -0,0 +1,104 @@
+"""
+Checks the splitting of an entry range into shards, the reporting of
+failed tasks and the merging of the shard outputs of TTH.MEAnalysis.parallel.
+
+Usage:
+python test/check_parallel.py
+"""
+import array, os, pickle, shutil, sys, tempfile
+import ROOT
+
+from PhysicsTools.HeppyCore.statistics.counter import Counters
+from TTH.MEAnalysis.looper import read_counters
+from TTH.MEAnalysis.parallel import shard_ranges, run_tasks, merge_shards
+
+def square(i):
+    if i == 2:
+        raise ValueError("task 2 fails")
+    return i * i
+
+def write_shard(path, first, n):
+    """
+    Writes the output tree and the counters of a shard processing the
+    entries first..first+n-1.
+    """
+    os.makedirs(os.path.join(path, "tree"))
+    of = ROOT.TFile(os.path.join(path, "tree", "tree.root"), "RECREATE")
+    tree = ROOT.TTree("tree", "tree")
+    ientry = array.array("i", [0])
+    tree.Branch("ientry", ientry, "ientry/I")
+    for i in range(first, first + n):
+        ientry[0] = i
+        tree.Fill()
+    of.Write()
+    of.Close()
+
+    counters = Counters()
+    counters.addCounter("processing")
+    counters["processing"].register("processed")
+    counters["processing"].register("passes")
+    counters["processing"].inc("processed", n)
+    counters["processing"].inc("passes", n / 2)
+    os.makedirs(os.path.join(path, "ana"))
+    of = open(os.path.join(path, "checkpoint_counters.pck"), "wb")
+    pickle.dump({"ana": counters}, of)
+    of.close()
+
+def count(counter, level):
+    #the items of a heppy Counter are [level, count]
+    return counter[level][1]
+
+if __name__ == "__main__":
+    errors = []
+
+    #contiguous shards covering the range, differing by at most one entry
+    for (first, end, nshards) in [(0, 10, 3), (5, 105, 7), (0, 2, 4), (3, 3, 2)]:
+        ranges = shard_ranges(first, end, nshards)
+        print "shard_ranges", first, end, nshards, ranges
+        entries = []
+        for (start, n) in ranges:
+            entries += range(start, start + n)
+        sizes = [n for (start, n) in ranges]
+        if entries != range(first, end) or max(sizes) - min(sizes) > 1:
+            errors += ["shard_ranges({0}, {1}, {2}) = {3}".format(first, end, nshards, ranges)]
+
+    #results in task order, the failed task is reported and the others complete
+    out = run_tasks(square, 5, 2)
+    print "run_tasks", [ret for (ret, error) in out]
+    if [ret for (ret, error) in out] != [0, 1, None, 9, 16]:
+        errors += ["run_tasks results {0}".format(out)]
+    if out[2][1] is None or not "task 2 fails" in out[2][1]:
+        errors += ["run_tasks did not report the failed task"]
+
+    #the shard outputs are merged in shard order and the counters are summed
+    tmp = tempfile.mkdtemp()
+    ranges = shard_ranges(0, 25, 3)
+    shard_dirs = []
+    for (i, (first, n)) in enumerate(ranges):
+        shard_dirs += [os.path.join(tmp, "shard_{0}".format(i))]
+        write_shard(shard_dirs[-1], first, n)
+    name = os.path.join(tmp, "merged")
+    os.makedirs(name)
+    merge_shards(name, shard_dirs)
+
+    inf = ROOT.TFile(os.path.join(name, "tree", "tree.root"))
+    tree = inf.Get("tree")
+    entries = []
+    for i in range(int(tree.GetEntries())):
+        tree.GetEntry(i)
+        entries += [tree.ientry]
+    inf.Close()
+    print "merged entries", len(entries)
+    if entries != range(25):
+        errors += ["merged tree entries {0}".format(entries)]
+    merged = read_counters(name)["ana"]["processing"]
+    print "merged counters", count(merged, "processed"), count(merged, "passes")
+    if count(merged, "processed") != 25 or count(merged, "passes") != sum([n / 2 for (first, n) in ranges]):
+        errors += ["merged counters {0}".format(merged)]
+    shutil.rmtree(tmp)
+
+    if len(errors) > 0:
+        print "\n".join(errors)
+        print "FAILED"
+        sys.exit(1)
+    print "OK"
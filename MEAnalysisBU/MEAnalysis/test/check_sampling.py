@@ -0,0 +1,50 @@
+"""
+Checks that entrylists.sample_entries draws reproducible, stratified
+subsets of the entries.
+
+Usage:
+python test/check_sampling.py
+"""
+import sys
+import numpy as np
+
+from TTH.MEAnalysis.entrylists import sample_entries
+
+if __name__ == "__main__":
+    errors = []
+
+    #unstratified: n distinct sorted entries, the same for the same seed
+    a = sample_entries(1000, 100, 5)
+    b = sample_entries(1000, 100, 5)
+    c = sample_entries(1000, 100, 6)
+    print "unstratified", len(a), a[:5]
+    if len(a) != 100 or len(np.unique(a)) != 100 or not np.all(np.diff(a) > 0):
+        errors += ["not 100 distinct sorted entries"]
+    if a.min() < 0 or a.max() >= 1000:
+        errors += ["entries out of range"]
+    if not np.array_equal(a, b):
+        errors += ["not reproducible for the same seed"]
+    if np.array_equal(a, c):
+        errors += ["the same subset for different seeds"]
+
+    #all the entries if n is not smaller than their number
+    if not np.array_equal(sample_entries(10, 20, 1), np.arange(10)):
+        errors += ["n >= entries does not return all the entries"]
+
+    #stratified: the strata are sampled in proportion to their size, with
+    #the largest remainders rounded up
+    keys = np.array([4] * 500 + [5] * 300 + [6] * 150 + [7] * 50)
+    np.random.RandomState(1).shuffle(keys)
+    s = sample_entries(keys, 111, 3)
+    counts = dict([(k, int((keys[s] == k).sum())) for k in [4, 5, 6, 7]])
+    print "stratified", counts
+    if counts != {4: 55, 5: 33, 6: 17, 7: 6}:
+        errors += ["stratum sizes {0}".format(counts)]
+    if not np.array_equal(s, sample_entries(keys, 111, 3)):
+        errors += ["stratified sampling is not reproducible"]
+
+    if len(errors) > 0:
+        print "\n".join(errors)
+        print "FAILED"
+        sys.exit(1)
+    print "OK"
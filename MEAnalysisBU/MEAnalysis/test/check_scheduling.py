@@ -0,0 +1,84 @@
+"""
+Checks the dependency analysis and the ordering of TTH.MEAnalysis.scheduling
+on small sequences of declared and undeclared analyzers.
+
+Usage:
+python test/check_scheduling.py
+"""
+import sys
+
+from TTH.MEAnalysis.scheduling import overlap, order_segment, schedule_sequence, validate_sequence
+
+class Config(object):
+    """
+    Stands in for a heppy cfg.Analyzer.
+    """
+    def __init__(self, name, consumes=None, produces=None):
+        self.name = name
+        self.class_object = type(name, (object, ), {"consumes": consumes, "produces": produces})
+
+def names(sequence):
+    return [ana.name for ana in sequence]
+
+def check(label, value, expected, errors):
+    print label, value
+    if value != expected:
+        errors += ["{0}: {1}, expected {2}".format(label, value, expected)]
+
+if __name__ == "__main__":
+    errors = []
+
+    #names and patterns
+    for (a, b, expected) in [
+        ("nBCSVM", "nB*", True),
+        ("nB*", "nBCSVM", True),
+        ("numJets", "nB*", False),
+        ("nMatch*", "nMatch_*", True),
+        ("nMatch_*", "btag_*", False),
+        ("is_sl", "is_sl", True),
+        ("is_sl", "is_dl", False),
+    ]:
+        check("overlap({0}, {1})".format(a, b), overlap(a, b), expected, errors)
+
+    #the cheapest rejection per event runs first among the independent analyzers
+    evs = Config("evs", ["input"], ["Jet", "selLeptons"])
+    leps = Config("leps", ["selLeptons"], ["is_sl", "good_leptons"])
+    jets = Config("jets", ["Jet"], ["good_jets", "nB*"])
+    cat = Config("cat", ["is_sl", "nBCSVM"], ["cat"])
+    segment = [evs, leps, jets, cat]
+    profiles = {
+        "leps": {"wall_mean": 2e-4, "pass_rate": 0.5},
+        "jets": {"wall_mean": 1e-4, "pass_rate": 0.5},
+    }
+    check("no profiles", names(order_segment(segment, {})), ["evs", "leps", "jets", "cat"], errors)
+    check("profiles", names(order_segment(segment, profiles)), ["evs", "jets", "leps", "cat"], errors)
+
+    #an analyzer which never rejects stays in place
+    profiles["jets"]["pass_rate"] = 1.0
+    check("no rejection", names(order_segment(segment, profiles)), ["evs", "leps", "jets", "cat"], errors)
+    profiles["jets"]["pass_rate"] = 0.5
+
+    #write after read: an analyzer overwriting an attribute stays after its readers
+    reset = Config("reset", [], ["is_sl"])
+    check("write after read", names(order_segment([evs, leps, cat, reset], {"reset": {"wall_mean": 1e-6, "pass_rate": 0.1}})),
+        ["evs", "leps", "cat", "reset"], errors
+    )
+
+    #undeclared analyzers are barriers
+    tree = Config("tree")
+    check("barrier", names(schedule_sequence([evs, leps, jets, tree, cat], profiles)),
+        ["evs", "jets", "leps", "tree", "cat"], errors
+    )
+
+    #a missing producer is reported
+    try:
+        validate_sequence([leps, evs])
+        errors += ["validate_sequence accepted leps before evs"]
+    except ValueError as e:
+        print "invalid sequence:", str(e).splitlines()[-1]
+
+    if len(errors) > 0:
+        print "\n".join(errors)
+        print "FAILED"
+        sys.exit(1)
+    print "OK"
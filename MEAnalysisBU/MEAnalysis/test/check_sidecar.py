@@ -0,0 +1,106 @@
+"""
+Checks that the event results written by sidecar.SidecarWriter are
+restored by the SidecarTable of the written file.
+
+Usage:
+python test/check_sidecar.py
+"""
+import os, random, shutil, sys, tempfile
+
+from TTH.MEAnalysis.sidecar import SidecarWriter, load_sidecar, scalar_attributes
+
+class Conf(object):
+    jets = {"btagWPs": {"CSVM": ("btagCSV", 0.679), "CSVT": ("btagCSV", 0.898)}}
+
+class Object(object):
+    def __init__(self, **kwargs):
+        self.__dict__.update(kwargs)
+
+def make_input(rng, ievent):
+    """
+    Returns an event with the input collections only.
+    """
+    event = Object()
+    event.input = Object(run=1, lumi=ievent / 10, evt=1000 + ievent)
+    event.Jet = [Object(pt=rng.uniform(20, 200)) for i in range(rng.randint(0, 8))]
+    event.selLeptons = [Object(pt=rng.uniform(20, 200)) for i in range(rng.randint(0, 3))]
+    return event
+
+def add_results(rng, event):
+    """
+    Sets the results of the analyzers which are stored in the sidecar.
+    """
+    event.good_jets = [j for j in event.Jet if rng.random() < 0.7]
+    event.good_leptons = event.selLeptons[:1]
+    for j in event.good_jets:
+        j.btagFlag = float(rng.random() < 0.5)
+    event.btagged_jets = [j for j in event.good_jets if j.btagFlag > 0.5]
+    event.buntagged_jets = [j for j in event.good_jets if j.btagFlag < 0.5]
+    event.wquark_candidate_jets = set(event.buntagged_jets[:2])
+    event.is_sl = rng.random() < 0.5
+    event.numJets = len(event.good_jets)
+    event.Wmass = rng.uniform(0, 150)
+    event.cat = rng.choice(["cat1", "cat2", "NOCAT"])
+    event.cat_gen = rng.choice([None, "sl"])
+    event.nBCSVM = len(event.btagged_jets)
+    event.nMatch_wq = rng.randint(0, 2)
+    event.l_quarks_w = [Object(pt=rng.uniform(20, 100), eta=0.5, phi=1.0, mass=0.0, pdgId=1)
+        for i in range(rng.randint(0, 3))
+    ]
+
+def results(event):
+    """
+    Returns the stored attributes of an event, the objects as their
+    positions in the input collections and the generator particles by value.
+    """
+    ret = {}
+    for (name, dtype, default) in scalar_attributes(Conf):
+        ret[name] = getattr(event, name, default)
+    ret["good_jets"] = [event.Jet.index(j) for j in event.good_jets]
+    ret["good_leptons"] = [event.selLeptons.index(l) for l in event.good_leptons]
+    ret["btagFlag"] = [j.btagFlag for j in event.good_jets]
+    for l in ["btagged_jets", "buntagged_jets", "wquark_candidate_jets"]:
+        ret[l] = sorted([event.good_jets.index(j) for j in getattr(event, l)])
+    ret["l_quarks_w"] = [(q.pt, q.eta, q.pdgId) for q in event.l_quarks_w]
+    return ret
+
+if __name__ == "__main__":
+    sidecar_dir = tempfile.mkdtemp()
+    rng = random.Random(1)
+    writer = SidecarWriter(Conf)
+    events = []
+    for i in range(50):
+        event = make_input(rng, i)
+        add_results(rng, event)
+        writer.add(event)
+        events += [event]
+    writer.save(os.path.join(sidecar_dir, "sample", "0.npz"))
+
+    table = load_sidecar(sidecar_dir, "sample", Conf)
+    print "stored events", len(table)
+    errors = []
+    for event in events:
+        #a new event with the same inputs, as in the MEM-only job
+        restored = Object(input=event.input, Jet=event.Jet, selLeptons=event.selLeptons)
+        row = table.find(restored)
+        if row is None:
+            errors += ["event {0} not found".format(event.input.evt)]
+            continue
+        for j in event.Jet:
+            j.__dict__.pop("btagFlag", None)
+        table.read_event(restored, row)
+        expected, found = results(event), results(restored)
+        for (k, v) in expected.items():
+            if isinstance(v, float) and abs(v - found[k]) < 1e-9:
+                continue
+            if v != found[k]:
+                errors += ["event {0} {1}: {2} restored as {3}".format(event.input.evt, k, v, found[k])]
+    if table.find(Object(input=Object(run=2, lumi=0, evt=0))) is not None:
+        errors += ["found an event which was not stored"]
+    shutil.rmtree(sidecar_dir)
+
+    if len(errors) > 0:
+        print "\n".join(errors[:20])
+        print "FAILED"
+        sys.exit(1)
+    print "OK"
@@ -4,4 +4,12 @@ echo "TTH/MEAnalysis runtests.sh " $LOCAL_TEST_DIR
 cd $CMSSW_BASE/src/TTH/MEAnalysis
 $CMSSW_BASE/bin/$SCRAM_ARCH/MEAnalysis test/me_tthbb.py
 $CMSSW_BASE/bin/$SCRAM_ARCH/MEAnalysis test/me_ttbar.py
+python test/check_columnstore.py
+python test/check_sampling.py
+python test/check_scheduling.py
+python test/check_sidecar.py
+python test/check_memcheck.py
+python test/check_parallel.py
+python test/check_batch.py
+python test/check_kinematics.py
 exit 0
@@ -75,6 +75,10 @@ def Make_config():
     #   This number is not used if Use_limited_entries is set to False
     config['n_entries_limited'] = 100000
 
+    # If not None, the limited entries are a random subset spread over the
+    #   whole tree, reproducible with this seed, instead of the first entries
+    config['Sampling_seed'] = None
+
     # Specify whether to make a TF from E_mc to E_reco, or Pt_mc to Pt_reco
     config['Use_Pt'] = True
 
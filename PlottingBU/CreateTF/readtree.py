@@ -14,6 +14,7 @@ import ROOT
 import TTH.TTHNtupleAnalyzer.AccessHelpers as AH
 import pickle
 import copy
+import random
 
 from TFClasses import function
 
@@ -405,17 +406,26 @@ def Single_Bin_Fits():
     config['events_used'] = 0
 
     if config['Use_limited_entries']:
-        n_processed = config['n_entries_limited']
+        n_processed = min(config['n_entries_limited'], n_entries)
     else:
         n_processed = n_entries
-    print "Processing {0} events (out of {1} events)".format(n_processed, n_entries)
 
-    for i_event in range(n_processed):
+    # Take a seeded random subset of the entries instead of the first ones
+    if config['Use_limited_entries'] and config.get('Sampling_seed', None) != None:
+        entries = sorted(random.Random(config['Sampling_seed']).sample(
+            xrange(n_entries), n_processed))
+        print "Processing {0} events sampled with seed {1} (out of {2} events)".format(
+            n_processed, config['Sampling_seed'], n_entries)
+    else:
+        entries = range(n_processed)
+        print "Processing {0} events (out of {1} events)".format(n_processed, n_entries)
+
+    for (i_event, entry) in enumerate(entries):
 
         if not i_event % 5000:
             print "{0:.1f}%".format( 100.*i_event /n_processed)
 
-        input_tree.GetEntry( i_event )
+        input_tree.GetEntry( entry )
 
         if Use_mc_values:
             E_event = AH.getter(input_tree, config['mc_E_str'])